@@ -0,0 +1,275 @@
+import base64
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, NamedTuple, Tuple
+from urllib import parse
+
+from ghsearch.pagination import count_pages
+from ghsearch.ratelimit import RATE_LIMIT, resource_for
+from ghsearch.tarballs import git_blob_sha
+
+API_PREFIX = "/api/v3"
+MAX_PER_PAGE = 100
+NEEDLE = "special_var = 10"
+
+
+class FakeGitHubConfig(NamedTuple):
+    results: int = 300  # files matching the search query
+    repos: int = 10
+    archived_fraction: float = 0.2  # of the repositories
+    match_fraction: float = 0.5  # of the files, which contain NEEDLE
+    content_size: int = 4096  # bytes per file
+    latency: float = 0.0  # seconds added to each response
+    core_limit: int = 5000
+    search_limit: int = 30
+    graphql_limit: int = 5000
+    seed: int = 0
+
+
+class FakeFile(NamedTuple):
+    repo: str
+    path: str
+    sha: str
+    content: bytes
+
+
+def _build_content(rng: random.Random, size: int, matches: bool) -> bytes:
+    words = ["foo", "bar", "baz", "special_var", "=", "print()", "import os", "return", "# comment"]
+    lines: List[str] = []
+    length = len(NEEDLE) + 1 if matches else 0
+    while length < size:
+        line = " ".join(rng.choice(words) for _ in range(rng.randint(1, 8)))
+        lines.append(line)
+        length += len(line) + 1
+    if matches:
+        lines.insert(rng.randint(0, len(lines)), NEEDLE)
+    return "\n".join(lines).encode()
+
+
+class FakeGitHub:
+    """
+    A local stand-in for the parts of the GitHub API used by gh-search: code search, file contents, repositories, the
+    rate limit, and GraphQL lookups of archived repositories. Generated data is deterministic for a given config, each
+    request is counted per rate limit resource, and responses carry X-RateLimit-* headers drawn from the quotas.
+    """
+
+    def __init__(self, config: FakeGitHubConfig = FakeGitHubConfig()):
+        self.config = config
+        self.requests: Counter = Counter()
+        self._lock = threading.Lock()
+        self._remaining: Dict[str, int] = {}
+        self._reset = int(time.time()) + 3600
+        self.reset_counters()
+
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length)) if length else None
+                url = parse.urlsplit(self.path)
+                highlight = "text-match" in self.headers.get("Accept", "")
+                status, data, resource = fake.handle(url.path, parse.parse_qs(url.query), body, highlight)
+                if fake.config.latency:
+                    time.sleep(fake.config.latency)
+                payload = json.dumps(data).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                for name, value in fake.rate_limit_headers(resource).items():
+                    self.send_header(name, value)
+                if url.path.endswith("/search/code"):
+                    for name, value in fake.link_header(url.path, parse.parse_qs(url.query)).items():
+                        self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_POST = do_GET
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}{API_PREFIX}"
+        self._build_data()
+        threading.Thread(target=self.server.serve_forever, args=(0.01,), daemon=True).start()
+
+    def close(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset_counters(self) -> None:
+        with self._lock:
+            self.requests.clear()
+            self._remaining = {
+                "core": self.config.core_limit,
+                "search": self.config.search_limit,
+                "graphql": self.config.graphql_limit,
+            }
+
+    def quota_used(self) -> Dict[str, int]:
+        limits = {
+            "core": self.config.core_limit,
+            "search": self.config.search_limit,
+            "graphql": self.config.graphql_limit,
+        }
+        with self._lock:
+            return {resource: limits[resource] - remaining for resource, remaining in self._remaining.items()}
+
+    def rate_limit_headers(self, resource: str) -> Dict[str, str]:
+        if resource == RATE_LIMIT:
+            return {}
+        limit = getattr(self.config, f"{resource}_limit")
+        return {
+            "X-RateLimit-Limit": str(limit),
+            "X-RateLimit-Remaining": str(max(self._remaining[resource], 0)),
+            "X-RateLimit-Reset": str(self._reset),
+            "X-RateLimit-Resource": "code_search" if resource == "search" else resource,  # as named by GitHub
+        }
+
+    def link_header(self, path: str, query: Dict[str, List[str]]) -> Dict[str, str]:
+        """
+        PyGithub iterates over search results by following the next link. Like GitHub, the last link stops at the
+        1000th result, however many results there are.
+        """
+        page, per_page = self._page(query)
+        last_page = count_pages(len(self._results), per_page)
+        if page >= last_page:
+            return {}
+        params = {name: values[0] for name, values in query.items()}
+        links = [
+            f'<{self.url.removesuffix(API_PREFIX)}{path}?{parse.urlencode({**params, "page": number})}>; rel="{rel}"'
+            for rel, number in (("next", page + 1), ("last", last_page))
+        ]
+        return {"Link": ", ".join(links)}
+
+    def handle(
+        self, path: str, query: Dict[str, List[str]], body: Any = None, highlight: bool = False
+    ) -> Tuple[int, Any, str]:
+        resource = resource_for(path)
+        with self._lock:
+            self.requests[resource] += 1
+            if resource != RATE_LIMIT:
+                self._remaining[resource] -= 1
+        path = path.removeprefix(API_PREFIX)
+        if resource == RATE_LIMIT:
+            return 200, self._rate_limit(), resource
+        if resource == "graphql":
+            return 200, self._graphql(body["variables"]), resource
+        if path == "/search/code":
+            term = query.get("q", [""])[0].split(" ")[0]
+            return 200, self._search(*self._page(query), term if highlight else None), resource
+        parts = path.strip("/").split("/", 4)
+        if len(parts) == 3 and parts[0] == "repos":
+            full_name = f"{parts[1]}/{parts[2]}"
+            if full_name in self._repos:
+                return 200, self._repos[full_name], resource
+        if len(parts) == 5 and parts[0] == "repos" and parts[3] == "contents":
+            file = self._files.get((f"{parts[1]}/{parts[2]}", parts[4]))
+            if file:
+                return 200, self._content(file), resource
+        return 404, {"message": "Not Found"}, resource
+
+    def _build_data(self) -> None:
+        rng = random.Random(self.config.seed)
+        archived = set(rng.sample(range(self.config.repos), int(self.config.repos * self.config.archived_fraction)))
+        self._repos: Dict[str, Dict[str, Any]] = {}
+        for i in range(self.config.repos):
+            full_name = f"org/repo{i}"
+            self._repos[full_name] = {
+                "id": i,
+                "name": f"repo{i}",
+                "full_name": full_name,
+                "owner": {"login": "org"},
+                "html_url": f"https://github.com/{full_name}",
+                "url": f"{self.url}/repos/{full_name}",
+                "fork": False,
+                "archived": i in archived,
+                "default_branch": "main",
+            }
+        self._files: Dict[Tuple[str, str], FakeFile] = {}
+        self._results: List[FakeFile] = []
+        for i in range(self.config.results):
+            repo = f"org/repo{i % self.config.repos}"
+            content = _build_content(rng, self.config.content_size, rng.random() < self.config.match_fraction)
+            file = FakeFile(repo, f"src/file{i}.py", git_blob_sha(content), content)
+            self._files[(repo, file.path)] = file
+            self._results.append(file)
+
+    @staticmethod
+    def _page(query: Dict[str, List[str]]) -> Tuple[int, int]:
+        return int(query.get("page", ["1"])[0]), min(int(query.get("per_page", ["30"])[0]), MAX_PER_PAGE)
+
+    def _search(self, page: int, per_page: int, highlight_term: str | None = None) -> Dict[str, Any]:
+        items = []
+        for file in self._results[(page - 1) * per_page : page * per_page]:  # noqa: E203
+            item: Dict[str, Any] = {
+                "name": file.path.rpartition("/")[2],
+                "path": file.path,
+                "sha": file.sha,
+                "url": f"{self.url}/repos/{file.repo}/contents/{file.path}?ref={file.sha}",
+                "html_url": f"https://github.com/{file.repo}/blob/{file.sha}/{file.path}",
+                "repository": self._repos[file.repo],
+            }
+            if highlight_term is not None:
+                item["text_matches"] = self._text_matches(file, highlight_term)
+            items.append(item)
+        return {"total_count": len(self._results), "incomplete_results": False, "items": items}
+
+    @staticmethod
+    def _text_matches(file: FakeFile, term: str) -> List[Dict[str, Any]]:
+        """Like GitHub, a fragment of the lines around the first occurrence of the term"""
+        lines = file.content.decode().split("\n")
+        for i, line in enumerate(lines):
+            if term in line:
+                fragment = "\n".join(lines[max(i - 1, 0) : i + 2])  # noqa: E203
+                return [{"property": "content", "fragment": fragment, "matches": []}]
+        return []
+
+    def _content(self, file: FakeFile) -> Dict[str, Any]:
+        return {
+            "type": "file",
+            "name": file.path.rpartition("/")[2],
+            "path": file.path,
+            "sha": file.sha,
+            "size": len(file.content),
+            "encoding": "base64",
+            "content": base64.b64encode(file.content).decode(),
+            "url": f"{self.url}/repos/{file.repo}/contents/{file.path}?ref={file.sha}",
+            "html_url": f"https://github.com/{file.repo}/blob/{file.sha}/{file.path}",
+        }
+
+    def _rate_limit(self) -> Dict[str, Any]:
+        with self._lock:
+            resources = {
+                resource: {
+                    "limit": getattr(self.config, f"{resource}_limit"),
+                    "remaining": max(remaining, 0),
+                    "reset": self._reset,
+                    "used": getattr(self.config, f"{resource}_limit") - remaining,
+                }
+                for resource, remaining in self._remaining.items()
+            }
+        return {"resources": resources, "rate": resources["core"]}
+
+    def _graphql(self, variables: Dict[str, str]) -> Dict[str, Any]:
+        data = {}
+        for name, owner in variables.items():
+            if name.startswith("owner"):
+                i = name.removeprefix("owner")
+                repo = self._repos.get(f"{owner}/{variables[f'name{i}']}")
+                data[f"repo{i}"] = repo and {
+                    "isArchived": repo["archived"],
+                    "isFork": repo["fork"],
+                    "url": repo["html_url"],
+                    "owner": repo["owner"],
+                }
+        return {"data": data}
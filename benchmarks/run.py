@@ -0,0 +1,170 @@
+import json
+import time
+import tracemalloc
+from io import BytesIO, TextIOWrapper
+from typing import Any, Callable, Dict, List, NamedTuple, Tuple
+from unittest.mock import patch
+
+import click
+
+from benchmarks.fake_github import NEEDLE, FakeGitHub, FakeGitHubConfig
+from ghsearch.client import RESULTS_PER_PAGE, Client, build_client
+from ghsearch.defaults import BACKENDS, PYGITHUB_BACKEND
+from ghsearch.filters import ContentFilter, Filter, NotArchivedFilter, PathFilter, RegexContentFilter
+from ghsearch.gh_search import GHSearch
+from ghsearch.output import printer_factory, printers_list
+from ghsearch.ratelimit import RateLimitScheduler
+from ghsearch.repositories import ArchivedStatusResolver
+
+QUERY = ["special_var"]
+REGEX = r"special_var\s*=\s*10"
+
+SCENARIOS: Dict[str, Callable[[Client], List[Filter]]] = {
+    "search": lambda client: [],
+    "path": lambda client: [PathFilter("file1")],
+    "archived": lambda client: [NotArchivedFilter(ArchivedStatusResolver(client))],
+    "content": lambda client: [ContentFilter(NEEDLE)],
+    "regex": lambda client: [RegexContentFilter(REGEX)],
+    "archived+regex": lambda client: [NotArchivedFilter(ArchivedStatusResolver(client)), RegexContentFilter(REGEX)],
+}
+
+
+class Measurement(NamedTuple):
+    name: str
+    results: int
+    seconds: float
+    peak_memory_kb: int
+    requests: int
+    core: int
+    search: int
+    graphql: int
+
+
+def _measure(fake: FakeGitHub, fn: Callable[[], Any]) -> Tuple[Any, float, int, Dict[str, int]]:
+    fake.reset_counters()
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        value = fn()
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return value, elapsed, peak, fake.quota_used()
+
+
+def benchmark_search(fake: FakeGitHub, client: Client, name: str, jobs: int) -> Tuple[Measurement, List[Any]]:
+    """Runs GHSearch.get_filtered_results with the filters of a scenario"""
+    scheduler = RateLimitScheduler(max_core_fraction=1.0)  # never stop to ask
+    gh_search = GHSearch(client, SCENARIOS[name](client), jobs=jobs, scheduler=scheduler)
+    results, seconds, peak, quota = _measure(fake, lambda: gh_search.get_filtered_results(QUERY))
+    return Measurement(name, len(results), seconds, peak // 1024, sum(fake.requests.values()), **quota), results
+
+
+def benchmark_printer(fake: FakeGitHub, name: str, results: List[Any]) -> Measurement:
+    """Prints results with a printer; printers may still make requests, for attributes search results lack"""
+    stream = TextIOWrapper(BytesIO(), encoding="utf-8")  # with a buffer, for the binary printers
+    _, seconds, peak, quota = _measure(fake, lambda: printer_factory(name, stream).print(QUERY, results))
+    return Measurement(f"print {name}", len(results), seconds, peak // 1024, sum(fake.requests.values()), **quota)
+
+
+def _echo_table(measurements: List[Measurement]) -> None:
+    headers = ["benchmark", "results", "seconds", "peak KiB", "requests", "core", "search", "graphql"]
+    rows: List[List[Any]] = [headers, *([m.name, m.results, f"{m.seconds:.3f}", *m[3:]] for m in measurements)]
+    widths = [max(len(str(row[i])) for row in rows) for i in range(len(headers))]
+    for row in rows:
+        click.echo(
+            "  ".join(
+                str(cell).ljust(width) if i == 0 else str(cell).rjust(width)
+                for i, (cell, width) in enumerate(zip(row, widths))
+            )
+        )
+
+
+@click.command(
+    help="Measures gh-search end to end against a local fake GitHub API: the wall time, requests, rate limit quota and"
+    " peak (python) memory of filtering search results with each scenario's filters, and of each printer.",
+    context_settings={"max_content_width": 120},
+)
+@click.option("--results", help="Number of search results.", type=click.IntRange(min=1), default=100)
+@click.option(
+    "--repos", help="Number of repositories the results are spread over.", type=click.IntRange(min=1), default=10
+)
+@click.option(
+    "--archived-fraction", help="Fraction of archived repositories.", type=click.FloatRange(0, 1), default=0.2
+)
+@click.option(
+    "--match-fraction", help="Fraction of files the content filters match.", type=click.FloatRange(0, 1), default=0.5
+)
+@click.option("--content-size", help="Size of each file in bytes.", type=click.IntRange(min=0), default=4096)
+@click.option("--latency", help="Seconds added to each response.", type=click.FloatRange(min=0), default=0.005)
+@click.option(
+    "--per-page",
+    help="Search results requested per page.",
+    type=click.IntRange(1, RESULTS_PER_PAGE),
+    default=RESULTS_PER_PAGE,
+)
+@click.option("-j", "--jobs", help="Number of results to filter concurrently.", type=click.IntRange(min=1), default=1)
+@click.option("--backend", type=click.Choice(BACKENDS), default=PYGITHUB_BACKEND)
+@click.option(
+    "-s",
+    "--scenario",
+    help="Scenario to run; repeatable (default: all of them)",
+    type=click.Choice(list(SCENARIOS)),
+    multiple=True,
+)
+@click.option("--json-output", help="Also write the measurements to this json file.", type=click.File("w"))
+def main(
+    results,
+    repos,
+    archived_fraction,
+    match_fraction,
+    content_size,
+    latency,
+    per_page,
+    jobs,
+    backend,
+    scenario,
+    json_output,
+):
+    config = FakeGitHubConfig(results, repos, archived_fraction, match_fraction, content_size, latency)
+    fake = FakeGitHub(config)
+    measurements = []
+
+    def run(name: str) -> List[Any]:
+        # a fresh client per scenario, so that none benefits from the connections or caches of another
+        client = build_client("token", fake.url, jobs if jobs > 1 else None, backend)
+        try:
+            measurement, filtered = benchmark_search(fake, client, name, jobs)
+            measurements.append(measurement)
+            if name == "search":
+                for printer in printers_list():
+                    try:
+                        measurements.append(benchmark_printer(fake, printer, filtered))
+                    except click.UsageError as e:  # eg. an optional dependency isn't installed
+                        click.echo(f"Skipping print {printer}: {e.message}", err=True)
+        finally:
+            client.close()
+        return filtered
+
+    try:
+        with patch("ghsearch.client.RESULTS_PER_PAGE", per_page):
+            for name in scenario or SCENARIOS:
+                run(name)
+    finally:
+        fake.close()
+
+    _echo_table(measurements)
+    if json_output:
+        json.dump(
+            {
+                "config": {**config._asdict(), "per_page": per_page, "jobs": jobs, "backend": backend},
+                "measurements": [m._asdict() for m in measurements],
+            },
+            json_output,
+            indent=2,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,502 @@
+import asyncio
+import base64
+import json
+import ssl
+import threading
+import time
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import Any, Coroutine, Dict, Iterator, List, NamedTuple, Tuple, TypeVar
+from urllib import parse, request
+
+from github.Consts import DEFAULT_TIMEOUT
+from github.Requester import Requester
+
+from ghsearch.cache import ResponseCache, cache_key, is_cacheable_url, is_conditional
+from ghsearch.defaults import DEFAULT_MAX_IN_FLIGHT
+from ghsearch.pagination import count_pages
+from ghsearch.ratelimit import RateLimitScheduler, resource_for
+from ghsearch.stats import RunStats
+
+DEFAULT_BASE_URL = "https://api.github.com"
+TEXT_MATCH_MEDIA_TYPE = "application/vnd.github.text-match+json"
+REDIRECT_STATUSES = (301, 307, 308)  # not 302, which the tarball api answers with the download url
+MAX_REDIRECTS = 5
+
+T = TypeVar("T")
+
+_Connection = Tuple[asyncio.StreamReader, asyncio.StreamWriter]
+
+
+class Response(NamedTuple):
+    status: int
+    headers: Dict[str, str]
+    body: bytes
+
+    def json(self) -> Any:
+        return json.loads(self.body) if self.body else None
+
+
+def environment_proxy(scheme: str, host: str) -> str | None:
+    """Returns the proxy set for scheme by the environment (eg. HTTPS_PROXY), unless NO_PROXY bypasses it for host"""
+    if request.proxy_bypass(host):
+        return None
+    return request.getproxies().get(scheme)
+
+
+class ConnectionPool:
+    """
+    Reuses HTTP/1.1 keep-alive connections to a single host, with at most max_in_flight requests at a time. Connecting,
+    and each request, time out after `timeout` seconds (like PyGithub) so that a stalled connection can't hang the run.
+    With a proxy, https connections are tunnelled through it with CONNECT, and http requests are sent to it.
+    """
+
+    def __init__(
+        self,
+        scheme: str,
+        host: str,
+        port: int | None,
+        max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+        timeout: float = DEFAULT_TIMEOUT,
+        proxy: str | None = None,
+    ):
+        default_port = 443 if scheme == "https" else 80
+        self.host = host
+        self.port = port or default_port
+        self.ssl = ssl.create_default_context() if scheme == "https" else None
+        self.timeout = timeout
+        self.proxy = parse.urlsplit(proxy if "://" in proxy else f"http://{proxy}") if proxy else None
+        host_name = f"[{host}]" if ":" in host else host  # an IPv6 address
+        self.address = f"{host_name}:{self.port}"
+        self.authority = host_name if self.port == default_port else self.address
+        self.connections_opened = 0
+        self._idle: List[_Connection] = []
+        self._in_flight = asyncio.Semaphore(max_in_flight)
+
+    async def request(self, method: str, target: str, headers: Dict[str, str], body: bytes | None = None) -> Response:
+        async with self._in_flight:
+            reused = bool(self._idle)
+            connection = self._idle.pop() if reused else await self._connect()
+            try:
+                response, keep_alive = await self._send(connection, method, target, headers, body)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                connection[1].close()
+                if not reused:
+                    raise
+                # the server may have closed the idle connection in the meantime
+                connection = await self._connect()
+                response, keep_alive = await self._send(connection, method, target, headers, body)
+
+            if keep_alive:
+                self._idle.append(connection)
+            else:
+                connection[1].close()
+            return response
+
+    async def close(self) -> None:
+        while self._idle:
+            _, writer = self._idle.pop()
+            writer.close()
+
+    async def _connect(self) -> _Connection:
+        self.connections_opened += 1
+        return await asyncio.wait_for(self._open_connection(), self.timeout)
+
+    async def _open_connection(self) -> _Connection:
+        if not self.proxy:
+            return await asyncio.open_connection(self.host, self.port, ssl=self.ssl)
+        reader, writer = await asyncio.open_connection(self.proxy.hostname, self.proxy.port or 80)
+        if not self.ssl:
+            return reader, writer
+        lines = [f"CONNECT {self.address} HTTP/1.1", f"Host: {self.address}", *self._proxy_headers()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        await writer.drain()
+        response, _ = await self._read_response(reader, "CONNECT")
+        if response.status != 200:
+            writer.close()
+            raise ConnectionRefusedError(f"Proxy refused to connect to {self.address}: {response.status}")
+        await writer.start_tls(self.ssl, server_hostname=self.host)
+        return reader, writer
+
+    def _proxy_headers(self) -> List[str]:
+        if not self.proxy or not self.proxy.username:
+            return []
+        credentials = f"{parse.unquote(self.proxy.username)}:{parse.unquote(self.proxy.password or '')}"
+        return [f"Proxy-Authorization: Basic {base64.b64encode(credentials.encode()).decode()}"]
+
+    async def _send(
+        self, connection: _Connection, method: str, target: str, headers: Dict[str, str], body: bytes | None
+    ) -> Tuple[Response, bool]:
+        try:
+            return await asyncio.wait_for(self._exchange(connection, method, target, headers, body), self.timeout)
+        except TimeoutError:
+            connection[1].close()  # a response may still arrive, so the connection can't be reused
+            raise
+
+    async def _exchange(
+        self, connection: _Connection, method: str, target: str, headers: Dict[str, str], body: bytes | None
+    ) -> Tuple[Response, bool]:
+        reader, writer = connection
+        if self.proxy and not self.ssl:
+            # plain http requests are sent to the proxy, with the absolute url as target
+            lines = [f"{method} http://{self.authority}{target} HTTP/1.1", f"Host: {self.authority}"]
+            lines += self._proxy_headers()
+        else:
+            lines = [f"{method} {target} HTTP/1.1", f"Host: {self.authority}"]
+        lines += [f"{name}: {value}" for name, value in headers.items()]
+        lines.append(f"Content-Length: {len(body or b'')}")
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + (body or b""))
+        await writer.drain()
+        return await self._read_response(reader, method)
+
+    @staticmethod
+    async def _read_response(reader: asyncio.StreamReader, method: str) -> Tuple[Response, bool]:
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError("Connection closed by server")
+        version, status_code, *_ = status_line.decode("latin-1").split(" ", 2)
+        status = int(status_code)
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+        if method == "HEAD" or (method == "CONNECT" and status == 200) or status in (204, 304) or status < 200:
+            body = b""
+        elif headers.get("transfer-encoding", "").lower() == "chunked":
+            body = await ConnectionPool._read_chunked(reader)
+        elif "content-length" in headers:
+            body = await reader.readexactly(int(headers["content-length"]))
+        else:
+            body = await reader.read()
+            keep_alive = False
+        return Response(status, headers, body), keep_alive
+
+    @staticmethod
+    async def _read_chunked(reader: asyncio.StreamReader) -> bytes:
+        chunks: List[bytes] = []
+        while True:
+            size = int((await reader.readline()).split(b";")[0].strip(), 16)
+            if size == 0:
+                while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass
+                return b"".join(chunks)
+            chunks.append(await reader.readexactly(size))
+            await reader.readline()
+
+
+class AsyncGitHubClient:
+    """A thin asyncio GitHub REST client, covering only the endpoints gh-search needs"""
+
+    def __init__(
+        self,
+        token: str,
+        base_url: str = DEFAULT_BASE_URL,
+        per_page: int = 100,
+        max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+        response_cache: ResponseCache | None = None,
+        scheduler: RateLimitScheduler | None = None,
+        stats: RunStats | None = None,
+        timeout: float = DEFAULT_TIMEOUT,
+    ):
+        url = parse.urlsplit(base_url)
+        self.per_page = per_page
+        self._scheme = url.scheme
+        self.response_cache = response_cache
+        self.scheduler = scheduler
+        self.stats = stats
+        self._prefix = url.path.rstrip("/")
+        self._graphql_path = Requester.get_graphql_prefix(url.path)
+        host = url.hostname or ""
+        proxy = environment_proxy(url.scheme, host)
+        self._pool = ConnectionPool(url.scheme, host, url.port, max_in_flight, timeout, proxy)
+        self._headers = {
+            "Authorization": f"token {token}",
+            "User-Agent": "gh-search",
+            "Accept": "application/vnd.github+json",
+            "Connection": "keep-alive",
+        }
+
+    @property
+    def connections_opened(self) -> int:
+        return self._pool.connections_opened
+
+    async def request_json(
+        self,
+        method: str,
+        url: str,
+        params: Dict[str, Any] | None = None,
+        body: Any = None,
+        headers: Dict[str, str] | None = None,
+    ) -> Any:
+        response = await self.request(method, url, params, headers, json.dumps(body).encode() if body else None)
+        data = response.json()
+        if response.status >= 400:
+            raise Requester.createException(response.status, response.headers, data)
+        return data
+
+    async def conditional_get(self, url: str, etag: str | None = None) -> Tuple[Any, str | None]:
+        response = await self.request("GET", url, headers={"If-None-Match": etag} if etag else None)
+        if response.status == 304:
+            return None, etag
+        data = response.json()
+        if response.status >= 400:
+            raise Requester.createException(response.status, response.headers, data)
+        return data, response.headers.get("etag")
+
+    async def request(
+        self,
+        method: str,
+        url: str,
+        params: Dict[str, Any] | None = None,
+        headers: Dict[str, str] | None = None,
+        body: bytes | None = None,
+    ) -> Response:
+        target = self._target(url)
+        if params:
+            target += ("&" if "?" in target else "?") + parse.urlencode(params)
+        for _ in range(MAX_REDIRECTS):
+            response = await self._request_target(method, target, headers, body)
+            if response.status not in REDIRECT_STATUSES or "location" not in response.headers:
+                return response
+            # eg. a renamed or transferred repository, which is redirected to by its id
+            target = self._redirect_target(response.headers["location"])
+        raise RuntimeError(f"Github server redirected {method} {target} more than {MAX_REDIRECTS} times")
+
+    async def _request_target(
+        self, method: str, target: str, headers: Dict[str, str] | None, body: bytes | None
+    ) -> Response:
+        headers = {**self._headers, **(headers or {})}
+        if method != "GET" or not self.response_cache or is_conditional(headers) or not is_cacheable_url(target):
+            return await self._send(method, target, headers, body)
+
+        key = cache_key(f"{self._pool.host}:{self._pool.port}", target, headers)
+        cached = self.response_cache.get(key)
+        headers = {**headers, **(cached.validators if cached else {})}
+        response = await self._send(method, target, headers, body)
+        if response.status == 304 and cached:
+            self.response_cache.record_not_modified()
+            return Response(200, *cached.refresh(response.headers))
+        if response.status == 200:
+            self.response_cache.put(key, response.headers, response.body)
+        return response
+
+    async def _send(self, method: str, target: str, headers: Dict[str, str], body: bytes | None) -> Response:
+        if not self.scheduler:
+            return await self._timed_request(method, target, headers, body)
+        resource = resource_for(target)
+        attempt = 0
+        while True:
+            await asyncio.sleep(self.scheduler.reserve(resource))
+            response = await self._timed_request(method, target, headers, body)
+            delay = self.scheduler.record(resource, response.status, response.headers, response.body, attempt)
+            if delay is None:
+                return response
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def _timed_request(self, method: str, target: str, headers: Dict[str, str], body: bytes | None) -> Response:
+        if not self.stats:
+            return await self._pool.request(method, target, headers, body)
+        start = time.perf_counter()
+        response = await self._pool.request(method, target, headers, body)
+        self.stats.record_request(method, target, response.status, len(response.body), time.perf_counter() - start)
+        return response
+
+    async def search_code(self, query: str, page: int = 1, highlight: bool = False) -> Dict:
+        params = {"q": query, "per_page": self.per_page, "page": page}
+        headers = {"Accept": TEXT_MATCH_MEDIA_TYPE} if highlight else None
+        return await self.request_json("GET", "/search/code", params, headers=headers)
+
+    async def get_repo(self, full_name: str) -> Dict:
+        return await self.request_json("GET", f"/repos/{full_name}")
+
+    async def get_blob(self, full_name: str, sha: str) -> Dict:
+        return await self.request_json("GET", f"/repos/{full_name}/git/blobs/{sha}")
+
+    async def get_tarball_url(self, full_name: str, ref: str | None = None) -> str:
+        response = await self.request("GET", f"/repos/{full_name}/tarball/{ref or ''}".rstrip("/"))
+        if response.status >= 400:
+            raise Requester.createException(response.status, response.headers, response.json())
+        return response.headers["location"]
+
+    async def get_rate_limit(self) -> Dict:
+        return await self.request_json("GET", "/rate_limit")
+
+    async def graphql(self, query: str, variables: Dict[str, Any]) -> Dict:
+        return await self.request_json("POST", self._graphql_path, body={"query": query, "variables": variables})
+
+    async def close(self) -> None:
+        await self._pool.close()
+
+    def _redirect_target(self, location: str) -> str:
+        """Like PyGithub, only follows redirects to the same server"""
+        url = parse.urlsplit(location)
+        if url.scheme and url.scheme != self._scheme:
+            raise RuntimeError(f"Github server redirected from {self._scheme} protocol to {url.scheme}")
+        if url.hostname and url.hostname != self._pool.host:
+            raise RuntimeError(f"Github server redirected from host {self._pool.host} to {url.hostname}")
+        return url.path + (f"?{url.query}" if url.query else "")
+
+    def _target(self, url: str) -> str:
+        if url == self._graphql_path:
+            return url
+        if url.startswith("/"):
+            return self._prefix + url
+        parts = parse.urlsplit(url)
+        return parts.path + (f"?{parts.query}" if parts.query else "")
+
+
+def _decode_content(data: Dict) -> bytes:
+    if data.get("encoding") == "base64":
+        return base64.b64decode(data["content"])
+    return (data.get("content") or "").encode("utf-8")
+
+
+class AsyncGithub:
+    """
+    Runs an AsyncGitHubClient on a background event loop, and exposes the subset of github.Github used by gh-search.
+    Calls block the calling thread only, so requests made from several threads run concurrently.
+    """
+
+    def __init__(
+        self,
+        token: str,
+        base_url: str | None = None,
+        per_page: int = 100,
+        max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+        response_cache: ResponseCache | None = None,
+        scheduler: RateLimitScheduler | None = None,
+        stats: RunStats | None = None,
+        timeout: float = DEFAULT_TIMEOUT,
+    ):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="gh-search-async-client", daemon=True)
+        self._thread.start()
+        self.api = AsyncGitHubClient(
+            token, base_url or DEFAULT_BASE_URL, per_page, max_in_flight, response_cache, scheduler, stats, timeout
+        )
+
+    @property
+    def per_page(self) -> int:
+        return self.api.per_page
+
+    def run(self, coroutine: Coroutine[Any, Any, T]) -> T:
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    def get_rate_limit(self) -> Any:
+        resources = self.run(self.api.get_rate_limit())["resources"]
+        return SimpleNamespace(core=_build_rate(resources["core"]), search=_build_rate(resources["search"]))
+
+    def graphql(self, query: str, variables: Dict[str, Any]) -> Dict:
+        return self.run(self.api.graphql(query, variables))
+
+    def conditional_get(self, url: str, etag: str | None = None) -> Tuple[Any, str | None]:
+        return self.run(self.api.conditional_get(url, etag))
+
+    def tarball_url(self, full_name: str, ref: str | None = None) -> str:
+        return self.run(self.api.get_tarball_url(full_name, ref))
+
+    def search_code(self, query: str, highlight: bool = False) -> "AsyncSearchResults":
+        return AsyncSearchResults(self, query, highlight)
+
+    def close(self) -> None:
+        self.run(self.api.close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+
+def _build_rate(rate: Dict) -> SimpleNamespace:
+    reset = datetime.fromtimestamp(rate["reset"], tz=timezone.utc)
+    return SimpleNamespace(remaining=rate["remaining"], limit=rate["limit"], reset=reset)
+
+
+class AsyncSearchResults:
+    def __init__(self, client: AsyncGithub, query: str, highlight: bool = False):
+        self._client = client
+        self._query = query
+        self._highlight = highlight
+        self._first_page: Dict | None = None
+
+    @property
+    def totalCount(self) -> int:
+        return self._get_first_page()["total_count"]
+
+    def get_page(self, page: int) -> List[Any]:
+        data = (
+            self._get_first_page()
+            if page == 0
+            else self._client.run(self._client.api.search_code(self._query, page + 1, self._highlight))
+        )
+        return [AsyncContentFile(self._client, item) for item in data["items"]]
+
+    def __iter__(self) -> Iterator[Any]:
+        per_page = self._client.per_page
+        for page in range(count_pages(self.totalCount, per_page)):
+            items = self.get_page(page)
+            yield from items
+            if len(items) < per_page:
+                return
+
+    def _get_first_page(self) -> Dict:
+        if self._first_page is None:
+            self._first_page = self._client.run(self._client.api.search_code(self._query, 1, self._highlight))
+        return self._first_page
+
+
+class AsyncRepository:
+    def __init__(self, client: AsyncGithub, attributes: Dict):
+        self._client = client
+        self._attributes = attributes
+        self._lock = threading.Lock()
+        self.full_name: str = attributes["full_name"]
+        self.name: str = attributes["name"]
+        self.html_url: str = attributes["html_url"]
+        self.fork: bool = attributes["fork"]
+        self.owner = SimpleNamespace(login=attributes["owner"]["login"])
+
+    @property
+    def archived(self) -> bool:
+        return self._complete()["archived"]
+
+    def _complete(self) -> Dict:
+        with self._lock:
+            if "archived" not in self._attributes:
+                self._attributes = self._client.run(self._client.api.get_repo(self.full_name))
+        return self._attributes
+
+
+class AsyncContentFile:
+    def __init__(self, client: AsyncGithub, attributes: Dict):
+        self._client = client
+        self._attributes = attributes
+        self._lock = threading.Lock()
+        self.path: str = attributes["path"]
+        self.name: str = attributes["name"]
+        self.sha: str = attributes["sha"]
+        self.html_url: str = attributes["html_url"]
+        self.text_matches: List[Dict] | None = attributes.get("text_matches")
+        self.repository = AsyncRepository(client, attributes["repository"])
+
+    @property
+    def size(self) -> int:
+        return self._complete()["size"]
+
+    @property
+    def decoded_content(self) -> bytes:
+        data = self._complete()
+        if data.get("encoding") == "none":  # files larger than 1MB are only available via the blobs api
+            data = self._client.run(self._client.api.get_blob(self.repository.full_name, self.sha))
+        return _decode_content(data)
+
+    def _complete(self) -> Dict:
+        with self._lock:
+            if "size" not in self._attributes:
+                self._attributes = self._client.run(self._client.api.request_json("GET", self._attributes["url"]))
+        return self._attributes
@@ -0,0 +1,126 @@
+import os
+import re
+import shlex
+from typing import IO, Any, Dict, List, NamedTuple, Sequence
+
+import click
+from github.GithubException import GithubException
+
+from ghsearch.defaults import DEFAULT_ENCODING, DEFAULT_PREFETCH_PAGES
+from ghsearch.gh_search import CORE_CALLS_RELATIVE_LIMIT
+from ghsearch.main import Session
+from ghsearch.output import printer_extension, printer_factory, printers_list
+from ghsearch.ratelimit import BudgetExceededException
+
+# batches run unattended, so rather than asking, they stop short of the core api rate limit
+BATCH_MAX_CORE_FRACTION = 1 - CORE_CALLS_RELATIVE_LIMIT
+
+_unsafe_name_re = re.compile(r"[^\w.-]+")
+
+
+class QuerySpec(NamedTuple):
+    name: str
+    query: List[str]
+    output: str = "default"
+    path_filter: str | None = None
+    content_filter: str | Sequence[str] | None = None
+    regex_content_filter: str | Sequence[str] | None = None
+    include_archived: bool = False
+    shard: bool = False
+    match_any: bool = False
+    encoding: str = DEFAULT_ENCODING
+    show_matches: bool = False
+    context: int | None = None
+
+
+def _build_spec(index: int, entry: Any, defaults: Dict[str, Any]) -> QuerySpec:
+    if isinstance(entry, str):
+        entry = {"query": entry}
+    if not isinstance(entry, dict):
+        raise click.UsageError(f"Query {index + 1} must be a string or a mapping")
+    fields = {**defaults, **entry}
+    unknown = set(fields) - set(QuerySpec._fields)
+    if unknown:
+        raise click.UsageError(f"Query {index + 1} has unknown keys: {', '.join(sorted(unknown))}")
+    if not fields.get("query"):
+        raise click.UsageError(f"Query {index + 1} has no query")
+    query = fields["query"]
+    fields["query"] = shlex.split(query) if isinstance(query, str) else [str(term) for term in query]
+    fields["name"] = _unsafe_name_re.sub("_", str(fields.get("name") or f"query{index + 1}"))
+    if fields.get("output", "default") not in printers_list():
+        raise click.UsageError(f"Query {index + 1} output must be one of: {', '.join(printers_list())}")
+    return QuerySpec(**fields)
+
+
+def load_specs(stream: IO) -> List[QuerySpec]:
+    """
+    Reads a yaml list of queries, or a mapping with `queries` and optional `defaults` for them. Each query is either a
+    string or a mapping of a `query` with a `name` and the filter and output options of gh-search.
+    """
+    from ruamel.yaml import YAML
+
+    data = YAML(typ="safe", pure=True).load(stream)
+    if isinstance(data, list):
+        data = {"queries": data}
+    if not isinstance(data, dict) or not isinstance(data.get("queries"), list):
+        raise click.UsageError("The queries file must contain a list of queries")
+    defaults = data.get("defaults") or {}
+    specs = [_build_spec(index, entry, defaults) for index, entry in enumerate(data["queries"])]
+    names = [spec.name for spec in specs]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise click.UsageError(f"Query names must be unique: {', '.join(duplicates)}")
+    return specs
+
+
+def run_batch(
+    specs: List[QuerySpec],
+    session: Session,
+    output_dir: str,
+    verbose: bool = False,
+    prefetch_pages: int = DEFAULT_PREFETCH_PAGES,
+    state_dir: str | None = None,
+) -> None:
+    """
+    Runs each query in turn on the same session, so that the client, caches and core api budget are shared, and
+    writes its results to `<output_dir>/<name>.<extension>`. A failing query is reported and the batch carries on,
+    unless the budget is used up. With a `state_dir`, each query keeps its state in `<state_dir>/<name>.json`.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    failed: List[str] = []
+    for spec in specs:
+        path = os.path.join(output_dir, f"{spec.name}.{printer_extension(spec.output)}")
+        click.echo(f"Running {spec.name}: {' '.join(spec.query)}", err=True)
+        try:
+            with open(path, "w") as stream:
+                session.search(
+                    spec.query,
+                    printer_factory(spec.output, stream),
+                    spec.path_filter,
+                    spec.content_filter,
+                    spec.regex_content_filter,
+                    spec.include_archived,
+                    verbose,
+                    prefetch_pages,
+                    spec.shard,
+                    spec.match_any,
+                    spec.encoding,
+                    spec.show_matches,
+                    spec.context,
+                    os.path.join(state_dir, f"{spec.name}.json") if state_dir else None,
+                )
+            if session.budget_exceeded:
+                raise session.budget_exceeded
+        except BudgetExceededException as ex:
+            raise click.ClickException(f"{ex}; stopped at {spec.name}")
+        except click.ClickException as ex:
+            failed.append(spec.name)
+            click.echo(f"Error: {spec.name} failed: {ex.format_message()}", err=True)
+        except GithubException as ex:
+            failed.append(spec.name)
+            click.echo(f"Error: {spec.name} failed: {ex}", err=True)
+
+    if verbose:
+        session.echo_stats()
+    if failed:
+        raise click.ClickException(f"{len(failed)} of {len(specs)} queries failed: {', '.join(failed)}")
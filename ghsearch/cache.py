@@ -0,0 +1,177 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+from typing import Dict, List, Mapping, NamedTuple, Tuple
+
+RESPONSE_CACHE_SHARE = 0.5  # of the max cache size, the rest is for file contents
+
+_TMP_SUFFIX = ".tmp"
+_EVICT_TO = 0.9  # of max_size, so that evicting (which walks the whole cache) is rare rather than done on every put
+
+_sha_re = re.compile(r"[0-9a-f]{40}|[0-9a-f]{64}")
+# file contents are kept by the blob cache, so responses with them aren't cached again
+_contents_url_re = re.compile(r"/repos/[^/]+/[^/]+/(contents|git/blobs)/")
+
+VARYING_HEADERS = ("accept",)  # request headers which change the response, eg. the text-match media type
+_BODY_HEADERS = ("content-length", "content-encoding", "transfer-encoding")
+
+
+class BlobCache:
+    """
+    On-disk cache of file contents keyed by git blob sha. Blobs are immutable, so entries never go stale; the least
+    recently used ones are evicted once the cache grows beyond max_size bytes, down to 90% of it.
+    """
+
+    def __init__(self, directory: str, max_size: int):
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        # totalled by the first put, as only puts need it: runs which only read the cache don't walk it
+        self._size: int | None = None
+
+    @staticmethod
+    def is_cacheable(sha: str | None) -> bool:
+        return isinstance(sha, str) and bool(_sha_re.fullmatch(sha))
+
+    def get(self, sha: str) -> bytes | None:
+        if not self.is_cacheable(sha):
+            return None
+        path = self._path(sha)
+        try:
+            with open(path, "rb") as f:
+                content = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return content
+
+    def contains(self, sha: str | None) -> bool:
+        return sha is not None and self.is_cacheable(sha) and os.path.exists(self._path(sha))
+
+    def put(self, sha: str, content: bytes, replace: bool = False) -> None:
+        if not self.is_cacheable(sha) or len(content) > self.max_size:
+            return
+        path = self._path(sha)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=_TMP_SUFFIX)
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, _, size in self._entries())
+            if os.path.exists(path):
+                if not replace:
+                    os.remove(tmp_path)
+                    return
+                self._size -= os.path.getsize(path)
+            os.replace(tmp_path, path)
+            self._size += len(content)
+            if self._size > self.max_size:
+                self._size = self._evict(self._size)
+
+    def _path(self, sha: str) -> str:
+        return os.path.join(self.directory, sha[:2], sha[2:])
+
+    def _entries(self) -> List[Tuple[float, str, int]]:
+        entries = []
+        for dirpath, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                if filename.endswith(_TMP_SUFFIX):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, path, stat.st_size))
+        return entries
+
+    def _evict(self, total_size: int) -> int:
+        """Removes the least recently used entries, and returns the size of those left"""
+        target = self.max_size * _EVICT_TO
+        for _, path, size in sorted(self._entries()):
+            if total_size <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            total_size -= size
+        return total_size
+
+
+def is_conditional(headers: Dict[str, str] | None) -> bool:
+    return any(name.lower() in ("if-none-match", "if-modified-since") for name in headers or {})
+
+
+def is_cacheable_url(url: str) -> bool:
+    return not _contents_url_re.search(url)
+
+
+def cache_key(address: str, url: str, headers: Mapping[str, str] | None) -> str:
+    """Keys a GET request by its url, and the request headers that change the response"""
+    headers = {name.lower(): value for name, value in (headers or {}).items()}
+    return address + url + "".join(f"\n{name}: {headers[name]}" for name in VARYING_HEADERS if name in headers)
+
+
+class CachedResponse(NamedTuple):
+    headers: Dict[str, str]
+    body: bytes
+
+    @property
+    def validators(self) -> Dict[str, str]:
+        validators = {}
+        if "etag" in self.headers:
+            validators["If-None-Match"] = self.headers["etag"]
+        if "last-modified" in self.headers:
+            validators["If-Modified-Since"] = self.headers["last-modified"]
+        return validators
+
+    def refresh(self, headers: Mapping[str, str]) -> "CachedResponse":
+        """Updates the headers with those of a 304 revalidating the response, eg. the current X-RateLimit-* ones"""
+        fresh = {name.lower(): value for name, value in headers.items() if name.lower() not in _BODY_HEADERS}
+        return CachedResponse({**self.headers, **fresh}, self.body)
+
+
+class ResponseCache:
+    """
+    On-disk cache of GET responses carrying an ETag or Last-Modified header, so that repeating a request can be made
+    conditional and a 304 Not Modified answered from disk. Entries are namespaced (eg. by token), as responses differ
+    between users.
+    """
+
+    def __init__(self, directory: str, max_size: int, namespace: str = ""):
+        self._store = BlobCache(directory, max_size)
+        self._namespace = namespace
+        self._lock = threading.Lock()
+        self.not_modified = 0
+
+    def get(self, url: str) -> CachedResponse | None:
+        entry = self._store.get(self._key(url))
+        if entry is None:
+            return None
+        headers, _, body = entry.partition(b"\n")
+        return CachedResponse(json.loads(headers), body)
+
+    def put(self, url: str, headers: Dict[str, str], body: bytes) -> None:
+        headers = {name.lower(): value for name, value in headers.items()}
+        if "etag" not in headers and "last-modified" not in headers:
+            return
+        self._store.put(self._key(url), json.dumps(headers).encode() + b"\n" + body, replace=True)
+
+    def record_not_modified(self) -> None:
+        with self._lock:
+            self.not_modified += 1
+
+    def _key(self, url: str) -> str:
+        return hashlib.sha256(f"{self._namespace}\n{url}".encode()).hexdigest()
@@ -3,8 +3,20 @@ import os
 import click
 import click_config_file
 
-from ghsearch.main import run
+from ghsearch.defaults import (
+    BACKENDS,
+    DEFAULT_CACHE_MAX_SIZE_MB,
+    DEFAULT_ENCODING,
+    DEFAULT_MAX_IN_FLIGHT,
+    DEFAULT_PREFETCH_PAGES,
+    DEFAULT_REPO_CACHE_TTL,
+    PYGITHUB_BACKEND,
+)
 from ghsearch.output import Printer, printer_factory, printers_list
+from ghsearch.stats import collect_stats
+
+# the modules which make requests (and PyGithub, asyncio...) are imported by the commands which run them, so that
+# --help, --version and usage errors don't wait for them
 
 
 def _printer(ctx: click.Context, param: click.Parameter, value: str) -> Printer:
@@ -26,6 +38,175 @@ def _create_none_value_validator(message):
 
 _cmd_name = "gh-search"
 _config_file = os.path.join(click.get_app_dir(_cmd_name), "config")
+_cache_dir = os.path.join(click.get_app_dir(_cmd_name), "cache")
+_index_path = os.path.join(click.get_app_dir(_cmd_name), "index.sqlite")
+
+
+def _options(*options):
+    """Applies a group of options shared by several commands, in the order listed"""
+
+    def decorator(f):
+        for option in reversed(options):
+            f = option(f)
+        return f
+
+    return decorator
+
+
+_github_options = _options(
+    click.option(
+        "--github-token",
+        envvar="GITHUB_TOKEN",
+        help="GitHub Auth Token. Will fall back on GITHUB_TOKEN envvar.",
+        callback=_create_none_value_validator(
+            "GitHub token must be set via --github-token option or GITHUB_TOKEN envvar."
+        ),
+    ),
+    click.option(
+        "--github-api-url",
+        envvar="GITHUB_API_URL",
+        help="Override default GitHub API URL. Can also specify via GITHUB_API_URL envvar.",
+    ),
+)
+
+_session_options = _options(
+    click.option(
+        "--budget",
+        help="Make at most this many core api requests, instead of asking before potentially making many.",
+        type=click.IntRange(min=0),
+    ),
+    click.option(
+        "--max-core-fraction",
+        help="Use at most this fraction of the remaining core api quota, instead of asking before running low.",
+        type=click.FloatRange(min=0, max=1),
+    ),
+    click.option(
+        "-j",
+        "--jobs",
+        help="Number of results to filter concurrently.",
+        type=click.IntRange(min=1),
+        default=1,
+    ),
+    click.option(
+        "--prefetch-pages",
+        help="Number of search result pages to fetch ahead of filtering; 0 to disable"
+        f" (default: {DEFAULT_PREFETCH_PAGES})",
+        type=click.IntRange(min=0),
+        default=DEFAULT_PREFETCH_PAGES,
+    ),
+    click.option(
+        "--backend",
+        help=f"GitHub API client; the {BACKENDS[1]} client runs requests concurrently over pooled connections.",
+        type=click.Choice(BACKENDS),
+        default=PYGITHUB_BACKEND,
+    ),
+    click.option(
+        "--max-connections",
+        help=f"Maximum number of concurrent requests made by the async backend (default: {DEFAULT_MAX_IN_FLIGHT})",
+        type=click.IntRange(min=1),
+        default=DEFAULT_MAX_IN_FLIGHT,
+    ),
+    click.option(
+        "--tarball-threshold",
+        help="Read the files of repositories with more than this many results from a tarball of the repository,"
+        " instead of downloading each file.",
+        type=click.IntRange(min=0),
+    ),
+    click.option("--no-cache", help="Do not read or write the on-disk cache.", default=False, is_flag=True),
+    click.option(
+        "--cache-dir",
+        help=f"Directory in which to cache file contents and repository metadata (default: {_cache_dir})",
+        type=click.Path(file_okay=False),
+        default=_cache_dir,
+    ),
+    click.option(
+        "--cache-max-size",
+        help=f"Maximum size of the on-disk cache in MB (default: {DEFAULT_CACHE_MAX_SIZE_MB})",
+        type=click.IntRange(min=1),
+        default=DEFAULT_CACHE_MAX_SIZE_MB,
+    ),
+    click.option(
+        "--repo-cache-ttl",
+        help=f"Seconds for which cached repository metadata is used as is (default: {DEFAULT_REPO_CACHE_TTL})",
+        type=click.IntRange(min=0),
+        default=DEFAULT_REPO_CACHE_TTL,
+    ),
+    click.option(
+        "--stats",
+        "show_stats",
+        help="Print the time spent in each stage, filter and api endpoint, request latencies, and counters such as"
+        " cache hits, to stderr once done.",
+        default=False,
+        is_flag=True,
+    ),
+    click.option(
+        "--stats-json",
+        help="Write those stats as json to this file ('-' for stdout).",
+        type=click.Path(dir_okay=False, allow_dash=True),
+    ),
+    click.option(
+        "--profile",
+        help="Profile the run with cProfile (the main thread only), and write the profile to this file for pstats.",
+        type=click.Path(dir_okay=False),
+    ),
+)
+
+_filter_options = _options(
+    click.option("-p", "--path-filter", help="Exclude results whose path (or part of path) does not match this."),
+    click.option(
+        "-c", "--content-filter", help="Exclude results whose content does not match this. Repeatable.", multiple=True
+    ),
+    click.option(
+        "-e",
+        "--regex-content-filter",
+        help="Exclude results whose content does not match this regex. Repeatable.",
+        multiple=True,
+    ),
+    click.option(
+        "--match-any",
+        help="Keep results matching any of the content filters, rather than all of them.",
+        default=False,
+        is_flag=True,
+    ),
+    click.option(
+        "--encoding",
+        help="Encoding used to decode file contents, when content filters can't be matched against the raw bytes"
+        f" (default: {DEFAULT_ENCODING})",
+        default=DEFAULT_ENCODING,
+    ),
+    click.option(
+        "-n",
+        "--show-matches",
+        help="Show the line number and text of each content filter match (all results are downloaded).",
+        default=False,
+        is_flag=True,
+    ),
+    click.option(
+        "-C",
+        "--context",
+        help="Lines of context to show around each content filter match. Implies --show-matches.",
+        type=click.IntRange(min=0),
+    ),
+    click.option("-a", "--include-archived", help="Include results from archived repos.", default=False, is_flag=True),
+    click.option(
+        "-l",
+        "--repos-with-matches",
+        help="Only the names of repos are printed. Equivalent to --output=repo-list",
+        default=False,
+        is_flag=True,
+    ),
+    click.option(
+        "-o",
+        "--output",
+        help=f"Output style; one of: {', '.join(printers_list())}",
+        callback=_printer,
+        default="default",
+    ),
+)
+
+_config_option = click_config_file.configuration_option(
+    cmd_name=_cmd_name, help=f"Config file (default: {_config_file})", expose_value=True
+)
 
 
 @click.command(
@@ -34,61 +215,256 @@ _config_file = os.path.join(click.get_app_dir(_cmd_name), "config")
     context_settings={"max_content_width": 120},
 )
 @click.argument("QUERY", nargs=-1, required=True)
+@_github_options
+@_filter_options
 @click.option(
-    "--github-token",
-    envvar="GITHUB_TOKEN",
-    help="GitHub Auth Token. Will fall back on GITHUB_TOKEN envvar.",
-    callback=_create_none_value_validator("GitHub token must be set via --github-token option or GITHUB_TOKEN envvar."),
-)
-@click.option(
-    "--github-api-url",
-    envvar="GITHUB_API_URL",
-    help="Override default GitHub API URL. Can also specify via GITHUB_API_URL envvar.",
-)
-@click.option("-p", "--path-filter", help="Exclude results whose path (or part of path) does not match this.")
-@click.option("-c", "--content-filter", help="Exclude results whose content does not match this.")
-@click.option("-e", "--regex-content-filter", help="Exclude results whose content does not match this regex.")
-@click.option("-a", "--include-archived", help="Include results from archived repos.", default=False, is_flag=True)
-@click.option(
-    "-l",
-    "--repos-with-matches",
-    help="Only the names of repos are printed. Equivalent to --output=repo-list",
+    "--shard",
+    help="Split queries with more than 1000 results by file size, so that all of them are retrieved.",
     default=False,
     is_flag=True,
 )
 @click.option(
-    "-o", "--output", help=f"Output style; one of: {', '.join(printers_list())}", callback=_printer, default="default"
+    "--state",
+    help="Only print the results added, changed or removed since the last run with this state file, which is then"
+    " updated. Files which haven't changed are not downloaded again.",
+    type=click.Path(dir_okay=False),
 )
+@_session_options
 @click.option("-v", "--verbose", help="Verbose output.", default=False, is_flag=True)
 @click.version_option(package_name="gh-search")
-@click_config_file.configuration_option(
-    cmd_name="gh-search", help=f"Config file (default: {_config_file})", expose_value=True
-)
+@_config_option
 def cli(
     query,
     output,
     include_archived,
     verbose,
+    jobs,
+    prefetch_pages,
+    shard,
+    budget,
+    max_core_fraction,
+    backend,
+    max_connections,
+    tarball_threshold,
+    no_cache,
+    cache_dir,
+    cache_max_size,
+    repo_cache_ttl,
     config,
     github_token,
     github_api_url=None,
+    show_stats=False,
+    stats_json=None,
+    profile=None,
     path_filter=None,
-    content_filter=None,
-    regex_content_filter=None,
+    content_filter=(),
+    regex_content_filter=(),
+    match_any=False,
+    encoding=DEFAULT_ENCODING,
+    show_matches=False,
+    context=None,
+    state=None,
+    **_,
+):
+    from ghsearch.main import run
+
+    if verbose:
+        click.echo(f"Reading defaults from {config}")
+    with collect_stats(show_stats, stats_json, profile) as stats:
+        run(
+            query=query,
+            github_token=github_token,
+            printer=output,
+            github_api_url=github_api_url,
+            path_filter=path_filter,
+            content_filter=content_filter,
+            regex_content_filter=regex_content_filter,
+            include_archived=include_archived,
+            verbose=verbose,
+            jobs=jobs,
+            cache_dir=None if no_cache else cache_dir,
+            cache_max_size=cache_max_size,
+            repo_cache_ttl=repo_cache_ttl,
+            backend=backend,
+            max_connections=max_connections,
+            prefetch_pages=prefetch_pages,
+            shard=shard,
+            budget=budget,
+            max_core_fraction=max_core_fraction,
+            match_any=match_any,
+            encoding=encoding,
+            show_matches=show_matches,
+            context=context,
+            tarball_threshold=tarball_threshold,
+            state_path=state,
+            stats=stats,
+        )
+
+
+@click.command(
+    help="Runs each query in QUERIES_FILE (yaml) in one process, sharing the client, caches and rate limit budget"
+    " between them, and writes the results of each query to its own file in the output directory."
+    " See https://github.com/janeklb/gh-search#example-batch-mode for the file format.",
+    context_settings={"max_content_width": 120},
+)
+@click.argument("QUERIES_FILE", type=click.File("r"))
+@_github_options
+@click.option(
+    "-d",
+    "--output-dir",
+    help="Directory in which to write the results of each query (default: the current directory)",
+    type=click.Path(file_okay=False),
+    default=".",
+)
+@click.option(
+    "--state-dir",
+    help="Directory of state files, one per query, so that only the results added, changed or removed since the last"
+    " run are written (see --state of gh-search).",
+    type=click.Path(file_okay=False),
+)
+@_session_options
+@click.option("-v", "--verbose", help="Verbose output.", default=False, is_flag=True)
+@click.version_option(package_name="gh-search")
+@_config_option
+def batch_cli(
+    queries_file,
+    output_dir,
+    state_dir,
+    verbose,
+    jobs,
+    prefetch_pages,
+    budget,
+    max_core_fraction,
+    backend,
+    max_connections,
+    tarball_threshold,
+    no_cache,
+    cache_dir,
+    cache_max_size,
+    repo_cache_ttl,
+    config,
+    github_token,
+    github_api_url=None,
+    show_stats=False,
+    stats_json=None,
+    profile=None,
     **_,
 ):
+    from ghsearch.batch import BATCH_MAX_CORE_FRACTION, load_specs, run_batch
+    from ghsearch.main import Session
+
     if verbose:
         click.echo(f"Reading defaults from {config}")
-    run(
-        query=query,
-        github_token=github_token,
+    specs = load_specs(queries_file)
+    if budget is None and max_core_fraction is None:
+        max_core_fraction = BATCH_MAX_CORE_FRACTION
+    with collect_stats(show_stats, stats_json, profile) as stats:
+        session = Session(
+            github_token,
+            github_api_url,
+            jobs,
+            None if no_cache else cache_dir,
+            cache_max_size,
+            repo_cache_ttl,
+            backend,
+            max_connections,
+            budget,
+            max_core_fraction,
+            tarball_threshold,
+            stats,
+            prefetch_pages,
+        )
+        try:
+            run_batch(specs, session, output_dir, verbose, prefetch_pages, state_dir)
+        finally:
+            session.close()
+
+
+_index_path_option = click.option(
+    "--index-path",
+    help=f"SQLite database of the index (default: {_index_path})",
+    type=click.Path(dir_okay=False),
+    default=_index_path,
+)
+
+
+@click.group(
+    help="Builds a local index of the files of selected repositories, and answers queries (and regex content filters)"
+    " from it without using the GitHub API.",
+    context_settings={"max_content_width": 120},
+)
+@click.version_option(package_name="gh-search")
+def index_cli():
+    pass
+
+
+@index_cli.command(
+    help="Indexes the latest commit of the default branch of each REPOSITORY (owner/name), or of all the repositories"
+    " of an owner (organization or user). Without any, refreshes the repositories already indexed; only the ones"
+    " which changed are downloaded again.",
+    context_settings={"max_content_width": 120},
+)
+@click.argument("REPOSITORY", nargs=-1)
+@_github_options
+@_index_path_option
+@click.option("-v", "--verbose", help="Verbose output.", default=False, is_flag=True)
+@_config_option
+def update(repository, index_path, verbose, config, github_token, github_api_url=None, **_):
+    from ghsearch.main import run_index_update
+
+    run_index_update(github_token, index_path, repository, github_api_url, verbose)
+
+
+@index_cli.command(
+    help="QUERY may contain terms, all of which files must contain (ignoring case), and the qualifiers:"
+    " repo:, org:, user:, path:, filename: and extension:.",
+    context_settings={"max_content_width": 120},
+)
+@click.argument("QUERY", nargs=-1)
+@_index_path_option
+@_filter_options
+@click.option(
+    "-j",
+    "--jobs",
+    help="Number of results to filter concurrently.",
+    type=click.IntRange(min=1),
+    default=1,
+)
+@click.option("-v", "--verbose", help="Verbose output.", default=False, is_flag=True)
+@_config_option
+def search(
+    query,
+    index_path,
+    output,
+    include_archived,
+    verbose,
+    jobs,
+    config,
+    path_filter=None,
+    content_filter=(),
+    regex_content_filter=(),
+    match_any=False,
+    encoding=DEFAULT_ENCODING,
+    show_matches=False,
+    context=None,
+    **_,
+):
+    from ghsearch.main import run_index_search
+
+    run_index_search(
+        query=list(query),
+        index_path=index_path,
         printer=output,
-        github_api_url=github_api_url,
         path_filter=path_filter,
         content_filter=content_filter,
         regex_content_filter=regex_content_filter,
         include_archived=include_archived,
         verbose=verbose,
+        jobs=jobs,
+        match_any=match_any,
+        encoding=encoding,
+        show_matches=show_matches,
+        context=context,
     )
 
 
@@ -1,12 +1,264 @@
-from typing import Any, Dict
+import threading
+import time
+from functools import partial
+from typing import IO, TYPE_CHECKING, Any, Callable, Dict, ItemsView, Iterator, List, Tuple, Union
+from urllib.request import urlopen
 
 from github import Github
+from github.Consts import DEFAULT_TIMEOUT
+from github.PaginatedList import PaginatedList
+from github.Requester import HTTPRequestsConnectionClass, HTTPSRequestsConnectionClass, Requester
+from urllib3.util import Retry
+
+from ghsearch.cache import CachedResponse, ResponseCache, cache_key, is_cacheable_url, is_conditional
+from ghsearch.defaults import ASYNC_BACKEND, DEFAULT_MAX_IN_FLIGHT, PYGITHUB_BACKEND
+from ghsearch.pagination import count_pages
+from ghsearch.ratelimit import RateLimitScheduler
+from ghsearch.stats import RunStats
+
+if TYPE_CHECKING:
+    # imported by build_client only with its backend, which is what needs asyncio
+    from ghsearch.async_client import AsyncGithub
 
 RESULTS_PER_PAGE = 100  # this is the max - see https://docs.github.com/en/rest/reference/search#search-code--parameters
+# like PyGithub's default GithubRetry, but leaving rate limits (403) to the scheduler, so that they aren't retried twice
+SERVER_ERROR_RETRY = Retry(
+    status_forcelist=list(range(500, 600)), allowed_methods=Retry.DEFAULT_ALLOWED_METHODS.union({"GET", "POST"})
+)
+
+Client = Union[Github, "AsyncGithub"]
+
+
+def _thread_local_attribute(name: str) -> property:
+    def fget(self):
+        return getattr(self._thread_local, name)
+
+    def fset(self, value):
+        setattr(self._thread_local, name, value)
+
+    return property(fget, fset)
+
+
+class _ThreadSafeConnectionMixin:
+    """
+    PyGithub shares a single connection object per client, and stores the pending request on it between
+    ``request()`` and ``getresponse()``. Keeping that state per thread lets several threads share the client.
+    """
+
+    verb = _thread_local_attribute("verb")
+    url = _thread_local_attribute("url")
+    input = _thread_local_attribute("input")
+    headers = _thread_local_attribute("headers")
+
+    def __init__(self, *args, **kwargs):
+        self._thread_local = threading.local()
+        super().__init__(*args, **kwargs)
+
+
+class _ThreadSafeHTTPConnection(_ThreadSafeConnectionMixin, HTTPRequestsConnectionClass):  # type: ignore[misc]
+    pass
+
+
+class _ThreadSafeHTTPSConnection(_ThreadSafeConnectionMixin, HTTPSRequestsConnectionClass):  # type: ignore[misc]
+    pass
+
+
+class _CachedRequestsResponse:
+    # mimics github.Requester.RequestsResponse
+    def __init__(self, response: CachedResponse):
+        self.status = 200
+        self.headers = response.headers
+        self.text = response.body.decode("utf-8")
+
+    def getheaders(self) -> ItemsView[str, str]:
+        return self.headers.items()
+
+    def read(self) -> str:
+        return self.text
+
+
+def _cached_getresponse(connection: Any, getresponse: Callable[[], Any]) -> Any:
+    """Makes GET requests conditional on a previously cached response, and serves that response on a 304"""
+    cache: ResponseCache = connection.response_cache
+    if connection.verb != "GET" or is_conditional(connection.headers) or not is_cacheable_url(connection.url):
+        return getresponse()
+    key = cache_key(f"{connection.host}:{connection.port}", connection.url, connection.headers)
+    cached = cache.get(key)
+    if cached:
+        connection.headers = {**(connection.headers or {}), **cached.validators}
+    response = getresponse()
+    if response.status == 304 and cached:
+        cache.record_not_modified()
+        return _CachedRequestsResponse(cached.refresh(dict(response.getheaders())))
+    if response.status == 200:
+        cache.put(key, dict(response.getheaders()), response.read().encode("utf-8"))
+    return response
+
+
+def _timed_getresponse(connection: Any, getresponse: Callable[[], Any]) -> Any:
+    start = time.perf_counter()
+    response = getresponse()
+    seconds = time.perf_counter() - start
+    body = response.read()
+    size = len(body.encode("utf-8") if isinstance(body, str) else body or b"")
+    connection.stats.record_request(connection.verb, connection.url, response.status, size, seconds)
+    return response
+
+
+def _getresponse(connection: Any, getresponse: Callable[[], Any]) -> Any:
+    if connection.stats:
+        getresponse = partial(_timed_getresponse, connection, getresponse)
+    if connection.scheduler:
+        getresponse = partial(connection.scheduler.send, connection.url, getresponse)
+    if connection.response_cache:
+        return _cached_getresponse(connection, getresponse)
+    return getresponse()
+
+
+class _HookedHTTPConnection(_ThreadSafeHTTPConnection):
+    response_cache: ResponseCache | None = None
+    scheduler: RateLimitScheduler | None = None
+    stats: RunStats | None = None
 
+    def getresponse(self) -> Any:
+        return _getresponse(self, super().getresponse)
+
+
+class _HookedHTTPSConnection(_ThreadSafeHTTPSConnection):
+    response_cache: ResponseCache | None = None
+    scheduler: RateLimitScheduler | None = None
+    stats: RunStats | None = None
+
+    def getresponse(self) -> Any:
+        return _getresponse(self, super().getresponse)
+
+
+def _requester(client: Github) -> Requester:
+    return client._Github__requester  # type: ignore[attr-defined]
+
+
+def _install_connection_class(
+    client: Github,
+    response_cache: ResponseCache | None = None,
+    scheduler: RateLimitScheduler | None = None,
+    stats: RunStats | None = None,
+) -> None:
+    """
+    Makes the client's connection safe to share between threads, and hooks in the response cache, rate limit
+    scheduler and stats. The requester creates its own connections, so these are bound to a client specific subclass.
+    """
+    requester = _requester(client)
+    base = _HookedHTTPSConnection if requester.scheme == "https" else _HookedHTTPConnection
+    attributes = {"response_cache": response_cache, "scheduler": scheduler, "stats": stats}
+    connection_class = type(base.__name__, (base,), attributes)
+    requester._Requester__connectionClass = connection_class  # type: ignore[attr-defined]
+
+
+def build_client(
+    token: str,
+    base_url: str | None = None,
+    pool_size: int | None = None,
+    backend: str = PYGITHUB_BACKEND,
+    max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+    response_cache: ResponseCache | None = None,
+    scheduler: RateLimitScheduler | None = None,
+    stats: RunStats | None = None,
+    prefetch_pages: int = 0,
+) -> Client:
+    if backend == ASYNC_BACKEND:
+        from ghsearch.async_client import AsyncGithub
+
+        return AsyncGithub(token, base_url, RESULTS_PER_PAGE, max_in_flight, response_cache, scheduler, stats)
 
-def build_client(token: str, base_url: str | None = None) -> Github:
     client_params: Dict[str, Any] = {"per_page": RESULTS_PER_PAGE, "login_or_token": token}
     if base_url:
         client_params["base_url"] = base_url
-    return Github(**client_params)
+    if pool_size:
+        client_params["pool_size"] = pool_size
+    if scheduler:
+        client_params["retry"] = SERVER_ERROR_RETRY
+    client = Github(**client_params)
+    # prefetching fetches search result pages on a background thread while the calling thread filters results, so
+    # it needs the thread safe connection even without a pool
+    if (pool_size and pool_size > 1) or prefetch_pages > 0 or response_cache or scheduler or stats:
+        _install_connection_class(client, response_cache, scheduler, stats)
+    return client
+
+
+class _SearchResults:
+    """
+    PyGithub's PaginatedList counts results by the `last` link of a page of one result, which the search api caps at
+    1000 results. This reads `total_count` from the first page of results instead, and keeps that page.
+    """
+
+    def __init__(self, results: PaginatedList, per_page: int):
+        self._results = results
+        self._per_page = per_page
+        self._first_page: List[Any] | None = None
+        self._total_count = 0
+
+    @property
+    def totalCount(self) -> int:
+        self.get_page(0)
+        return self._total_count
+
+    def get_page(self, page: int) -> List[Any]:
+        if page != 0:
+            return self._results.get_page(page)
+        if self._first_page is None:
+            self._first_page = self._results.get_page(0)
+            self._total_count = self._results._PaginatedList__totalCount or 0  # type: ignore[attr-defined]
+        return self._first_page
+
+    def __iter__(self) -> Iterator[Any]:
+        for page in range(count_pages(self.totalCount, self._per_page)):
+            items = self.get_page(page)
+            yield from items
+            if len(items) < self._per_page:
+                return
+
+
+def search_code(client: Client, query: str, **params: Any) -> Any:
+    """Searches code, with the total count of results (rather than at most 1000 of them) on either backend"""
+    results = client.search_code(query=query, **params)
+    if isinstance(results, PaginatedList):
+        return _SearchResults(results, client.per_page)
+    return results
+
+
+def graphql_query(client: Client, query: str, variables: Dict[str, Any]) -> Dict[str, Any]:
+    """Returns the full GraphQL response, which may contain both (partial) data and errors"""
+    if not isinstance(client, Github):
+        return client.graphql(query, variables)
+    requester = _requester(client)
+    _, data = requester.requestJsonAndCheck(
+        "POST", requester.graphql_url, input={"query": query, "variables": variables}
+    )
+    return data
+
+
+def conditional_get(client: Client, url: str, etag: str | None = None) -> Tuple[Any, str | None]:
+    """
+    Returns the resource at url and its etag, or (None, etag) if it has not been modified since etag was issued.
+    GitHub does not count those 304 responses against the rate limit.
+    """
+    if not isinstance(client, Github):
+        return client.conditional_get(url, etag)
+    headers = {"If-None-Match": etag} if etag else None
+    response_headers, data = _requester(client).requestJsonAndCheck("GET", url, headers=headers)
+    if data is None:
+        return None, etag
+    return data, response_headers.get("etag")
+
+
+def tarball_url(client: Client, full_name: str, ref: str | None = None) -> str:
+    """Returns the (short-lived) download url of a tarball of a repository at ref, or its default branch"""
+    if not isinstance(client, Github):
+        return client.tarball_url(full_name, ref)
+    headers, _ = _requester(client).requestJsonAndCheck("GET", f"/repos/{full_name}/tarball/{ref or ''}".rstrip("/"))
+    return headers["location"]
+
+
+def open_tarball(url: str) -> IO[bytes]:
+    """Opens a tarball download url, timing out (like the api requests) rather than hanging on a stalled download"""
+    return urlopen(url, timeout=DEFAULT_TIMEOUT)
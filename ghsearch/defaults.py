@@ -0,0 +1,11 @@
+"""Defaults of command line options, kept apart from the modules using them so that the cli imports quickly"""
+
+PYGITHUB_BACKEND = "pygithub"
+ASYNC_BACKEND = "async"
+BACKENDS = [PYGITHUB_BACKEND, ASYNC_BACKEND]
+
+DEFAULT_MAX_IN_FLIGHT = 10
+DEFAULT_PREFETCH_PAGES = 2
+DEFAULT_CACHE_MAX_SIZE_MB = 512
+DEFAULT_ENCODING = "utf-8"
+DEFAULT_REPO_CACHE_TTL = 24 * 60 * 60
@@ -1,8 +1,24 @@
+import codecs
+import functools
 import re
+import string
+import threading
+from typing import Any, AnyStr, Dict, List, Sequence, Set, Tuple
 
 from github.ContentFile import ContentFile
 from github.GithubException import GithubException
 
+from ghsearch.cache import BlobCache
+from ghsearch.defaults import DEFAULT_ENCODING
+from ghsearch.repositories import ArchivedStatusResolver
+from ghsearch.results import LineMatch
+from ghsearch.tarballs import RepoTarballs
+
+# relative cost of checking a single result, used to decide which filters to run first
+COST_FREE = 0  # checks on the search result itself
+COST_PER_REPO = 1  # lookups shared by all results from the same repository
+COST_PER_RESULT = 10  # a download per result
+
 
 class FilterException(BaseException):
     def __init__(self, filter, message):
@@ -14,57 +30,403 @@ class Filter:
     """This filter uses the core api"""
 
     uses_core_api = True
+    uses_text_matches = False
+    cost = COST_PER_RESULT
+    avoided_core_calls = 0
 
     def __call__(self, result: ContentFile) -> bool:
         raise NotImplementedError
 
+    def prepare(self, results: List[ContentFile]) -> None:
+        """Called with each batch of results before they are filtered, so that lookups can be batched up front"""
+
+    def estimate_core_calls(self, num_results: int, sample: Sequence[ContentFile] = ()) -> int:
+        """`sample` holds the first results of the search, if available"""
+        return num_results if self.uses_core_api else 0
+
+
+def _text_match_fragments(result: ContentFile) -> List[str]:
+    text_matches: List[Dict[str, Any]] = result.text_matches or []  # type: ignore[assignment]
+    return [match["fragment"] for match in text_matches if match.get("property") == "content"]
+
+
+_context_dependent_re = re.compile(r"\\[AbBZ]|[\^$]|\(\?<?[=!]")
+_backreference_re = re.compile(r"\\[1-9]|\(\?P=")
+
+
+def _compile(filter: Filter, pattern: str) -> re.Pattern:
+    try:
+        return re.compile(pattern)
+    except re.error as e:
+        message = f"Failed to compile regular expression from '{pattern}': {e}"
+        raise FilterException(filter, message) from e
+
+
+@functools.lru_cache
+def is_ascii_compatible(encoding: str) -> bool:
+    """
+    Whether ASCII bytes only ever stand for ASCII text, so that ASCII patterns can be matched against the raw bytes:
+    true of UTF-8 and of single byte encodings such as latin-1, but not of eg. shift_jis, where the second byte of a
+    character can be an ASCII one
+    """
+    try:
+        if string.printable.encode(encoding) != string.printable.encode("ascii"):
+            return False
+        if codecs.lookup(encoding).name == "utf-8":
+            return True
+    except LookupError:
+        return False
+    # a single byte encoding decodes each byte on its own, where a multibyte (or stateful) one waits for the next
+    decoder = codecs.getincrementaldecoder(encoding)("replace")
+    return all(len(decoder.decode(bytes([byte]))) == 1 for byte in range(256))
+
+
+def _compile_bytes(pattern: re.Pattern[str], encoding: str) -> re.Pattern[bytes] | None:
+    if not pattern.pattern.isascii() or not is_ascii_compatible(encoding):
+        return None
+    try:
+        return re.compile(pattern.pattern.encode("ascii"), pattern.flags & ~re.UNICODE)
+    except re.error:
+        return None  # eg. \N{...} escapes, which are only supported by str patterns
+
+
+def _line_matches(content: Any, spans: Sequence[Tuple[int, int]], context: int, encoding: str) -> List[LineMatch]:
+    """Turns the offsets of matches in `content` (str or bytes) into lines, without splitting the whole content"""
+    newline = b"\n" if isinstance(content, bytes) else "\n"
+
+    def decode(text: Any) -> str:
+        text = text.decode(encoding, "replace") if isinstance(text, bytes) else text
+        return text.removesuffix("\r")
+
+    def line_bounds(offset: int) -> Tuple[int, int]:
+        end = content.find(newline, offset)
+        return content.rfind(newline, 0, offset) + 1, len(content) if end == -1 else end
+
+    line_matches = []
+    line, position = 1, 0
+    for start, _ in spans:
+        line += content.count(newline, position, start)
+        position = start
+        line_start, line_end = line_bounds(start)
+        before: List[str] = []
+        offset = line_start
+        while len(before) < context and offset > 0:
+            offset, previous_end = line_bounds(offset - 1)
+            before.insert(0, decode(content[offset:previous_end]))
+        after: List[str] = []
+        offset = line_end
+        while len(after) < context and offset + 1 < len(content):  # a trailing newline doesn't start a line
+            next_start, offset = line_bounds(offset + 1)
+            after.append(decode(content[next_start:offset]))
+        column = len(decode(content[line_start:start])) + 1
+        line_matches.append(LineMatch(line, column, decode(content[line_start:line_end]), before, after))
+    return line_matches
+
 
 class DecodedContentFilter(Filter):
+    """
+    Filters on file contents. Text match fragments returned with the search results are checked first: a match in a
+    fragment is a match in the file, so the download is skipped. Only inconclusive results are downloaded, and where
+    possible matched as raw bytes; otherwise they are decoded with `encoding`.
+
+    With `context` set, every match is reported on the result (see `get_line_matches`) with that many lines of context
+    around it. Fragments can't tell where a match is, so then every result is downloaded.
+
+    With `tarballs`, the contents of results from repositories with many results are read from their tarball.
+    """
+
+    uses_text_matches = True
+
+    def __init__(
+        self,
+        blob_cache: BlobCache | None = None,
+        encoding: str = DEFAULT_ENCODING,
+        context: int | None = None,
+        tarballs: RepoTarballs | None = None,
+    ):
+        try:
+            codecs.lookup(encoding)
+        except LookupError as e:
+            raise FilterException(self, f"Unknown encoding '{encoding}'") from e
+        self.blob_cache = blob_cache
+        self.encoding = encoding
+        self.context = context
+        self.tarballs = tarballs
+        self.uses_text_matches = context is None
+        self.avoided_core_calls = 0
+        self._lock = threading.Lock()
+
+    def matches_fragment(self, result: ContentFile) -> bool:
+        return any(self.matches_content(fragment) for fragment in _text_match_fragments(result))
+
+    def prepare(self, results: List[ContentFile]) -> None:
+        if self.tarballs:
+            self.tarballs.prepare([result for result in results if self._needs_download(result)])
+
+    def _needs_download(self, result: ContentFile) -> bool:
+        if self.uses_text_matches and self.matches_fragment(result):
+            return False
+        return not (self.blob_cache and self.blob_cache.contains(result.sha))
+
+    def estimate_core_calls(self, num_results: int, sample: Sequence[ContentFile] = ()) -> int:
+        if not sample or not self.uses_text_matches:
+            return num_results
+        matched = sum(1 for result in sample if self.matches_fragment(result))
+        return num_results - num_results * matched // len(sample)
+
     def __call__(self, result: ContentFile) -> bool:
+        if self.uses_text_matches and self.matches_fragment(result):
+            with self._lock:
+                self.avoided_core_calls += 1
+            return True
         try:
-            content = result.decoded_content.decode("utf-8")
-            return self.matches_content(content)
+            content = self._get_decoded_content(result)
         except GithubException as e:
             message = f"Error reading content from {result.repository.full_name}/{result.path}: {e.data['message']}"
             raise FilterException(self, message) from e
+        setattr(result, "content_size", len(content))
+        text: Any = content if self.can_match_bytes(content) else content.decode(self.encoding, "replace")
+        if self.context is None:
+            return self.matches_content(text)
+        spans = self.find_spans(text)
+        if spans:
+            setattr(result, "line_matches", _line_matches(text, spans, self.context, self.encoding))
+        return bool(spans)
 
-    def matches_content(self, content: str) -> bool:
+    def _get_decoded_content(self, result: ContentFile) -> bytes:
+        if self.blob_cache is None:
+            return self._download(result)
+        content = self.blob_cache.get(result.sha)
+        if content is None:
+            content = self._download(result)
+            self.blob_cache.put(result.sha, content)
+        return content
+
+    def _download(self, result: ContentFile) -> bytes:
+        content = self.tarballs.get(result.sha) if self.tarballs else None
+        return result.decoded_content if content is None else content
+
+    def can_match_bytes(self, content: bytes) -> bool:
+        """Whether the raw content can be matched as is, rather than decoded first (eg. not for non-ASCII patterns)"""
+        return False
+
+    def matches_content(self, content: AnyStr) -> bool:
+        raise NotImplementedError
+
+    def find_spans(self, content: AnyStr) -> List[Tuple[int, int]]:
+        """The offsets of all matches in the content, or none if it doesn't match"""
         raise NotImplementedError
 
 
 class ContentFilter(DecodedContentFilter):
-    def __init__(self, content_filter: str):
+    def __init__(
+        self,
+        content_filter: str,
+        blob_cache: BlobCache | None = None,
+        encoding: str = DEFAULT_ENCODING,
+        context: int | None = None,
+        tarballs: RepoTarballs | None = None,
+    ):
+        super().__init__(blob_cache, encoding, context, tarballs)
         self.content_filter = content_filter
+        self._content_filter_bytes = (
+            content_filter.encode("ascii") if content_filter.isascii() and is_ascii_compatible(encoding) else None
+        )
+
+    def _needle(self, content: AnyStr) -> Any:
+        return self._content_filter_bytes if isinstance(content, bytes) else self.content_filter
+
+    def can_match_bytes(self, content: bytes) -> bool:
+        return self._content_filter_bytes is not None
 
-    def matches_content(self, content: str) -> bool:
-        return self.content_filter in content
+    def matches_content(self, content: AnyStr) -> bool:
+        return self._needle(content) in content
+
+    def find_spans(self, content: AnyStr) -> List[Tuple[int, int]]:
+        needle = self._needle(content)
+        spans = []
+        start = content.find(needle)
+        while start != -1:
+            spans.append((start, start + len(needle)))
+            start = content.find(needle, start + max(len(needle), 1))
+        return spans
 
 
 class RegexContentFilter(DecodedContentFilter):
-    def __init__(self, content_filter: str):
+    def __init__(
+        self,
+        content_filter: str,
+        blob_cache: BlobCache | None = None,
+        encoding: str = DEFAULT_ENCODING,
+        context: int | None = None,
+        tarballs: RepoTarballs | None = None,
+    ):
+        super().__init__(blob_cache, encoding, context, tarballs)
+        self.content_filter_pattern = _compile(self, content_filter)
+        self._content_filter_bytes_pattern = _compile_bytes(self.content_filter_pattern, encoding)
+
+    def _pattern(self, content: AnyStr) -> Any:
+        return self._content_filter_bytes_pattern if isinstance(content, bytes) else self.content_filter_pattern
+
+    def can_match_bytes(self, content: bytes) -> bool:
+        # classes like \w and . only match the same text in bytes and str patterns if the content is ASCII
+        return self._content_filter_bytes_pattern is not None and content.isascii()
+
+    def matches_content(self, content: AnyStr) -> bool:
+        return bool(self._pattern(content).search(content))
+
+    def find_spans(self, content: AnyStr) -> List[Tuple[int, int]]:
+        return [match.span() for match in self._pattern(content).finditer(content)]
+
+    def matches_fragment(self, result: ContentFile) -> bool:
+        # anchors and lookarounds depend on text around the fragment, so a match in the fragment proves nothing
+        if _context_dependent_re.search(self.content_filter_pattern.pattern):
+            return False
+        return super().matches_fragment(result)
+
+
+class MultiPatternContentFilter(DecodedContentFilter):
+    """
+    Filters on several literals and regexes at once, keeping results that match all of them (or any, with
+    `match_any`). The patterns are compiled into a single alternation, so the content is decoded once and scanned in
+    one pass. Matches of different patterns can overlap, so a pattern the scan skipped over is checked on its own.
+    """
+
+    def __init__(
+        self,
+        content_filters: Sequence[str] = (),
+        regex_content_filters: Sequence[str] = (),
+        match_any: bool = False,
+        blob_cache: BlobCache | None = None,
+        encoding: str = DEFAULT_ENCODING,
+        context: int | None = None,
+        tarballs: RepoTarballs | None = None,
+    ):
+        super().__init__(blob_cache, encoding, context, tarballs)
+        self.match_any = match_any
+        self.patterns = [re.compile(re.escape(literal)) for literal in content_filters]
+        self.patterns += [_compile(self, pattern) for pattern in regex_content_filters]
+        # anchors and lookarounds depend on text around a fragment, so fragments can't settle those patterns
+        self._fragment_patterns = [
+            i
+            for i, pattern in enumerate(self.patterns)
+            if i < len(content_filters) or not _context_dependent_re.search(pattern.pattern)
+        ]
+        self.combined_pattern = self._combine(self.patterns)
+
+        # escaped literals match the same bytes whatever the content, regexes only if the content is ASCII
+        self._bytes_need_ascii_content = bool(regex_content_filters)
+        bytes_patterns = [_compile_bytes(pattern, encoding) for pattern in self.patterns]
+        self._bytes_patterns: List[re.Pattern[bytes]] | None = [
+            pattern for pattern in bytes_patterns if pattern is not None
+        ]
+        if len(self._bytes_patterns) < len(self.patterns):
+            self._bytes_patterns = None
+        self._combined_bytes_pattern = (
+            _compile_bytes(self.combined_pattern, encoding) if self.combined_pattern is not None else None
+        )
+
+    @staticmethod
+    def _combine(patterns: List[re.Pattern]) -> re.Pattern | None:
+        # numbered backreferences would point at the wrong group once wrapped in the alternation
+        if any(_backreference_re.search(pattern.pattern) for pattern in patterns):
+            return None
         try:
-            self.content_filter_pattern = re.compile(content_filter)
-        except re.error as e:
-            message = f"Failed to compile regular expression from '{content_filter}': {e}"
-            raise FilterException(self, message) from e
+            return re.compile("|".join(f"(?P<p{i}>{pattern.pattern})" for i, pattern in enumerate(patterns)))
+        except re.error:
+            return None  # eg. inline flags which are only allowed at the start of a pattern
+
+    def _is_settled(self, found: Set[int]) -> bool:
+        return bool(found) if self.match_any else len(found) == len(self.patterns)
+
+    def _patterns_for(self, content: AnyStr) -> Tuple[re.Pattern | None, Sequence[re.Pattern]]:
+        if isinstance(content, bytes):
+            return self._combined_bytes_pattern, self._bytes_patterns or []
+        return self.combined_pattern, self.patterns
 
-    def matches_content(self, content: str) -> bool:
-        return bool(self.content_filter_pattern.search(content))
+    def can_match_bytes(self, content: bytes) -> bool:
+        return self._bytes_patterns is not None and (not self._bytes_need_ascii_content or content.isascii())
+
+    def matches_content(self, content: AnyStr) -> bool:
+        combined_pattern, patterns = self._patterns_for(content)
+        found: Set[int] = set()
+        if combined_pattern is not None:
+            for match in combined_pattern.finditer(content):
+                found.add(int(match.lastgroup[1:]))  # type: ignore[index]
+                if self._is_settled(found):
+                    return True
+            if self.match_any:
+                return False  # the alternation matches wherever any of the patterns does
+        for i, pattern in enumerate(patterns):
+            if i not in found:
+                if pattern.search(content):
+                    found.add(i)
+                elif not self.match_any:
+                    return False
+        return self._is_settled(found)
+
+    def find_spans(self, content: AnyStr) -> List[Tuple[int, int]]:
+        combined_pattern, patterns = self._patterns_for(content)
+        found: Set[int] = set()
+        spans: Set[Tuple[int, int]] = set()
+        if combined_pattern is not None:
+            for match in combined_pattern.finditer(content):
+                found.add(int(match.lastgroup[1:]))  # type: ignore[index]
+                spans.add(match.span())
+        for i, pattern in enumerate(patterns):
+            if i not in found:
+                pattern_spans = [match.span() for match in pattern.finditer(content)]
+                found.update([i] if pattern_spans else [])
+                spans.update(pattern_spans)
+        return sorted(spans) if self._is_settled(found) else []
+
+    def matches_fragment(self, result: ContentFile) -> bool:
+        # each pattern must be found in some fragment, or with match_any, any one of them
+        if not self.match_any and len(self._fragment_patterns) < len(self.patterns):
+            return False
+        found: Set[int] = set()
+        for fragment in _text_match_fragments(result):
+            found |= {i for i in self._fragment_patterns if self.patterns[i].search(fragment)}
+            if self._is_settled(found):
+                return True
+        return False
 
 
 class NotArchivedFilter(Filter):
-    def __init__(self):
-        self.cache = {}
+    cost = COST_PER_REPO
+
+    def __init__(self, resolver: ArchivedStatusResolver | None = None, cache: Dict[str, bool] | None = None):
+        self.cache: Dict[str, bool] = {} if cache is None else cache
+        self.resolver = resolver
+
+    def prepare(self, results: List[ContentFile]) -> None:
+        if not self.resolver:
+            return
+        full_names = [result.repository.full_name for result in results]
+        try:
+            archived = self.resolver.resolve(name for name in full_names if name not in self.cache)
+        except GithubException:
+            # eg. GraphQL is unavailable; fall back on looking up each repository via the rest api
+            self.resolver = None
+            return
+        self.cache.update({full_name: not is_archived for full_name, is_archived in archived.items()})
+
+    def estimate_core_calls(self, num_results: int, sample: Sequence[ContentFile] = ()) -> int:
+        if self.resolver:
+            return 0  # GraphQL queries count against the GraphQL rate limit, not the core one
+        return super().estimate_core_calls(num_results, sample)
 
     def __call__(self, result: ContentFile) -> bool:
         if result.repository.full_name not in self.cache:
-            self.cache[result.repository.full_name] = not result.repository.archived
+            archived = self.resolver.fetch(result.repository) if self.resolver else result.repository.archived
+            self.cache[result.repository.full_name] = not archived
         return self.cache[result.repository.full_name]
 
 
 class PathFilter(Filter):
     def __init__(self, path_filter: str):
         self.uses_core_api = False
+        self.cost = COST_FREE
         self.path_filter = path_filter
 
     def __call__(self, result: ContentFile) -> bool:
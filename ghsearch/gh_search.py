@@ -1,17 +1,29 @@
-from typing import List
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import nullcontext
+from functools import partial
+from itertools import chain, islice
+from typing import Any, Callable, ContextManager, Deque, Dict, Iterable, Iterator, List, Sequence, Tuple
 
 import click
-import github
 from github.ContentFile import ContentFile
 from github.GithubException import GithubException
 from github.Rate import Rate
 from github.RateLimit import RateLimit
 
+from ghsearch.client import Client, search_code
 from ghsearch.filters import Filter, FilterException
+from ghsearch.pagination import SEARCH_RESULTS_LIMIT, PagePrefetcher, SearchQuota, count_pages
+from ghsearch.ratelimit import BudgetExceededException, RateLimitScheduler
+from ghsearch.sharding import ShardedSearch
+from ghsearch.stats import RunStats
 from ghsearch.terminal import ProgressPrinter
 
 CORE_CALLS_RELATIVE_LIMIT = 0.1
 CORE_CALLS_ABSOLUTE_LIMIT = 500
+PREPARE_BATCH_SIZE = 100
 
 
 def _confirm_continue_many_calls(core_rate: Rate, num_results: int, calls_per_res: int) -> None:
@@ -40,6 +52,13 @@ Do you want to continue?""".strip(),
     )
 
 
+def _warn_truncated(query: str, total_count: int, hint: str = "") -> None:
+    click.echo(
+        f"Warning: '{query}' matched {total_count} results, only {SEARCH_RESULTS_LIMIT} of them can be retrieved{hint}",
+        err=True,
+    )
+
+
 def _echo_rate_limits(rate_limit: RateLimit) -> None:
     click.echo(
         f"Core rate limit: {rate_limit.core.remaining}/{rate_limit.core.limit} (resets {rate_limit.core.reset}), "
@@ -47,63 +66,216 @@ def _echo_rate_limits(rate_limit: RateLimit) -> None:
     )
 
 
-class GHSearch:
-    def __init__(self, client: github.Github, filters: List[Filter], verbose: bool = False):
-        self.client = client
+class FilterPipeline:
+    """Runs results through the filters, and yields the ones none of them exclude"""
+
+    def __init__(self, filters: List[Filter], verbose: bool = False, jobs: int = 1, stats: RunStats | None = None):
         self.filters = filters
         self.verbose = verbose
+        self.jobs = jobs
+        self.stats = stats
+        self._ordered_filters = list(filters)
+        self._filter_stats: Dict[Filter, List[int]] = {result_filter: [0, 0] for result_filter in filters}
+        self._filter_stats_lock = threading.Lock()
+
+    def _stage(self, name: str) -> ContextManager:
+        return self.stats.stage(name) if self.stats else nullcontext()
+
+    def filter_results(self, results: Iterable[ContentFile]) -> Iterator[ContentFile]:
+        progress_printer = ProgressPrinter(overwrite=not self.verbose)
+        with progress_printer as printer:
+            for result, check in self._check_results(results):
+                printer(f"Checking result for {result.repository.full_name}")
+                try:
+                    exclude_reason = check()
+                except FilterException as e:
+                    printer(str(e), force=True)
+                else:
+                    if not exclude_reason:
+                        progress_printer.clear()
+                        yield result
+                    elif self.verbose:
+                        click.echo(f"Skipping result for {result.repository.full_name} via {exclude_reason}")
+
+        avoided_core_calls = sum(f.avoided_core_calls for f in self.filters)
+        if self.stats:
+            self.stats.count("downloads avoided by text matches", avoided_core_calls)
+        if avoided_core_calls and self.verbose:
+            click.echo(f"Avoided {avoided_core_calls} core api call(s) using search text matches")
+
+    def _check_results(self, results: Iterable[ContentFile]) -> Iterator[Tuple[ContentFile, Callable[[], str | bool]]]:
+        """
+        Pairs each result with a callable returning its exclusion reason. With more than one job the checks are run
+        ahead of the caller on a bounded thread pool, but are still yielded in search result order.
+        """
+        results = self._prepare_in_batches(results)
+        if self.jobs <= 1:
+            for result in results:
+                yield result, partial(self._should_exclude, result)
+            return
+
+        pending: Deque[Tuple[ContentFile, Future]] = deque()
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            try:
+                for result in results:
+                    pending.append((result, executor.submit(self._should_exclude, result)))
+                    if len(pending) >= self.jobs * 2:
+                        result, future = pending.popleft()
+                        yield result, future.result
+                while pending:
+                    result, future = pending.popleft()
+                    yield result, future.result
+            finally:
+                for _, future in pending:
+                    future.cancel()
+
+    def _prepare_in_batches(self, results: Iterable[ContentFile]) -> Iterator[ContentFile]:
+        batch: List[ContentFile] = []
+        for result in results:
+            batch.append(result)
+            if len(batch) == PREPARE_BATCH_SIZE:
+                yield from self._prepare(batch)
+                batch = []
+        yield from self._prepare(batch)
+
+    def _prepare(self, batch: List[ContentFile]) -> List[ContentFile]:
+        if batch:
+            self._order_filters()
+            for result_filter in self.filters:
+                start = time.perf_counter()
+                result_filter.prepare(batch)
+                if self.stats:
+                    self.stats.record_filter(result_filter.__class__.__name__, time.perf_counter() - start)
+        return batch
+
+    def _order_filters(self) -> None:
+        """
+        Orders filters by their cost relative to how likely they are to reject a result (as observed so far), so that
+        cheap and selective filters run first and spare the expensive ones.
+        """
+
+        def rank(result_filter: Filter) -> float:
+            evaluated, rejected = self._filter_stats[result_filter]
+            return result_filter.cost * (evaluated + 2) / (rejected + 1)
+
+        with self._filter_stats_lock:
+            self._ordered_filters = sorted(self.filters, key=rank)
+
+    def _should_exclude(self, result):
+        for result_filter in self._ordered_filters:
+            start = time.perf_counter()
+            passed = result_filter(result)
+            if self.stats:
+                self.stats.record_filter(result_filter.__class__.__name__, time.perf_counter() - start, passed)
+            with self._filter_stats_lock:
+                stats = self._filter_stats[result_filter]
+                stats[0] += 1
+                stats[1] += not passed
+            if not passed:
+                return result_filter.__class__.__name__
+        return False
+
+
+class GHSearch(FilterPipeline):
+    def __init__(
+        self,
+        client: Client,
+        filters: List[Filter],
+        verbose: bool = False,
+        jobs: int = 1,
+        prefetch_pages: int = 0,
+        shard: bool = False,
+        scheduler: RateLimitScheduler | None = None,
+        stats: RunStats | None = None,
+    ):
+        super().__init__(filters, verbose, jobs, stats)
+        self.client = client
+        self.prefetch_pages = prefetch_pages
+        self.shard = shard
+        self.scheduler = scheduler
+        self.budget_exceeded: BudgetExceededException | None = None
 
     def get_rate_limit(self) -> RateLimit | None:
-        try:
-            return self.client.get_rate_limit()
-        except GithubException as ge:
-            # 404 means that rate limiting is disabled
-            if ge.status == 404:
-                return None
-            raise ge
+        with self._stage("rate limit"):
+            try:
+                return self.client.get_rate_limit()
+            except GithubException as ge:
+                # 404 means that rate limiting is disabled
+                if ge.status == 404:
+                    return None
+                raise ge
 
     def get_filtered_results(self, query: List[str]) -> List[ContentFile]:
+        return list(self.iter_filtered_results(query))
+
+    def iter_filtered_results(self, query: List[str]) -> Iterator[ContentFile]:
         rate_limit = self.get_rate_limit()
 
         if rate_limit and self.verbose:
             _echo_rate_limits(rate_limit)
 
-        results = self.client.search_code(query=" ".join(query))
+        search_params: Dict[str, Any] = {"highlight": True} if any(f.uses_text_matches for f in self.filters) else {}
+        search_rate = rate_limit.search if rate_limit else None
+        query_string = " ".join(query)
+        search_results: Any
+        results: Iterable[ContentFile]
+        with self._stage("search"):
+            if self.shard:
+                search_results = ShardedSearch(
+                    self.client, query_string, search_params, SearchQuota(search_rate), self.jobs
+                )
+                for shard in search_results.truncated_shards:
+                    _warn_truncated(shard.query, shard.total_count)
+                results = search_results
+            else:
+                search_results = search_code(self.client, query_string, **search_params)
+                if search_results.totalCount > SEARCH_RESULTS_LIMIT:
+                    _warn_truncated(query_string, search_results.totalCount, " (use --shard to retrieve all of them)")
+                results = search_results
+                if self.prefetch_pages:
+                    per_page = self.client.per_page
+                    num_pages = count_pages(search_results.totalCount, per_page)
+                    results = PagePrefetcher(search_results, num_pages, per_page, self.prefetch_pages, search_rate)
+
+        if self.stats:
+            results = self.stats.timed("search", results)
 
         if rate_limit:
-            self._check_core_limit_threshold(results.totalCount, rate_limit.core)
+            # the first page of results refines the estimate
+            results = iter(results)
+            sample = list(islice(results, PREPARE_BATCH_SIZE))
+            self._check_core_limit_threshold(search_results.totalCount, rate_limit.core, sample)
+            results = chain(sample, results)
 
-        filtered_results = []
-        with ProgressPrinter(overwrite=not self.verbose) as printer:
-            for result in results:
-                printer(f"Checking result for {result.repository.full_name}")
-                try:
-                    exclude_reason = self._should_exclude(result)
-                except FilterException as e:
-                    printer(str(e), force=True)
-                else:
-                    if not exclude_reason:
-                        filtered_results.append(result)
-                    elif self.verbose:
-                        click.echo(f"Skipping result for {result.repository.full_name} via {exclude_reason}")
+        try:
+            yield from self.filter_results(results)
+        except BudgetExceededException as ex:
+            # end the results there, so that those found so far are still printed
+            self.budget_exceeded = ex
+            return
 
         rate_limit = self.get_rate_limit()
         if rate_limit and self.verbose:
             _echo_rate_limits(rate_limit)
 
-        return filtered_results
-
-    def _should_exclude(self, result):
-        for result_filter in self.filters:
-            if not result_filter(result):
-                return result_filter.__class__.__name__
-        return False
+    def _check_core_limit_threshold(
+        self, num_results: int, core_rate: Rate, sample: Sequence[ContentFile] = ()
+    ) -> None:
+        num_core_api_calls_worst_case = sum(f.estimate_core_calls(num_results, sample) for f in self.filters)
+        if self.scheduler and self.scheduler.has_budget:
+            # unattended: rather than asking, stop once the budget is used up
+            budget = self.scheduler.apply_core_remaining(core_rate.remaining)
+            if budget is not None and num_core_api_calls_worst_case > budget:
+                click.echo(
+                    f"Warning: gh-search may make up to {num_core_api_calls_worst_case} core api requests, "
+                    f"but will stop after {budget}",
+                    err=True,
+                )
+            return
 
-    def _check_core_limit_threshold(self, num_results: int, core_rate: Rate) -> None:
-        max_core_api_calls_per_result = sum(bool(f.uses_core_api) for f in self.filters)
-        if max_core_api_calls_per_result > 0:
+        if num_core_api_calls_worst_case > 0:
 
-            num_core_api_calls_worst_case = num_results * max_core_api_calls_per_result
+            max_core_api_calls_per_result = -(-num_core_api_calls_worst_case // num_results)
             remaining_worst_case = core_rate.remaining - num_core_api_calls_worst_case
             if remaining_worst_case / core_rate.limit < CORE_CALLS_RELATIVE_LIMIT:
                 _confirm_continue_near_limit(core_rate, num_results, max_core_api_calls_per_result)
@@ -0,0 +1,421 @@
+import os
+import re
+import sqlite3
+import tarfile
+import threading
+import zlib
+from functools import lru_cache
+from typing import IO, Any, Callable, Dict, Iterator, List, NamedTuple, Sequence, Set, Tuple
+
+from github.GithubException import UnknownObjectException
+
+from ghsearch.client import Client, conditional_get, open_tarball, tarball_url
+from ghsearch.defaults import DEFAULT_ENCODING
+from ghsearch.filters import is_ascii_compatible
+from ghsearch.repositories import metadata_from_rest
+from ghsearch.sharding import MAX_INDEXED_FILE_SIZE
+from ghsearch.tarballs import git_blob_sha
+
+try:
+    # private, and changed between python versions: without them, regex queries scan every blob
+    from re import _constants as sre_constants  # type: ignore[attr-defined]
+    from re import _parser as sre_parse  # type: ignore[attr-defined]
+except ImportError:
+    sre_constants = sre_parse = None
+
+BINARY_SNIFF_SIZE = 8000  # like git, files with a NUL byte in their first 8000 bytes are binary
+MAX_TRIGRAMS_PER_LITERAL = 64  # any subset of a literal's trigrams narrows down the candidates just as safely
+REPOS_PER_PAGE = 100
+
+SUPPORTED_QUALIFIERS = ("repo", "org", "user", "path", "filename", "extension")
+# qualifiers of GitHub code search which the index can't answer
+_unsupported_qualifiers = {"in", "language", "size", "fork", "is", "archived", "symbol", "content", "enterprise"}
+_qualifier_re = re.compile(r"^(?P<name>[a-z]+):(?P<value>.+)$")
+
+# under unicode IGNORECASE, python's re also matches these ASCII letters against non-ASCII ones (eg. "k" and "K")
+_unicode_case_folded = set(b"iksIKS")
+_repeats = tuple(getattr(sre_constants, name, None) for name in ("MAX_REPEAT", "MIN_REPEAT", "POSSESSIVE_REPEAT"))
+
+# ("trigrams", [trigram, ...]) matches blobs containing all of them; ("and" | "or", [plan, ...]) combines plans
+Plan = Tuple[str, List[Any]]
+
+
+class IndexException(Exception):
+    pass
+
+
+class IndexedOwner(NamedTuple):
+    login: str
+
+
+class IndexedRepository(NamedTuple):
+    full_name: str
+    name: str
+    owner: IndexedOwner
+    html_url: str
+    fork: bool
+    archived: bool
+
+
+class IndexedFile:
+    """A file of the index, with the attributes of the search results (ContentFile) used by filters and printers"""
+
+    text_matches = None
+
+    def __init__(
+        self, index: "LocalIndex", repository: IndexedRepository, path: str, sha: str, size: int, commit: str, blob: int
+    ):
+        self.repository = repository
+        self.path = path
+        self.sha = sha
+        self.size = size
+        self.html_url = f"{repository.html_url}/blob/{commit}/{path}"
+        self._index = index
+        self._blob = blob
+
+    @property
+    def name(self) -> str:
+        return os.path.basename(self.path)
+
+    @property
+    def decoded_content(self) -> bytes:
+        return self._index.read(self._blob)
+
+
+def _trigrams(content: bytes) -> Set[bytes]:
+    """Trigrams of ASCII-lowercased content, so that the index answers both case sensitive and insensitive queries"""
+    lowered = content.lower()
+    return {lowered[i : i + 3] for i in range(len(lowered) - 2)}  # noqa: E203
+
+
+def _literal_plan(literal: bytes) -> Plan | None:
+    trigrams = sorted(_trigrams(literal))[:MAX_TRIGRAMS_PER_LITERAL]
+    return ("trigrams", trigrams) if trigrams else None
+
+
+def _combine(kind: str, plans: Sequence[Plan | None]) -> Plan | None:
+    """None is a plan matching any blob"""
+    if kind == "or" and (not plans or None in plans):
+        return None
+    known = [plan for plan in plans if plan is not None]
+    if len(known) <= 1:
+        return known[0] if known else None
+    return (kind, known)
+
+
+def _regex_plan(items: Any, encoding: str, ignore_case: bool) -> Plan | None:
+    """
+    Plans the trigrams that any match of a parsed regex must contain: those of each run of consecutive literals, of
+    each group, of every alternative of a branch, and of repeated items which must occur at least once.
+    """
+    plans: List[Plan | None] = []
+    run = bytearray()
+
+    def flush() -> None:
+        plans.append(_literal_plan(bytes(run)))
+        run.clear()
+
+    for op, av in items:
+        if op is sre_constants.LITERAL:
+            try:
+                literal = chr(av).encode(encoding)
+            except UnicodeEncodeError:
+                literal = b""
+            if not literal or (ignore_case and (av > 127 or av in _unicode_case_folded)):
+                flush()
+            else:
+                run.extend(literal)
+        elif op is sre_constants.AT:
+            continue  # anchors are zero-width, so the literals around them are still consecutive
+        else:
+            flush()
+            if op is sre_constants.SUBPATTERN:
+                _, add_flags, del_flags, sub_items = av
+                sub_ignore_case = (ignore_case or bool(add_flags & re.IGNORECASE)) and not del_flags & re.IGNORECASE
+                plans.append(_regex_plan(sub_items, encoding, sub_ignore_case))
+            elif op is sre_constants.ATOMIC_GROUP:
+                plans.append(_regex_plan(av, encoding, ignore_case))
+            elif op is sre_constants.BRANCH:
+                plans.append(_combine("or", [_regex_plan(branch, encoding, ignore_case) for branch in av[1]]))
+            elif op in _repeats and av[0] >= 1:
+                plans.append(_regex_plan(av[2], encoding, ignore_case))
+    flush()
+    return _combine("and", plans)
+
+
+def _parse_regex(pattern: str, encoding: str) -> Plan | None:
+    try:
+        parsed = sre_parse.parse(pattern)
+    except re.error:
+        return None  # reported by the regex content filter
+    ignore_case = bool(parsed.state.flags & re.IGNORECASE) and not parsed.state.flags & re.ASCII
+    return _regex_plan(parsed, encoding, ignore_case)
+
+
+@lru_cache(maxsize=1)
+def _parser_supported() -> bool:
+    """Whether python's private regex parser is there, and parses a known pattern as expected"""
+    expected = ("and", [("trigrams", [b"abc"]), ("or", [("trigrams", [b"def"]), ("trigrams", [b"ghi"])])])
+    try:
+        return sre_parse is not None and _parse_regex("abc(?:def|ghi)+", "utf-8") == expected
+    except Exception:
+        return False
+
+
+def plan_regex(pattern: str, encoding: str) -> Plan | None:
+    if not _parser_supported():
+        return None
+    try:
+        return _parse_regex(pattern, encoding)
+    except (AttributeError, IndexError, TypeError, ValueError):
+        return None  # parsed into items of an unexpected shape
+
+
+def plan_literal(literal: str, encoding: str) -> Plan | None:
+    try:
+        return _literal_plan(literal.encode(encoding))
+    except UnicodeEncodeError:
+        return None
+
+
+def _plan_sql(plan: Plan, params: List[Any]) -> str:
+    kind, parts = plan
+    if kind == "trigrams":
+        params.extend(parts)
+        params.append(len(parts))
+        placeholders = ", ".join("?" * len(parts))
+        return f"SELECT blob FROM trigrams WHERE trigram IN ({placeholders}) GROUP BY blob HAVING COUNT(*) = ?"
+    operator = " INTERSECT " if kind == "and" else " UNION "
+    return operator.join(f"SELECT blob FROM ({_plan_sql(part, params)})" for part in parts)
+
+
+def _like_escape(value: str) -> str:
+    return re.sub(r"([\\%_])", r"\\\1", value)
+
+
+class _Query(NamedTuple):
+    terms: List[str]
+    conditions: List[str]
+    params: List[Any]
+
+
+def _parse_query(query: Sequence[str]) -> _Query:
+    """Splits a query into its terms, and SQL conditions on files `f` and repositories `r` for its qualifiers"""
+    terms: List[str] = []
+    qualifiers: Dict[str, List[str]] = {}
+    for term in query:
+        match = _qualifier_re.match(term)
+        if match and match["name"] in SUPPORTED_QUALIFIERS:
+            qualifiers.setdefault(match["name"], []).append(match["value"])
+        elif match and match["name"] in _unsupported_qualifiers:
+            raise IndexException(
+                f"The '{match['name']}:' qualifier is not supported by the index; use one of: "
+                f"{', '.join(f'{name}:' for name in SUPPORTED_QUALIFIERS)}"
+            )
+        else:
+            terms.append(term)
+
+    conditions = []
+    params: List[Any] = []
+
+    def add(condition: str, values: List[Any]) -> None:
+        # like GitHub code search, repeated qualifiers match any of their values
+        conditions.append("(" + " OR ".join([condition] * len(values)) + ")")
+        params.extend(values)
+
+    if "repo" in qualifiers:
+        add("r.full_name = ? COLLATE NOCASE", qualifiers["repo"])
+    if "org" in qualifiers or "user" in qualifiers:
+        add("r.owner = ? COLLATE NOCASE", qualifiers.get("org", []) + qualifiers.get("user", []))
+    if "path" in qualifiers:
+        add("f.path LIKE ? ESCAPE '\\'", [_like_escape(value.strip("/")) + "/%" for value in qualifiers["path"]])
+    if "filename" in qualifiers:
+        add("'/' || f.path LIKE ? ESCAPE '\\'", ["%/" + _like_escape(value) for value in qualifiers["filename"]])
+    if "extension" in qualifiers:
+        add("f.path LIKE ? ESCAPE '\\'", ["%." + _like_escape(value.lstrip(".")) for value in qualifiers["extension"]])
+    return _Query(terms, conditions, params)
+
+
+class LocalIndex:
+    """
+    A trigram index of the files of the default branch of repositories, kept in a SQLite database. Each repository is
+    read from a tarball of its latest commit, and files are stored once per distinct blob, so refreshing a repository
+    only indexes the files which changed, and an unchanged repository costs a couple of 304 Not Modified responses.
+    """
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS repositories (full_name TEXT PRIMARY KEY, archived INTEGER, fork INTEGER,"
+                " owner TEXT, html_url TEXT, default_branch TEXT, etag TEXT, ref_etag TEXT, commit_sha TEXT)"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS files (repository TEXT, path TEXT, blob INTEGER,"
+                " PRIMARY KEY (repository, path)) WITHOUT ROWID"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS blobs (id INTEGER PRIMARY KEY, sha TEXT UNIQUE, size INTEGER, content BLOB)"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS trigrams (trigram BLOB, blob INTEGER, PRIMARY KEY (trigram, blob))"
+                " WITHOUT ROWID"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS files_blob ON files (blob)")
+
+    def close(self) -> None:
+        self._db.close()
+
+    def repositories(self) -> List[str]:
+        with self._lock:
+            return [row[0] for row in self._db.execute("SELECT full_name FROM repositories ORDER BY full_name")]
+
+    def read(self, blob: int) -> bytes:
+        with self._lock:
+            (content,) = self._db.execute("SELECT content FROM blobs WHERE id = ?", (blob,)).fetchone()
+        return zlib.decompress(content)
+
+    def update(self, client: Client, full_name: str, open_url: Callable[[str], IO[bytes]] = open_tarball) -> bool:
+        """Indexes the latest commit of the default branch of a repository, returns whether it had changed"""
+        with self._lock:
+            stored = self._db.execute(
+                "SELECT default_branch, etag, ref_etag, commit_sha FROM repositories WHERE full_name = ?", (full_name,)
+            ).fetchone()
+        default_branch, etag, ref_etag, commit_sha = stored or (None, None, None, None)
+
+        data, etag = conditional_get(client, f"/repos/{full_name}", etag)
+        if data is not None:
+            metadata = metadata_from_rest(data)
+            default_branch = data["default_branch"]
+            with self._lock, self._db:
+                self._db.execute(
+                    "INSERT INTO repositories (full_name, archived, fork, owner, html_url, default_branch, etag)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (full_name) DO UPDATE SET archived = excluded.archived,"
+                    " fork = excluded.fork, owner = excluded.owner, html_url = excluded.html_url,"
+                    " default_branch = excluded.default_branch, etag = excluded.etag",
+                    (*metadata, default_branch, etag),
+                )
+
+        ref, ref_etag = conditional_get(client, f"/repos/{full_name}/git/ref/heads/{default_branch}", ref_etag)
+        if ref is None or ref["object"]["sha"] == commit_sha:
+            return False
+
+        commit_sha = ref["object"]["sha"]
+        with open_url(tarball_url(client, full_name, commit_sha)) as response:
+            self._index_tarball(full_name, response)
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE repositories SET ref_etag = ?, commit_sha = ? WHERE full_name = ?",
+                (ref_etag, commit_sha, full_name),
+            )
+        return True
+
+    def _index_tarball(self, full_name: str, stream: IO[bytes]) -> None:
+        files: Dict[str, int] = {}
+        with self._lock, self._db, tarfile.open(fileobj=stream, mode="r|gz") as tar:
+            for member in tar:
+                # members are prefixed by a single `<owner>-<repo>-<commit>/` directory
+                if not member.isfile() or member.size > MAX_INDEXED_FILE_SIZE:
+                    continue
+                content = tar.extractfile(member).read()  # type: ignore[union-attr]
+                if b"\0" not in content[:BINARY_SNIFF_SIZE]:
+                    files[member.name.partition("/")[2]] = self._add_blob(content)
+
+            previous = {row[0] for row in self._db.execute("SELECT blob FROM files WHERE repository = ?", (full_name,))}
+            self._db.execute("DELETE FROM files WHERE repository = ?", (full_name,))
+            self._db.executemany("INSERT INTO files VALUES (?, ?, ?)", ((full_name, *file) for file in files.items()))
+            for blob in previous - set(files.values()):
+                self._remove_blob_unless_used(blob)
+
+    def _add_blob(self, content: bytes) -> int:
+        sha = git_blob_sha(content)
+        row = self._db.execute("SELECT id FROM blobs WHERE sha = ?", (sha,)).fetchone()
+        if row:
+            return row[0]
+        blob = self._db.execute(
+            "INSERT INTO blobs (sha, size, content) VALUES (?, ?, ?)", (sha, len(content), zlib.compress(content))
+        ).lastrowid
+        self._db.executemany("INSERT INTO trigrams VALUES (?, ?)", ((trigram, blob) for trigram in _trigrams(content)))
+        return blob  # type: ignore[return-value]
+
+    def _remove_blob_unless_used(self, blob: int) -> None:
+        if self._db.execute("SELECT 1 FROM files WHERE blob = ? LIMIT 1", (blob,)).fetchone():
+            return
+        (content,) = self._db.execute("SELECT content FROM blobs WHERE id = ?", (blob,)).fetchone()
+        self._db.executemany(
+            "DELETE FROM trigrams WHERE trigram = ? AND blob = ?",
+            ((trigram, blob) for trigram in _trigrams(zlib.decompress(content))),
+        )
+        self._db.execute("DELETE FROM blobs WHERE id = ?", (blob,))
+
+    def search(
+        self,
+        query: Sequence[str],
+        content_filters: Sequence[str] = (),
+        regex_content_filters: Sequence[str] = (),
+        match_any: bool = False,
+        encoding: str = DEFAULT_ENCODING,
+    ) -> Iterator[IndexedFile]:
+        """
+        Returns the files which contain every term of the query (case insensitively) and match its qualifiers, and
+        which may match the content filters, as far as their trigrams tell; the filters still have to be applied.
+        """
+        terms, conditions, params = _parse_query(query)
+        filter_plans: List[Plan | None] = [None]  # the trigrams of other encodings are not those of the patterns
+        if is_ascii_compatible(encoding):
+            filter_plans = [plan_literal(pattern, encoding) for pattern in content_filters]
+            filter_plans += [plan_regex(pattern, encoding) for pattern in regex_content_filters]
+        plan = _combine(
+            "and",
+            [_literal_plan(term.encode()) for term in terms] + [_combine("or" if match_any else "and", filter_plans)],
+        )
+
+        sql = (
+            "SELECT r.full_name, r.owner, r.html_url, r.fork, r.archived, r.commit_sha, f.path, b.sha, b.size, b.id"
+            " FROM files f JOIN repositories r ON r.full_name = f.repository JOIN blobs b ON b.id = f.blob"
+        )
+        plan_params: List[Any] = []
+        if plan:
+            conditions.insert(0, f"f.blob IN ({_plan_sql(plan, plan_params)})")
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY r.full_name, f.path"
+        return self._results(sql, plan_params + params, [term.encode().lower() for term in terms])
+
+    def _results(self, sql: str, params: List[Any], terms: List[bytes]) -> Iterator[IndexedFile]:
+        with self._lock:
+            rows = self._db.execute(sql, params).fetchall()
+        repositories: Dict[str, IndexedRepository] = {}
+        for full_name, owner, html_url, fork, archived, commit, path, sha, size, blob in rows:
+            if full_name not in repositories:
+                name = full_name.partition("/")[2]
+                repositories[full_name] = IndexedRepository(
+                    full_name, name, IndexedOwner(owner), html_url, bool(fork), bool(archived)
+                )
+            result = IndexedFile(self, repositories[full_name], path, sha, size, commit, blob)
+            if terms:
+                content = result.decoded_content.lower()
+                if not all(term in content for term in terms):
+                    continue
+            yield result
+
+
+def list_repositories(client: Client, owner: str) -> List[str]:
+    """Lists the repositories of an organization, or a user"""
+    try:
+        return _list_repositories(client, f"/orgs/{owner}/repos")
+    except UnknownObjectException:
+        return _list_repositories(client, f"/users/{owner}/repos")
+
+
+def _list_repositories(client: Client, url: str) -> List[str]:
+    full_names: List[str] = []
+    page = 1
+    while True:
+        data, _ = conditional_get(client, f"{url}?per_page={REPOS_PER_PAGE}&page={page}")
+        full_names.extend(repo["full_name"] for repo in data)
+        if len(data) < REPOS_PER_PAGE:
+            return full_names
+        page += 1
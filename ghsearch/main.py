@@ -1,62 +1,380 @@
-from typing import List
+import os
+import tarfile
+from typing import Dict, List, Sequence, Tuple
 
 import click
 from click import UsageError
 from github.GithubException import BadCredentialsException, GithubException
 
+from ghsearch.cache import RESPONSE_CACHE_SHARE, BlobCache, ResponseCache
 from ghsearch.client import build_client
-from ghsearch.filters import ContentFilter, Filter, FilterException, NotArchivedFilter, PathFilter, RegexContentFilter
-from ghsearch.gh_search import GHSearch
+from ghsearch.defaults import (
+    DEFAULT_CACHE_MAX_SIZE_MB,
+    DEFAULT_ENCODING,
+    DEFAULT_MAX_IN_FLIGHT,
+    DEFAULT_PREFETCH_PAGES,
+    DEFAULT_REPO_CACHE_TTL,
+    PYGITHUB_BACKEND,
+)
+from ghsearch.filters import (
+    ContentFilter,
+    Filter,
+    FilterException,
+    MultiPatternContentFilter,
+    NotArchivedFilter,
+    PathFilter,
+    RegexContentFilter,
+)
+from ghsearch.gh_search import FilterPipeline, GHSearch
+from ghsearch.index import IndexException, LocalIndex, list_repositories
 from ghsearch.output import Printer
+from ghsearch.ratelimit import BudgetExceededException, RateLimitScheduler
+from ghsearch.repositories import ArchivedStatusResolver, RepoMetadataCache
+from ghsearch.stats import RunStats
+from ghsearch.tarballs import RepoTarballs
+from ghsearch.watch import WatchState, state_key
+
+
+def _patterns(patterns: str | Sequence[str] | None) -> Tuple[str, ...]:
+    if isinstance(patterns, str):
+        return (patterns,)
+    return tuple(pattern for pattern in patterns or () if pattern)
 
 
 def _build_filters(
     path_filter: str | None = None,
     include_archived: bool = True,
-    content_filter: str | None = None,
-    regex_content_filter: str | None = None,
+    content_filter: str | Sequence[str] | None = None,
+    regex_content_filter: str | Sequence[str] | None = None,
+    blob_cache: BlobCache | None = None,
+    archived_resolver: ArchivedStatusResolver | None = None,
+    archived_cache: Dict[str, bool] | None = None,
+    match_any: bool = False,
+    encoding: str = DEFAULT_ENCODING,
+    context: int | None = None,
+    tarballs: RepoTarballs | None = None,
 ) -> List[Filter]:
     filters: List[Filter] = []
     if path_filter:
         filters.append(PathFilter(path_filter))
     if not include_archived:
-        filters.append(NotArchivedFilter())
-    if content_filter:
-        filters.append(ContentFilter(content_filter))
-    if regex_content_filter:
-        filters.append(RegexContentFilter(regex_content_filter))
+        filters.append(NotArchivedFilter(archived_resolver, archived_cache))
+    content_filters, regex_content_filters = _patterns(content_filter), _patterns(regex_content_filter)
+    if len(content_filters) + len(regex_content_filters) > 1:
+        filters.append(
+            MultiPatternContentFilter(
+                content_filters, regex_content_filters, match_any, blob_cache, encoding, context, tarballs
+            )
+        )
+    elif content_filters:
+        filters.append(ContentFilter(content_filters[0], blob_cache, encoding, context, tarballs))
+    elif regex_content_filters:
+        filters.append(RegexContentFilter(regex_content_filters[0], blob_cache, encoding, context, tarballs))
     return filters
 
 
+class Session:
+    """The client, caches and rate limit budget shared by all queries run by one process"""
+
+    def __init__(
+        self,
+        github_token: str,
+        github_api_url: str | None = None,
+        jobs: int = 1,
+        cache_dir: str | None = None,
+        cache_max_size: int = DEFAULT_CACHE_MAX_SIZE_MB,
+        repo_cache_ttl: int = DEFAULT_REPO_CACHE_TTL,
+        backend: str = PYGITHUB_BACKEND,
+        max_connections: int = DEFAULT_MAX_IN_FLIGHT,
+        budget: int | None = None,
+        max_core_fraction: float | None = None,
+        tarball_threshold: int | None = None,
+        stats: RunStats | None = None,
+        prefetch_pages: int = DEFAULT_PREFETCH_PAGES,
+    ):
+        """`prefetch_pages` is the most that searches run on this session will prefetch"""
+        self.jobs = jobs
+        self.stats = stats
+        # the caches split the max size between them, so that together they stay within it
+        response_cache_size = int(cache_max_size * 1024 * 1024 * RESPONSE_CACHE_SHARE)
+        blob_cache_size = cache_max_size * 1024 * 1024 - response_cache_size
+        self.response_cache = (
+            ResponseCache(os.path.join(cache_dir, "responses"), response_cache_size, github_token)
+            if cache_dir
+            else None
+        )
+        self.scheduler = RateLimitScheduler(budget, max_core_fraction)
+        self.budget_exceeded: BudgetExceededException | None = None  # once a search stopped short because of it
+        self.client = build_client(
+            github_token,
+            github_api_url,
+            pool_size=jobs if jobs > 1 else None,
+            backend=backend,
+            max_in_flight=max_connections,
+            response_cache=self.response_cache,
+            scheduler=self.scheduler,
+            stats=stats,
+            prefetch_pages=prefetch_pages,
+        )
+        self.blob_cache = BlobCache(os.path.join(cache_dir, "blobs"), blob_cache_size) if cache_dir else None
+        repo_cache = (
+            RepoMetadataCache(os.path.join(cache_dir, "repositories.sqlite"), repo_cache_ttl) if cache_dir else None
+        )
+        self.archived_resolver = ArchivedStatusResolver(self.client, repo_cache)
+        self.archived_cache: Dict[str, bool] = {}
+        self.tarballs = RepoTarballs(self.client, tarball_threshold) if tarball_threshold is not None else None
+
+    def search(
+        self,
+        query: List[str],
+        printer: Printer,
+        path_filter: str | None = None,
+        content_filter: str | Sequence[str] | None = None,
+        regex_content_filter: str | Sequence[str] | None = None,
+        include_archived: bool = False,
+        verbose: bool = False,
+        prefetch_pages: int = DEFAULT_PREFETCH_PAGES,
+        shard: bool = False,
+        match_any: bool = False,
+        encoding: str = DEFAULT_ENCODING,
+        show_matches: bool = False,
+        context: int | None = None,
+        state_path: str | None = None,
+    ) -> None:
+        """
+        `context` lines are shown around matches, which implies `show_matches`. With a `state_path`, only the results
+        added, changed or removed since the previous run with the same state are printed.
+        """
+        if show_matches and context is None:
+            context = 0
+        try:
+            filters = _build_filters(
+                path_filter,
+                include_archived,
+                content_filter,
+                regex_content_filter,
+                self.blob_cache,
+                self.archived_resolver,
+                self.archived_cache,
+                match_any,
+                encoding,
+                context,
+                self.tarballs,
+            )
+        except FilterException as ex:
+            raise UsageError(str(ex), click.get_current_context(silent=True))
+        state = None
+        if state_path:
+            key = state_key(
+                query, path_filter, include_archived, content_filter, regex_content_filter, match_any, encoding
+            )
+            state = WatchState(state_path, key)
+            filters = state.remember(filters)
+
+        try:
+            gh_search = GHSearch(
+                self.client, filters, verbose, self.jobs, prefetch_pages, shard, self.scheduler, self.stats
+            )
+            results = gh_search.iter_filtered_results(query)
+            if state:
+                results = state.changes(results, lambda: gh_search.budget_exceeded is None)
+            if self.stats:
+                with self.stats.stage("print"):
+                    printer.print(query, self.stats.timed("filter", results))
+            else:
+                printer.print(query, results)
+
+        except BadCredentialsException as ex:
+            raise UsageError(f"Bad Credentials: {ex}", click.get_current_context(silent=True))
+        except GithubException as ex:
+            if ex.status == 422 and isinstance(ex.data, dict):
+                message = ex.data["message"]
+                errors = ", ".join(err["message"] for err in ex.data.get("errors", []) if isinstance(err, dict))
+                raise UsageError(f"{message} (GitHub Exception): {errors}", click.get_current_context(silent=True))
+            raise ex
+        self.budget_exceeded = self.budget_exceeded or gh_search.budget_exceeded
+
+        if state:
+            state.save()
+            if self.stats:
+                self.stats.count("content filter results reused", state.reused)
+            if verbose:
+                click.echo(f"Content filter results reused from the previous run: {state.reused}")
+
+    def echo_stats(self) -> None:
+        if self.response_cache:
+            click.echo(f"Requests answered with 304 Not Modified: {self.response_cache.not_modified}")
+        if self.scheduler.retries:
+            click.echo(f"Requests retried after hitting a rate limit: {self.scheduler.retries}")
+        if self.tarballs:
+            click.echo(
+                f"Repository tarballs downloaded: {self.tarballs.downloaded}, files read from them: "
+                f"{self.tarballs.files_read}"
+            )
+
+    def _record_stats(self, stats: RunStats) -> None:
+        stats.count("core api requests", self.scheduler.core_used)
+        stats.count("graphql api requests", self.scheduler.graphql_used)
+        stats.count("requests retried after a rate limit", self.scheduler.retries)
+        if self.response_cache:
+            stats.count("responses not modified (304)", self.response_cache.not_modified)
+        if self.blob_cache:
+            stats.count("content cache hits", self.blob_cache.hits)
+            stats.count("content cache misses", self.blob_cache.misses)
+        if self.tarballs:
+            stats.count("tarballs downloaded", self.tarballs.downloaded)
+            stats.count("tarball bytes downloaded", self.tarballs.downloaded_bytes)
+            stats.count("files read from tarballs", self.tarballs.files_read)
+
+    def close(self) -> None:
+        if self.stats:
+            self._record_stats(self.stats)
+        if self.tarballs:
+            self.tarballs.close()
+        self.client.close()
+
+
 def run(
     query: List[str],
     github_token: str,
     printer: Printer,
     github_api_url: str | None = None,
     path_filter: str | None = None,
-    content_filter: str | None = None,
-    regex_content_filter: str | None = None,
+    content_filter: str | Sequence[str] | None = None,
+    regex_content_filter: str | Sequence[str] | None = None,
     include_archived: bool = False,
     verbose: bool = False,
+    jobs: int = 1,
+    cache_dir: str | None = None,
+    cache_max_size: int = DEFAULT_CACHE_MAX_SIZE_MB,
+    repo_cache_ttl: int = DEFAULT_REPO_CACHE_TTL,
+    backend: str = PYGITHUB_BACKEND,
+    max_connections: int = DEFAULT_MAX_IN_FLIGHT,
+    prefetch_pages: int = DEFAULT_PREFETCH_PAGES,
+    shard: bool = False,
+    budget: int | None = None,
+    max_core_fraction: float | None = None,
+    match_any: bool = False,
+    encoding: str = DEFAULT_ENCODING,
+    show_matches: bool = False,
+    context: int | None = None,
+    tarball_threshold: int | None = None,
+    state_path: str | None = None,
+    stats: RunStats | None = None,
+) -> None:
+    session = Session(
+        github_token,
+        github_api_url,
+        jobs,
+        cache_dir,
+        cache_max_size,
+        repo_cache_ttl,
+        backend,
+        max_connections,
+        budget,
+        max_core_fraction,
+        tarball_threshold,
+        stats,
+        prefetch_pages,
+    )
+    try:
+        session.search(
+            query,
+            printer,
+            path_filter,
+            content_filter,
+            regex_content_filter,
+            include_archived,
+            verbose,
+            prefetch_pages,
+            shard,
+            match_any,
+            encoding,
+            show_matches,
+            context,
+            state_path,
+        )
+        if session.budget_exceeded:
+            click.echo(f"Warning: {session.budget_exceeded}, so the results are incomplete", err=True)
+    except BudgetExceededException as ex:
+        raise click.ClickException(str(ex))
+    finally:
+        session.close()
+    if verbose:
+        session.echo_stats()
+
+
+def run_index_update(
+    github_token: str,
+    index_path: str,
+    targets: Sequence[str] = (),
+    github_api_url: str | None = None,
+    verbose: bool = False,
 ) -> None:
+    """Indexes each `owner/name` repository, and all the repositories of each owner; by default, those indexed"""
     client = build_client(github_token, github_api_url)
+    index = LocalIndex(index_path)
+    failed: List[str] = []
+    try:
+        full_names: List[str] = []
+        for target in targets:
+            full_names.extend([target] if "/" in target else list_repositories(client, target))
+        for full_name in dict.fromkeys(full_names or index.repositories()):
+            try:
+                changed = index.update(client, full_name)
+            except BadCredentialsException as ex:
+                raise UsageError(f"Bad Credentials: {ex}", click.get_current_context(silent=True))
+            except (GithubException, tarfile.TarError, OSError) as ex:
+                failed.append(full_name)
+                click.echo(f"Error: failed to index {full_name}: {ex}", err=True)
+            else:
+                if verbose:
+                    click.echo(f"{'Indexed' if changed else 'Up to date'}: {full_name}")
+    finally:
+        index.close()
+    if failed:
+        raise click.ClickException(f"Failed to index {len(failed)} repositories: {', '.join(failed)}")
+
 
+def run_index_search(
+    query: List[str],
+    index_path: str,
+    printer: Printer,
+    path_filter: str | None = None,
+    content_filter: str | Sequence[str] | None = None,
+    regex_content_filter: str | Sequence[str] | None = None,
+    include_archived: bool = False,
+    verbose: bool = False,
+    jobs: int = 1,
+    match_any: bool = False,
+    encoding: str = DEFAULT_ENCODING,
+    show_matches: bool = False,
+    context: int | None = None,
+) -> None:
+    """Answers a query from the local index, narrowed down by the trigrams of the content filters"""
+    if not os.path.exists(index_path):
+        raise UsageError(f"There is no index at {index_path}, create it with `gh-search-index update`")
+    if show_matches and context is None:
+        context = 0
     try:
-        filters = _build_filters(path_filter, include_archived, content_filter, regex_content_filter)
+        filters = _build_filters(
+            path_filter,
+            include_archived,
+            content_filter,
+            regex_content_filter,
+            match_any=match_any,
+            encoding=encoding,
+            context=context,
+        )
     except FilterException as ex:
         raise UsageError(str(ex), click.get_current_context(silent=True))
 
+    index = LocalIndex(index_path)
     try:
-        gh_search = GHSearch(client, filters, verbose)
-        results = gh_search.get_filtered_results(query)
-
-        printer.print(query, results)
-
-    except BadCredentialsException as ex:
-        raise UsageError(f"Bad Credentials: {ex}", click.get_current_context(silent=True))
-    except GithubException as ex:
-        if ex.status == 422 and isinstance(ex.data, dict):
-            message = ex.data["message"]
-            errors = ", ".join(err["message"] for err in ex.data.get("errors", []) if isinstance(err, dict))
-            raise UsageError(f"{message} (GitHub Exception): {errors}", click.get_current_context(silent=True))
-        raise ex
+        results = index.search(query, _patterns(content_filter), _patterns(regex_content_filter), match_any, encoding)
+        # indexed files have the attributes of search results used by the filters and printers
+        printer.print(query, FilterPipeline(filters, verbose, jobs).filter_results(results))  # type: ignore[arg-type]
+    except IndexException as ex:
+        raise UsageError(str(ex), click.get_current_context(silent=True))
+    finally:
+        index.close()
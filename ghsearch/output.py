@@ -1,11 +1,14 @@
+import importlib
 from collections import defaultdict
-from typing import IO, Dict, List, Type
-from urllib import parse
+from typing import IO, Any, Dict, Iterable, List, Type
 
-from github.ContentFile import ContentFile
+from ghsearch.results import SearchResult, compact_results
 
 
 class Printer:
+    EXTENSION = "txt"  # of files the output is written to
+    PRINTS_SIZE = False  # whether results' sizes are looked up, which is a request per result no content filter read
+
     @staticmethod
     def sanitize_qualifiers_for_search_url(query: List[str]) -> List[str]:
         return [q for q in query if not (q.startswith("repo:") or q.startswith("org:"))]
@@ -13,18 +16,47 @@ class Printer:
     def __init__(self, stream: IO) -> None:
         self._stream = stream
 
-    def print(self, query: List[str], results: List[ContentFile]) -> None:
+    def print(self, query: List[str], results: Iterable[Any]) -> None:
+        """Prints results (ContentFile, or any object with the same attributes), held as compact SearchResults"""
         results_per_repo = defaultdict(list)
-        for result in results:
+        for result in compact_results(results, self.PRINTS_SIZE):
             results_per_repo[result.repository.full_name].append(result)
         self._print(query, results_per_repo)
         self._stream.flush()
 
-    def _print(self, query: List[str], results_per_repo: Dict[str, List[ContentFile]]) -> None:
+    def _print(self, query: List[str], results_per_repo: Dict[str, List[SearchResult]]) -> None:
+        raise NotImplementedError()
+
+
+class StreamingPrinter(Printer):
+    """Prints each result as soon as it is received, instead of waiting for all results to be grouped by repo"""
+
+    def print(self, query: List[str], results: Iterable[Any]) -> None:
+        self._start(query)
+        for result in compact_results(results, self.PRINTS_SIZE):
+            self._print_result(result)
+            self._stream.flush()
+
+    def _start(self, query: List[str]) -> None:
+        pass
+
+    def _print_result(self, result: SearchResult) -> None:
         raise NotImplementedError()
 
 
-_REGISTRY: Dict[str, Type[Printer]] = {}
+# printers by name, as classes or as the "module:class" paths of the built in ones, which are imported when used so
+# that running the cli only loads the printer (and serialisation library) it prints with
+_REGISTRY: Dict[str, Type[Printer] | str] = {
+    "default": "ghsearch.printers.text:DefaultPrinter",
+    "repo-list": "ghsearch.printers.text:RepoListPrinter",
+    "json": "ghsearch.printers.structured:JsonPrinter",
+    "yaml": "ghsearch.printers.structured:YamlPrinter",
+    "jsonl": "ghsearch.printers.structured:JsonLinesPrinter",
+    "yaml-stream": "ghsearch.printers.structured:YamlStreamPrinter",
+    "msgpack": "ghsearch.printers.binary:MsgpackPrinter",
+    "msgpack-gzip": "ghsearch.printers.binary:GzipMsgpackPrinter",
+    "msgpack-zstd": "ghsearch.printers.binary:ZstdMsgpackPrinter",
+}
 
 
 def register_printer(cls: Type[Printer]) -> Type[Printer]:
@@ -41,98 +73,19 @@ def printers_list() -> List[str]:
     return list(_REGISTRY.keys())
 
 
-def printer_factory(name: str, stream: IO, force_repo_list_printer: bool = False) -> Printer:
-    if force_repo_list_printer:
-        return RepoListPrinter(stream)
-    return _REGISTRY[name](stream)
-
-
-@register_printer
-class DefaultPrinter(Printer):
-    NAME = "default"
-
-    def _print(self, query: List[str], results_per_repo: Dict[str, List[ContentFile]]) -> None:
-        if len(results_per_repo) == 0:
-            self._stream.write("No results!\n")
-            self._stream.write(
-                "(For limitations of GitHub's code search see https://docs.github.com/en/github/"
-                "searching-for-information-on-github/searching-code#considerations-for-code-search)\n"
-            )
-            return
-
-        sorted_results = sorted(results_per_repo.items(), key=lambda kv: len(kv[1]), reverse=True)
-
-        q_param = parse.quote(" ".join(self.sanitize_qualifiers_for_search_url(query)))
-        self._stream.write("Results:\n")
-        for repo, repo_results in sorted_results:
-            repo_result = repo_results[0]
-            url = f"{repo_result.repository.html_url}/search?utf8=✓&q={q_param}"
-            self._stream.write(f" {len(repo_results)} - {repo}: {url}\n")
-
-            repo_results.sort(key=lambda x: x.path)
-            for result in repo_results:
-                self._stream.write(f"\t- {result.path}\n")
-
-
-@register_printer
-class RepoListPrinter(Printer):
-    NAME = "repo-list"
-
-    def _print(self, query: List[str], results_per_repo: Dict[str, List[ContentFile]]) -> None:
-        for repo in results_per_repo:
-            self._stream.write(repo + "\n")
-
-
-class StructuredPrinter(Printer):
-    def _print(self, query: List[str], results_per_repo: Dict[str, List[ContentFile]]) -> None:
-        self._print_serialise([self._build_repo_results(results_per_repo[repo]) for repo in results_per_repo])
-
-    @classmethod
-    def _build_repo_results(cls, results: List[ContentFile]) -> Dict:
-        repo = results[0].repository
-        return {
-            "full_name": repo.full_name,
-            "html_url": repo.html_url,
-            "fork": repo.fork,
-            "owner": repo.owner.login,
-            "name": repo.name,
-            "results": cls._build_results(results),
-        }
-
-    @classmethod
-    def _build_results(cls, results: List[ContentFile]) -> List[Dict]:
-        return [cls._build_result(result) for result in results]
-
-    @staticmethod
-    def _build_result(result: ContentFile) -> Dict:
-        return {
-            "path": result.path,
-            "name": result.name,
-            "size": result.size,
-            "html_url": result.html_url,
-        }
-
-    def _print_serialise(self, structured_results: List[Dict]) -> None:
-        raise NotImplementedError()
-
+def printer_class(name: str) -> Type[Printer]:
+    entry = _REGISTRY[name]
+    if isinstance(entry, str):
+        module, _, attribute = entry.partition(":")
+        cls: Type[Printer] = getattr(importlib.import_module(module), attribute)
+        _REGISTRY[name] = cls
+        return cls
+    return entry
 
-@register_printer
-class JsonPrinter(StructuredPrinter):
-    NAME = "json"
 
-    def _print_serialise(self, structured_results: List[Dict]) -> None:
-        import json
+def printer_extension(name: str) -> str:
+    return printer_class(name).EXTENSION
 
-        json.dump(structured_results, fp=self._stream)
 
-
-@register_printer
-class YamlPrinter(StructuredPrinter):
-    NAME = "yaml"
-
-    def _print_serialise(self, structured_results: List[Dict]) -> None:
-        from ruamel.yaml import YAML
-
-        yaml = YAML(typ="safe", pure=True)
-        yaml.default_flow_style = False
-        yaml.dump(structured_results, stream=self._stream)
+def printer_factory(name: str, stream: IO, force_repo_list_printer: bool = False) -> Printer:
+    return printer_class("repo-list" if force_repo_list_printer else name)(stream)
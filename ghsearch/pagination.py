@@ -0,0 +1,97 @@
+import threading
+from datetime import datetime, timedelta, timezone
+from queue import Full, Queue
+from typing import Any, Iterator, List
+
+SEARCH_RESULTS_LIMIT = 1000  # the search api will not return results beyond this
+SEARCH_RATE_WINDOW = timedelta(minutes=1)
+
+_DONE = object()
+
+
+def count_pages(total_count: int, per_page: int) -> int:
+    return -(-min(total_count, SEARCH_RESULTS_LIMIT) // per_page)
+
+
+def _seconds_until(reset: datetime) -> float:
+    return max((reset - datetime.now(timezone.utc)).total_seconds(), 0)
+
+
+class SearchQuota:
+    """
+    Counts down the remaining search api requests, and can be shared between threads. Once none are left, acquire()
+    blocks until the rate limit resets (or until `stop` is set).
+    """
+
+    def __init__(self, search_rate: Any, used: int = 0, stop: threading.Event | None = None):
+        self.remaining = search_rate.remaining - used if search_rate else None
+        self.limit = search_rate.limit if search_rate else None
+        self.reset = search_rate.reset if search_rate else None
+        self._stop = stop or threading.Event()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        if self.remaining is None:
+            return
+        with self._lock:
+            if self.remaining <= 0:
+                self._stop.wait(_seconds_until(self.reset))
+                self.remaining = self.limit
+                self.reset += SEARCH_RATE_WINDOW
+            self.remaining -= 1
+
+
+class PagePrefetcher:
+    """
+    Fetches search result pages on a background thread, up to `depth` pages ahead of the consumer, so that search
+    api latency overlaps with filtering. When the search rate limit is known, fetching pauses until it resets rather
+    than running out of quota.
+    """
+
+    def __init__(self, results: Any, num_pages: int, per_page: int, depth: int, search_rate: Any = None):
+        self.results = results
+        self.num_pages = num_pages
+        self.per_page = per_page
+        self._pages: Queue = Queue(maxsize=depth)
+        self._stop = threading.Event()
+        # the search that produced `results` has used one request from the quota already
+        self.quota = SearchQuota(search_rate, used=1, stop=self._stop)
+
+    def __iter__(self) -> Iterator[Any]:
+        thread = threading.Thread(target=self._fetch_pages, name="gh-search-prefetch", daemon=True)
+        thread.start()
+        try:
+            while True:
+                page = self._pages.get()
+                if page is _DONE:
+                    return
+                if isinstance(page, BaseException):
+                    raise page
+                yield from page
+        finally:
+            self._stop.set()
+            thread.join()
+
+    def _fetch_pages(self) -> None:
+        try:
+            for page_number in range(self.num_pages):
+                if page_number > 0:  # the first page was fetched by the search, and is counted in the quota already
+                    self.quota.acquire()
+                if self._stop.is_set():
+                    return
+                page: List[Any] = self.results.get_page(page_number)
+                if not self._put(page) or len(page) < self.per_page:
+                    return
+        except BaseException as e:
+            self._put(e)
+        finally:
+            self._put(_DONE)
+
+    def _put(self, item: Any) -> bool:
+        while not self._stop.is_set():
+            try:
+                self._pages.put(item, timeout=0.1)
+                return True
+            except Full:
+                continue
+        return False
@@ -0,0 +1,67 @@
+from contextlib import nullcontext
+from typing import IO, Any, ContextManager, Iterable, List
+
+import click
+
+from ghsearch.output import Printer
+from ghsearch.printers.structured import StructuredPrinter
+from ghsearch.results import compact_results
+
+
+class MsgpackPrinter(Printer):
+    """
+    A MessagePack map per result, with the same fields as jsonl, for tools that load results without parsing text (eg.
+    with msgpack.Unpacker). Binary, so written to the underlying buffer of text streams such as stdout. Needs the
+    msgpack package (pip install gh-search[msgpack]).
+    """
+
+    NAME = "msgpack"
+    EXTENSION = "msgpack"
+    PRINTS_SIZE = True
+
+    def __init__(self, stream: IO) -> None:
+        try:
+            import msgpack
+        except ImportError:
+            raise click.UsageError(f"The {self.NAME} output needs the msgpack package: pip install gh-search[msgpack]")
+        super().__init__(stream)
+        self._packb = msgpack.packb
+
+    def print(self, query: List[str], results: Iterable[Any]) -> None:
+        self._stream.flush()
+        binary = getattr(self._stream, "buffer", self._stream)
+        with self._open(binary) as out:
+            for result in compact_results(results, self.PRINTS_SIZE):
+                out.write(self._packb(StructuredPrinter._build_result_with_repo(result)))
+        binary.flush()
+
+    def _open(self, binary: IO[bytes]) -> ContextManager[Any]:
+        return nullcontext(binary)
+
+
+class GzipMsgpackPrinter(MsgpackPrinter):
+    NAME = "msgpack-gzip"
+    EXTENSION = "msgpack.gz"
+
+    def _open(self, binary: IO[bytes]) -> ContextManager[Any]:
+        import gzip
+
+        return gzip.GzipFile(fileobj=binary, mode="wb", mtime=0)
+
+
+class ZstdMsgpackPrinter(MsgpackPrinter):
+    """Needs the zstandard package (pip install gh-search[zstd])"""
+
+    NAME = "msgpack-zstd"
+    EXTENSION = "msgpack.zst"
+
+    def __init__(self, stream: IO) -> None:
+        try:
+            import zstandard
+        except ImportError:
+            raise click.UsageError(f"The {self.NAME} output needs the zstandard package: pip install gh-search[zstd]")
+        super().__init__(stream)
+        self._compressor = zstandard.ZstdCompressor()
+
+    def _open(self, binary: IO[bytes]) -> ContextManager[Any]:
+        return self._compressor.stream_writer(binary, closefd=False)
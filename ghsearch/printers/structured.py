@@ -0,0 +1,122 @@
+from typing import Any, Dict, Iterator, List
+
+from ghsearch.output import Printer, StreamingPrinter
+from ghsearch.results import ResultRepository, SearchResult, get_change, get_line_matches
+
+
+class StructuredPrinter(Printer):
+    """
+    Serialises the results of each repository as soon as they're built, and lets them go once written, rather than
+    building the whole output first.
+    """
+
+    PRINTS_SIZE = True
+
+    def _print(self, query: List[str], results_per_repo: Dict[str, List[SearchResult]]) -> None:
+        self._print_serialise(self._build_repo_results(results_per_repo.pop(repo)) for repo in list(results_per_repo))
+
+    @classmethod
+    def _build_repo_results(cls, results: List[SearchResult]) -> Dict:
+        return {**cls._build_repo(results[0].repository), "results": cls._build_results(results)}
+
+    @staticmethod
+    def _build_repo(repo: ResultRepository) -> Dict:
+        return {
+            "full_name": repo.full_name,
+            "html_url": repo.html_url,
+            "fork": repo.fork,
+            "owner": repo.owner.login,
+            "name": repo.name,
+        }
+
+    @classmethod
+    def _build_results(cls, results: List[SearchResult]) -> List[Dict]:
+        return [cls._build_result(result) for result in results]
+
+    @staticmethod
+    def _build_result(result: SearchResult) -> Dict:
+        structured_result: Dict[str, Any] = {
+            "path": result.path,
+            "name": result.name,
+            "size": result.size,
+            "html_url": result.html_url,
+        }
+        change = get_change(result)
+        if change:
+            structured_result["change"] = change
+        line_matches = get_line_matches(result)
+        if line_matches:
+            structured_result["matches"] = [match._asdict() for match in line_matches]
+        return structured_result
+
+    @classmethod
+    def _build_result_with_repo(cls, result: SearchResult) -> Dict:
+        """A result on its own, for formats printing results as they're received"""
+        return {**cls._build_result(result), "repository": cls._build_repo(result.repository)}
+
+    def _print_serialise(self, structured_results: Iterator[Dict]) -> None:
+        raise NotImplementedError()
+
+
+def _safe_yaml() -> Any:
+    """A safe YAML dumper, with the C emitter of ruamel.yaml.clib when it is installed (the pure one is much slower)"""
+    from ruamel.yaml import YAML
+
+    yaml = YAML(typ="safe")
+    yaml.default_flow_style = False
+    return yaml
+
+
+class JsonPrinter(StructuredPrinter):
+    NAME = "json"
+    EXTENSION = "json"
+
+    def _print_serialise(self, structured_results: Iterator[Dict]) -> None:
+        import json
+
+        # the same output as json.dump of the whole list, which would use the slower pure python encoder anyway
+        self._stream.write("[")
+        for i, structured_result in enumerate(structured_results):
+            self._stream.write(", " + json.dumps(structured_result) if i else json.dumps(structured_result))
+        self._stream.write("]")
+
+
+class YamlPrinter(StructuredPrinter):
+    NAME = "yaml"
+    EXTENSION = "yaml"
+
+    def _print_serialise(self, structured_results: Iterator[Dict]) -> None:
+        yaml = _safe_yaml()
+        empty = True
+        for structured_result in structured_results:
+            # the block sequence items of a list dumped one at a time add up to the list dumped at once
+            yaml.dump([structured_result], stream=self._stream)
+            empty = False
+        if empty:
+            yaml.dump([], stream=self._stream)
+
+
+class JsonLinesPrinter(StreamingPrinter):
+    NAME = "jsonl"
+    EXTENSION = "jsonl"
+    PRINTS_SIZE = True
+
+    def _print_result(self, result: SearchResult) -> None:
+        import json
+
+        self._stream.write(json.dumps(StructuredPrinter._build_result_with_repo(result)) + "\n")
+
+
+class YamlStreamPrinter(StreamingPrinter):
+    """Like jsonl: a YAML document per result, written as soon as it is received"""
+
+    NAME = "yaml-stream"
+    EXTENSION = "yaml"
+    PRINTS_SIZE = True
+
+    def _start(self, query: List[str]) -> None:
+        self._yaml = _safe_yaml()
+        self._yaml.explicit_start = True
+
+    def _print_result(self, result: SearchResult) -> None:
+        self._yaml.dump(StructuredPrinter._build_result_with_repo(result), stream=self._stream)
@@ -0,0 +1,69 @@
+from itertools import chain
+from typing import Dict, List, Set
+from urllib import parse
+
+from ghsearch.output import Printer, StreamingPrinter
+from ghsearch.results import LineMatch, SearchResult, get_change, get_line_matches
+
+
+class DefaultPrinter(Printer):
+    NAME = "default"
+
+    def _print(self, query: List[str], results_per_repo: Dict[str, List[SearchResult]]) -> None:
+        if len(results_per_repo) == 0:
+            self._stream.write("No results!\n")
+            self._stream.write(
+                "(For limitations of GitHub's code search see https://docs.github.com/en/github/"
+                "searching-for-information-on-github/searching-code#considerations-for-code-search)\n"
+            )
+            return
+
+        sorted_results = sorted(results_per_repo.items(), key=lambda kv: len(kv[1]), reverse=True)
+
+        q_param = parse.quote(" ".join(self.sanitize_qualifiers_for_search_url(query)))
+        self._stream.write("Results:\n")
+        for repo, repo_results in sorted_results:
+            repo_result = repo_results[0]
+            url = f"{repo_result.repository.html_url}/search?utf8=✓&q={q_param}"
+            self._stream.write(f" {len(repo_results)} - {repo}: {url}\n")
+
+            repo_results.sort(key=lambda x: x.path)
+            for result in repo_results:
+                change = get_change(result)
+                self._stream.write(f"\t- {result.path} ({change})\n" if change else f"\t- {result.path}\n")
+                self._print_line_matches(get_line_matches(result))
+
+    def _print_line_matches(self, line_matches: List[LineMatch]) -> None:
+        """Prints matching lines like `grep -n`: `line:column:` before matches, `line-` before context lines"""
+        lines: Dict[int, str] = {}
+        matched_lines: Set[int] = set()
+        for match in line_matches:
+            if match.line not in matched_lines:
+                matched_lines.add(match.line)
+                lines[match.line] = f"{match.line}:{match.column}:{match.text}"
+            context = chain(
+                enumerate(match.before, match.line - len(match.before)), enumerate(match.after, match.line + 1)
+            )
+            for number, text in context:
+                lines.setdefault(number, f"{number}-{text}")
+
+        with_context = any(match.before or match.after for match in line_matches)
+        previous = None
+        for number in sorted(lines):
+            if with_context and previous is not None and number > previous + 1:
+                self._stream.write("\t\t--\n")
+            self._stream.write(f"\t\t{lines[number]}\n")
+            previous = number
+
+
+class RepoListPrinter(StreamingPrinter):
+    NAME = "repo-list"
+
+    def _start(self, query: List[str]) -> None:
+        self._printed_repos: Set[str] = set()
+
+    def _print_result(self, result: SearchResult) -> None:
+        repo = result.repository.full_name
+        if repo not in self._printed_repos:
+            self._printed_repos.add(repo)
+            self._stream.write(repo + "\n")
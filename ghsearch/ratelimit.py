@@ -0,0 +1,148 @@
+import threading
+import time
+from typing import Any, Callable, Dict, Mapping, TypeVar
+
+CORE = "core"
+SEARCH = "search"
+GRAPHQL = "graphql"
+RATE_LIMIT = "rate_limit"  # checking the rate limit is free
+
+# X-RateLimit-Resource names which differ from those of the buckets
+_HEADER_RESOURCES = {"code_search": SEARCH}
+
+SECONDARY_LIMIT_BACKOFF = 60  # seconds; GitHub asks to wait at least a minute when no Retry-After is given
+MAX_RETRIES = 3
+
+T = TypeVar("T")
+
+
+class BudgetExceededException(Exception):
+    pass
+
+
+def resource_for(url: str) -> str:
+    path = url.split("?", 1)[0].removeprefix("/api/v3")  # the api prefix of GitHub Enterprise Server
+    if path.startswith("/search/"):
+        return SEARCH
+    if path.endswith("/graphql"):
+        return GRAPHQL
+    if path.endswith("/rate_limit"):
+        return RATE_LIMIT
+    return CORE
+
+
+class _Bucket:
+    def __init__(self) -> None:
+        self.remaining: int | None = None
+        self.limit: int | None = None
+        self.reset: float | None = None
+
+
+class RateLimitScheduler:
+    """
+    Paces requests with a token bucket per rate limit resource (core, search, graphql), kept up to date from the
+    X-RateLimit-* headers of every response: once a bucket is empty, requests wait for its reset. Secondary rate
+    limits (403/429) are retried after Retry-After, or with exponential backoff. Optionally, the number of core
+    requests is capped by a budget, as an absolute number and/or a fraction of the core quota remaining at the start.
+    """
+
+    def __init__(
+        self,
+        budget: int | None = None,
+        max_core_fraction: float | None = None,
+        clock: Callable[[], float] = time.time,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.budget = budget
+        self.max_core_fraction = max_core_fraction
+        self.core_used = 0
+        self.graphql_used = 0  # GraphQL has a rate limit of its own, which the budget doesn't cover
+        self.retries = 0
+        self._clock = clock
+        self._sleep = sleep
+        self._buckets: Dict[str, _Bucket] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def has_budget(self) -> bool:
+        return self.budget is not None or self.max_core_fraction is not None
+
+    def apply_core_remaining(self, core_remaining: int) -> int | None:
+        """Turns max_core_fraction into an absolute budget, given the core quota remaining at the start of the run"""
+        if self.max_core_fraction is not None:
+            fraction_budget = int(core_remaining * self.max_core_fraction)
+            self.budget = fraction_budget if self.budget is None else min(self.budget, fraction_budget)
+            self.max_core_fraction = None
+        return self.budget
+
+    def reserve(self, resource: str) -> float:
+        """
+        Takes a token from the resource's bucket, and returns how many seconds to wait before sending. Core requests
+        count against the budget from here on, so that requests in flight on other threads can't overshoot it.
+        """
+        with self._lock:
+            if resource == CORE:
+                if self.budget is not None and self.core_used >= self.budget:
+                    raise BudgetExceededException(f"The budget of {self.budget} core api requests has been used up")
+                self.core_used += 1
+            elif resource == GRAPHQL:
+                self.graphql_used += 1
+            bucket = self._buckets.setdefault(resource, _Bucket())
+            if bucket.remaining is None:
+                return 0
+            delay = 0.0
+            if bucket.remaining <= 0 and bucket.reset is not None:
+                delay = max(bucket.reset - self._clock(), 0)
+                # assume the bucket is refilled after the reset, until responses say otherwise
+                bucket.remaining = bucket.limit or 1
+            bucket.remaining -= 1
+            return delay
+
+    def record(
+        self, resource: str, status: int, headers: Mapping[str, str], body: Any, attempt: int = 0
+    ) -> float | None:
+        """Updates the buckets from a response, and returns how many seconds to wait before retrying it (if at all)"""
+        headers = {name.lower(): value for name, value in headers.items()}
+        with self._lock:
+            if resource == CORE and status == 304:
+                self.core_used -= 1  # GitHub doesn't count 304 Not Modified responses against the rate limit
+            if "x-ratelimit-remaining" in headers:
+                header_resource = headers.get("x-ratelimit-resource", resource)
+                bucket = self._buckets.setdefault(_HEADER_RESOURCES.get(header_resource, header_resource), _Bucket())
+                bucket.remaining = int(headers["x-ratelimit-remaining"])
+                bucket.limit = int(headers.get("x-ratelimit-limit", bucket.limit or 0)) or None
+                bucket.reset = float(headers["x-ratelimit-reset"]) if "x-ratelimit-reset" in headers else bucket.reset
+
+        if status not in (403, 429) or attempt >= MAX_RETRIES:
+            return None
+        if "retry-after" in headers:
+            delay = float(headers["retry-after"])
+        elif headers.get("x-ratelimit-remaining") == "0" and "x-ratelimit-reset" in headers:
+            delay = max(float(headers["x-ratelimit-reset"]) - self._clock(), 0)
+        elif status == 429 or _is_secondary_limit(body):
+            delay = SECONDARY_LIMIT_BACKOFF * 2**attempt
+        else:
+            return None  # eg. missing permissions
+        with self._lock:
+            self.retries += 1
+        return delay
+
+    def send(self, url: str, send: Callable[[], T]) -> T:
+        """Sends a request (a PyGithub style connection response) according to the rate limits"""
+        resource = resource_for(url)
+        attempt = 0
+        while True:
+            self._sleep(self.reserve(resource))
+            response: Any = send()
+            delay = self.record(resource, response.status, dict(response.getheaders()), response.read(), attempt)
+            if delay is None:
+                return response
+            self._sleep(delay)
+            attempt += 1
+
+
+def _is_secondary_limit(body: Any) -> bool:
+    if isinstance(body, bytes):
+        body = body.decode("utf-8", "replace")
+    text = str(body or "").lower()
+    return "secondary rate limit" in text or "abuse" in text
@@ -0,0 +1,150 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, List, NamedTuple
+
+from github.GithubException import GithubException
+
+from ghsearch.client import Client, conditional_get, graphql_query
+from ghsearch.defaults import DEFAULT_REPO_CACHE_TTL
+
+# see https://docs.github.com/en/graphql/overview/rate-limits-and-node-limits-for-the-graphql-api
+MAX_NODES_PER_QUERY = 100
+
+
+class RepoMetadata(NamedTuple):
+    full_name: str
+    archived: bool
+    fork: bool
+    owner: str
+    html_url: str
+
+
+class CachedRepoMetadata(NamedTuple):
+    metadata: RepoMetadata
+    etag: str | None
+    fresh: bool
+
+
+class RepoMetadataCache:
+    """Persists repository metadata between runs in a SQLite database; entries are fresh for `ttl` seconds"""
+
+    def __init__(self, path: str, ttl: float = DEFAULT_REPO_CACHE_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS repositories (full_name TEXT PRIMARY KEY, archived INTEGER, fork INTEGER,"
+                " owner TEXT, html_url TEXT, etag TEXT, fetched_at REAL)"
+            )
+
+    def get(self, full_name: str) -> CachedRepoMetadata | None:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT full_name, archived, fork, owner, html_url, etag, fetched_at FROM repositories"
+                " WHERE full_name = ?",
+                (full_name,),
+            ).fetchone()
+        if row is None:
+            return None
+        full_name, archived, fork, owner, html_url, etag, fetched_at = row
+        metadata = RepoMetadata(full_name, bool(archived), bool(fork), owner, html_url)
+        return CachedRepoMetadata(metadata, etag, time.time() - fetched_at < self.ttl)
+
+    def put(self, metadata: RepoMetadata, etag: str | None = None) -> None:
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO repositories VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (*metadata, etag, time.time()),
+            )
+
+    def touch(self, full_name: str) -> None:
+        with self._lock, self._db:
+            self._db.execute("UPDATE repositories SET fetched_at = ? WHERE full_name = ?", (time.time(), full_name))
+
+
+def metadata_from_rest(data: Dict[str, Any]) -> RepoMetadata:
+    return RepoMetadata(data["full_name"], data["archived"], data["fork"], data["owner"]["login"], data["html_url"])
+
+
+class ArchivedStatusResolver:
+    """
+    Looks up whether repositories are archived, resolving up to MAX_NODES_PER_QUERY of them per GraphQL query.
+    With a metadata cache, fresh entries are used as is and stale ones are revalidated with their etag.
+    """
+
+    def __init__(self, client: Client, metadata_cache: RepoMetadataCache | None = None):
+        self.client = client
+        self.metadata_cache = metadata_cache
+
+    def resolve(self, full_names: Iterable[str]) -> Dict[str, bool]:
+        archived: Dict[str, bool] = {}
+        unresolved = []
+        for full_name in dict.fromkeys(full_names):
+            cached = self.metadata_cache.get(full_name) if self.metadata_cache else None
+            metadata = cached and (cached.metadata if cached.fresh else self._revalidate(cached))
+            if metadata:
+                archived[full_name] = metadata.archived
+            else:
+                unresolved.append(full_name)
+
+        for start in range(0, len(unresolved), MAX_NODES_PER_QUERY):
+            archived.update(self._resolve_batch(unresolved[start : start + MAX_NODES_PER_QUERY]))  # noqa: E203
+        return archived
+
+    def fetch(self, repository: Any) -> bool:
+        """Looks up a single repository via the rest api"""
+        if not self.metadata_cache:
+            return repository.archived
+        cached = self.metadata_cache.get(repository.full_name)
+        metadata = cached and (cached.metadata if cached.fresh else self._revalidate(cached))
+        if metadata:
+            return metadata.archived
+        data, etag = conditional_get(self.client, f"/repos/{repository.full_name}")
+        metadata = metadata_from_rest(data)
+        self.metadata_cache.put(metadata, etag)
+        return metadata.archived
+
+    def _revalidate(self, cached: CachedRepoMetadata) -> RepoMetadata | None:
+        """Returns the current metadata of a stale entry: unchanged (on a 304), or as fetched. None if that failed."""
+        assert self.metadata_cache
+        if not cached.etag:
+            return None
+        try:
+            data, etag = conditional_get(self.client, f"/repos/{cached.metadata.full_name}", cached.etag)
+        except GithubException:
+            return None
+        if data is None:
+            self.metadata_cache.touch(cached.metadata.full_name)
+            return cached.metadata
+        metadata = metadata_from_rest(data)
+        self.metadata_cache.put(metadata, etag)
+        return metadata
+
+    def _resolve_batch(self, full_names: List[str]) -> Dict[str, bool]:
+        # only fetch what's needed to populate the metadata cache when there is one
+        selection = "isArchived isFork url owner { login }" if self.metadata_cache else "isArchived"
+        variables = {}
+        parameters = []
+        fields = []
+        for i, full_name in enumerate(full_names):
+            variables[f"owner{i}"], _, variables[f"name{i}"] = full_name.partition("/")
+            parameters.append(f"$owner{i}: String!, $name{i}: String!")
+            fields.append(f"repo{i}: repository(owner: $owner{i}, name: $name{i}) {{ {selection} }}")
+        query = f"query({', '.join(parameters)}) {{ {' '.join(fields)} }}"
+
+        # repositories that could not be resolved are null (and reported in "errors"), leave those to the rest api
+        data = graphql_query(self.client, query, variables).get("data") or {}
+        archived = {}
+        for i, full_name in enumerate(full_names):
+            repo = data.get(f"repo{i}")
+            if repo:
+                archived[full_name] = repo["isArchived"]
+                if self.metadata_cache:
+                    self.metadata_cache.put(
+                        RepoMetadata(full_name, repo["isArchived"], repo["isFork"], repo["owner"]["login"], repo["url"])
+                    )
+        return archived
@@ -0,0 +1,103 @@
+"""Search results as printed, and the attributes added to them by filters and watch state"""
+
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple
+
+
+class LineMatch(NamedTuple):
+    line: int
+    column: int
+    text: str
+    before: List[str]
+    after: List[str]
+
+
+def get_line_matches(result: Any) -> List[LineMatch]:
+    """The matches found in a result by a content filter, if it was asked to report them"""
+    return getattr(result, "line_matches", None) or []
+
+
+def get_change(result: Any) -> str | None:
+    return getattr(result, "change", None)
+
+
+def get_content_size(result: Any) -> int | None:
+    """The size of a result's content, if a content filter read it (search results don't include their size)"""
+    return getattr(result, "content_size", None)
+
+
+class ResultOwner(NamedTuple):
+    login: str
+
+
+class ResultRepository(NamedTuple):
+    full_name: str
+    name: str
+    owner: ResultOwner
+    html_url: str
+    fork: bool
+
+
+class SearchResult:
+    """
+    The attributes of a result used by printers. Unlike a ContentFile, it holds neither the requester, raw data nor
+    downloaded content, and results from the same repository share their repository. Search results don't include
+    their size, so unless a content filter read the content, it is None unless looked up when compacting.
+    """
+
+    __slots__ = ("repository", "path", "name", "sha", "html_url", "size", "line_matches", "change")
+
+    def __init__(
+        self,
+        repository: ResultRepository,
+        path: str,
+        name: str,
+        sha: str,
+        html_url: str,
+        size: int | None = None,
+        line_matches: List[LineMatch] | None = None,
+        change: str | None = None,
+    ):
+        self.repository = repository
+        self.path = path
+        self.name = name
+        self.sha = sha
+        self.html_url = html_url
+        self.size = size
+        self.line_matches = line_matches
+        self.change = change
+
+    def __repr__(self) -> str:
+        return f"SearchResult({self.repository.full_name}/{self.path}@{self.sha})"
+
+
+def compact_results(results: Iterable[Any], with_size: bool = False) -> Iterator[SearchResult]:
+    """
+    Turns results (ContentFile, or any object with the same attributes) into SearchResults as they're iterated. Sizes
+    content filters didn't read are looked up with_size only, as that is a request per result (and None for results
+    removed since a watch's previous run).
+    """
+    repositories: Dict[str, ResultRepository] = {}
+    for result in results:
+        if isinstance(result, SearchResult):
+            yield result
+            continue
+        repo = result.repository
+        repository = repositories.get(repo.full_name)
+        if repository is None:
+            repository = ResultRepository(
+                repo.full_name, repo.name, ResultOwner(repo.owner.login), repo.html_url, repo.fork
+            )
+            repositories[repo.full_name] = repository
+        size = get_content_size(result)
+        if size is None and with_size:
+            size = result.size
+        yield SearchResult(
+            repository,
+            result.path,
+            result.name,
+            result.sha,
+            result.html_url,
+            size,
+            get_line_matches(result) or None,
+            get_change(result),
+        )
@@ -0,0 +1,111 @@
+import re
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Deque, Dict, Iterator, List, NamedTuple, Set, Tuple
+
+from ghsearch.client import Client, search_code
+from ghsearch.pagination import SEARCH_RESULTS_LIMIT, SearchQuota, count_pages
+
+MAX_INDEXED_FILE_SIZE = 384 * 1024  # larger files are not searchable
+
+_size_qualifier_re = re.compile(r"(^|\s)size:", re.IGNORECASE)
+
+
+class Shard(NamedTuple):
+    query: str
+    results: Any
+    total_count: int
+
+    @property
+    def truncated(self) -> bool:
+        return self.total_count > SEARCH_RESULTS_LIMIT
+
+
+def _result_key(result: Any) -> Tuple[str, str, str]:
+    return result.repository.full_name, result.path, result.sha
+
+
+class ShardedSearch:
+    """
+    Works around the search api returning at most 1000 results per query: a query with more results is split into
+    `size:` ranges, recursively, until each range fits. Shards are fetched on up to `jobs` threads within the search
+    rate limit, and results that show up in more than one shard are only yielded once.
+    """
+
+    def __init__(
+        self,
+        client: Client,
+        query: str,
+        search_params: Dict[str, Any] | None = None,
+        quota: SearchQuota | None = None,
+        jobs: int = 1,
+    ):
+        self.client = client
+        self.search_params = search_params or {}
+        self.quota = quota or SearchQuota(None)
+        self.jobs = jobs
+        self.shards = self._split(query)
+
+    @property
+    def totalCount(self) -> int:
+        return sum(shard.total_count for shard in self.shards)
+
+    @property
+    def truncated_shards(self) -> List[Shard]:
+        return [shard for shard in self.shards if shard.truncated]
+
+    def __iter__(self) -> Iterator[Any]:
+        seen: Set[Tuple[str, str, str]] = set()
+        pending: Deque[Future] = deque()
+        shards = iter(self.shards)
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            try:
+                while True:
+                    for shard in shards:
+                        pending.append(executor.submit(self._fetch, shard))
+                        if len(pending) >= self.jobs * 2:
+                            break
+                    if not pending:
+                        return
+                    for result in pending.popleft().result():
+                        key = _result_key(result)
+                        if key not in seen:
+                            seen.add(key)
+                            yield result
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def _search(self, query: str) -> Shard:
+        self.quota.acquire()
+        results = search_code(self.client, query, **self.search_params)
+        return Shard(query, results, results.totalCount)
+
+    def _split(self, query: str) -> List[Shard]:
+        shard = self._search(query)
+        if not shard.truncated or _size_qualifier_re.search(query):
+            return [shard]
+        return self._split_sizes(query, 0, MAX_INDEXED_FILE_SIZE)
+
+    def _split_sizes(self, query: str, low: int, high: int) -> List[Shard]:
+        middle = (low + high) // 2
+        shards = []
+        for shard_low, shard_high in ((low, middle), (middle + 1, high)):
+            shard = self._search(f"{query} size:{shard_low}..{shard_high}")
+            if shard.truncated and shard_low < shard_high:
+                shards += self._split_sizes(query, shard_low, shard_high)
+            elif shard.total_count:
+                shards.append(shard)
+        return shards
+
+    def _fetch(self, shard: Shard) -> List[Any]:
+        per_page = self.client.per_page
+        results: List[Any] = []
+        for page_number in range(count_pages(shard.total_count, per_page)):
+            if page_number > 0:  # the first page was fetched by the search of the shard, and kept
+                self.quota.acquire()
+            page = shard.results.get_page(page_number)
+            results += page
+            if len(page) < per_page:
+                break
+        return results
@@ -0,0 +1,201 @@
+import json
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from typing import IO, Any, Callable, Dict, Iterable, Iterator, List, TypeVar
+
+import click
+
+LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000)  # upper bounds; slower requests go in a last bucket
+
+T = TypeVar("T")
+
+
+def endpoint_for(method: str, url: str) -> str:
+    """Groups requests by endpoint, eg. `GET /repos/:owner/:repo/contents` for the contents of any file"""
+    parts = url.split("?", 1)[0].removeprefix("/api/v3").strip("/").split("/")
+    if parts[0] == "repos" and len(parts) >= 3:
+        end = 5 if parts[3:4] == ["git"] else 4  # eg. git/blobs
+        parts = ["repos", ":owner", ":repo", *parts[3:end]]
+    elif parts[0] in ("orgs", "users") and len(parts) >= 2:
+        parts = [parts[0], ":owner", *parts[2:3]]
+    return f"{method} /{'/'.join(parts)}"
+
+
+def _latency_bucket(seconds: float) -> str:
+    milliseconds = seconds * 1000
+    for bound in LATENCY_BUCKETS_MS:
+        if milliseconds <= bound:
+            return f"<={bound}ms"
+    return f">{LATENCY_BUCKETS_MS[-1]}ms"
+
+
+class _RequestStats:
+    def __init__(self) -> None:
+        self.count = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.statuses: Counter = Counter()
+        self.latencies: Counter = Counter()
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "bytes": self.bytes,
+            "seconds": self.seconds,
+            "max_seconds": self.max_seconds,
+            "statuses": {str(status): count for status, count in sorted(self.statuses.items())},
+            "latency_histogram": {bucket: self.latencies[bucket] for bucket in _bucket_names()},
+        }
+
+
+def _bucket_names() -> List[str]:
+    return [f"<={bound}ms" for bound in LATENCY_BUCKETS_MS] + [f">{LATENCY_BUCKETS_MS[-1]}ms"]
+
+
+class RunStats:
+    """
+    Timings and counters of a run: the time spent in each stage (excluding the stages nested in it, eg. the search
+    results fetched while printing), the requests made to each endpoint with their size and latency, the evaluations,
+    rejections and time of each filter (summed over jobs), and counters such as cache hits.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.perf_counter):
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.stages: Dict[str, float] = defaultdict(float)
+        self.requests: Dict[str, _RequestStats] = defaultdict(_RequestStats)
+        self.filters: Dict[str, Dict[str, Any]] = {}
+        self.counters: Dict[str, int] = {}
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        stack = self._local.__dict__.setdefault("stack", [])
+        now = self._clock()
+        if stack:
+            self._add_stage(stack[-1][0], now - stack[-1][1])
+        stack.append([name, now])
+        try:
+            yield
+        finally:
+            now = self._clock()
+            _, start = stack.pop()
+            self._add_stage(name, now - start)
+            if stack:
+                stack[-1][1] = now
+
+    def timed(self, name: str, iterable: Iterable[T]) -> Iterator[T]:
+        """Yields from iterable, counting the time spent getting each item as the stage `name`"""
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def record_request(self, method: str, url: str, status: int, size: int, seconds: float) -> None:
+        with self._lock:
+            stats = self.requests[endpoint_for(method, url)]
+            stats.count += 1
+            stats.bytes += size
+            stats.seconds += seconds
+            stats.max_seconds = max(stats.max_seconds, seconds)
+            stats.statuses[status] += 1
+            stats.latencies[_latency_bucket(seconds)] += 1
+
+    def record_filter(self, name: str, seconds: float, passed: bool | None = None) -> None:
+        """Records an evaluation of a filter, or with `passed` left out, the time it took to prepare a batch"""
+        with self._lock:
+            stats = self.filters.setdefault(name, {"evaluated": 0, "rejected": 0, "seconds": 0.0})
+            stats["seconds"] += seconds
+            if passed is not None:
+                stats["evaluated"] += 1
+                stats["rejected"] += not passed
+
+    def count(self, name: str, value: int) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def _add_stage(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.stages[name] += seconds
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "stages": dict(self.stages),
+                "filters": {name: dict(stats) for name, stats in self.filters.items()},
+                "requests": {endpoint: stats.as_dict() for endpoint, stats in sorted(self.requests.items())},
+                "counters": dict(self.counters),
+            }
+
+    def write_json(self, stream: IO) -> None:
+        json.dump(self.as_dict(), stream, indent=2)
+        stream.write("\n")
+
+    def summary(self) -> List[str]:
+        data = self.as_dict()
+        lines = ["Stages:"]
+        lines += [f"  {name:<40} {seconds:9.3f}s" for name, seconds in data["stages"].items()]
+        if data["filters"]:
+            lines.append("Filters (time summed over jobs):")
+            lines += [
+                f"  {name:<40} {stats['seconds']:9.3f}s  evaluated {stats['evaluated']}, rejected {stats['rejected']}"
+                for name, stats in data["filters"].items()
+            ]
+        if data["requests"]:
+            lines.append("Requests:")
+            latencies: Counter = Counter()
+            for endpoint, stats in data["requests"].items():
+                latencies.update(stats["latency_histogram"])
+                mean = stats["seconds"] / stats["count"] * 1000
+                lines.append(
+                    f"  {endpoint:<40} {stats['seconds']:9.3f}s  {stats['count']} requests, {stats['bytes']} bytes,"
+                    f" mean {mean:.0f}ms, max {stats['max_seconds'] * 1000:.0f}ms"
+                )
+            lines.append("Latency: " + ", ".join(f"{bucket}: {latencies[bucket]}" for bucket in _bucket_names()))
+        if data["counters"]:
+            lines.append("Counters:")
+            lines += [f"  {name:<40} {value:>10}" for name, value in data["counters"].items()]
+        return lines
+
+    def echo_summary(self) -> None:
+        for line in self.summary():
+            click.echo(line, err=True)
+
+
+@contextmanager
+def profiled(path: str | None) -> Iterator[None]:
+    """Profiles the block with cProfile (in the calling thread only), and dumps the stats to `path` for pstats"""
+    if not path:
+        yield
+        return
+    import cProfile
+
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        profile.dump_stats(path)
+
+
+@contextmanager
+def collect_stats(summary: bool, json_path: str | None, profile_path: str | None) -> Iterator[RunStats | None]:
+    """Yields the stats to record a run in, if any were asked for, and emits them once it is over (or aborted)"""
+    stats = RunStats() if summary or json_path else None
+    try:
+        with profiled(profile_path):
+            yield stats
+    finally:
+        if stats and summary:
+            stats.echo_summary()
+        if stats and json_path:
+            with click.open_file(json_path, "w") as f:
+                stats.write_json(f)
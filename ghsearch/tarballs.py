@@ -0,0 +1,145 @@
+import hashlib
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+from collections import Counter, defaultdict
+from typing import IO, Callable, Dict, List
+
+from github.ContentFile import ContentFile
+from github.GithubException import GithubException
+
+from ghsearch.client import Client, open_tarball, tarball_url
+from ghsearch.sharding import MAX_INDEXED_FILE_SIZE
+
+# tarballs are downloaded and extracted up to this many bytes, beyond which the contents api is used instead
+MAX_TARBALL_SIZE = 1024 * 1024 * 1024
+
+
+def git_blob_sha(content: bytes) -> str:
+    return hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()
+
+
+class TarballTooLarge(OSError):
+    pass
+
+
+class _LimitedReader:
+    """Reads a response up to `max_size` bytes, counting them"""
+
+    def __init__(self, response: IO[bytes], max_size: int):
+        self._response = response
+        self._max_size = max_size
+        self.read_bytes = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._response.read(size)
+        self.read_bytes += len(data)
+        if self.read_bytes > self._max_size:
+            raise TarballTooLarge(f"Tarball is larger than {self._max_size} bytes")
+        return data
+
+
+class RepoTarballs:
+    """
+    Reads file contents from repository tarballs rather than making a contents api request per file: once more than
+    `threshold` results have come from a repository, its tarball is downloaded (one core api request) and extracted
+    into a temporary directory, from which the files of each batch of results are read. The tarball is of the latest
+    commit of the default branch, which may be newer than the search index, so a file is only used if its git blob sha
+    matches the result's. Contents not claimed by the filter (eg. of results a cheaper filter rejected) are dropped
+    once the next batch but one is prepared, as the checks of the previous batch may still be running.
+
+    The tarball is decompressed as it is downloaded, and only files small enough to be searchable are extracted; a
+    repository whose tarball is larger than `max_size` bytes, compressed or not, falls back to the contents api.
+    """
+
+    def __init__(
+        self,
+        client: Client,
+        threshold: int,
+        open_url: Callable[[str], IO[bytes]] = open_tarball,
+        max_size: int = MAX_TARBALL_SIZE,
+    ):
+        self.client = client
+        self.threshold = threshold
+        self.max_size = max_size
+        self.downloaded = 0
+        self.downloaded_bytes = 0
+        self.files_read = 0
+        self._open_url = open_url
+        self._directory = tempfile.TemporaryDirectory(prefix="gh-search-")
+        self._counts: Counter = Counter()
+        self._tarballs: Dict[str, str | None] = {}  # None for repositories whose tarball could not be downloaded
+        self._contents: Dict[str, bytes] = {}
+        self._previous_contents: Dict[str, bytes] = {}
+        self._lock = threading.Lock()
+
+    def prepare(self, results: List[ContentFile]) -> None:
+        """Reads the contents of results from tarballs, for the repositories with enough results to be worth it"""
+        with self._lock:
+            self._previous_contents, self._contents = self._contents, {}
+        wanted: Dict[str, Dict[str, str]] = defaultdict(dict)
+        for result in results:
+            wanted[result.repository.full_name][result.path] = result.sha
+        for full_name, paths in wanted.items():
+            self._counts[full_name] += len(paths)
+            if full_name not in self._tarballs and self._counts[full_name] > self.threshold:
+                self._tarballs[full_name] = self._download(full_name)
+            path = self._tarballs.get(full_name)
+            if path:
+                self._read(path, paths)
+
+    def get(self, sha: str) -> bytes | None:
+        """Returns the contents of a prepared result, once"""
+        with self._lock:
+            content = self._contents.pop(sha, None)
+            return self._previous_contents.pop(sha, None) if content is None else content
+
+    def close(self) -> None:
+        self._directory.cleanup()
+
+    def _download(self, full_name: str) -> str | None:
+        directory = os.path.join(self._directory.name, full_name.replace("/", "_"))
+        try:
+            url = tarball_url(self.client, full_name)
+            with self._open_url(url) as response:
+                archive = _LimitedReader(response, self.max_size)
+                try:
+                    self._extract(archive, directory)
+                finally:
+                    self.downloaded_bytes += archive.read_bytes
+            self.downloaded += 1
+        except (GithubException, OSError, tarfile.TarError):
+            shutil.rmtree(directory, ignore_errors=True)
+            return None  # the contents api is used instead
+        return directory
+
+    def _extract(self, archive: _LimitedReader, directory: str) -> None:
+        """Extracts the files once, rather than decompressing the whole tarball again for each batch"""
+        extracted_bytes = 0
+        with tarfile.open(fileobj=archive, mode="r|gz") as tar:  # type: ignore[arg-type]
+            for member in tar:
+                # members are prefixed by a single `<owner>-<repo>-<commit>/` directory
+                member.name = member.name.partition("/")[2]
+                if not member.isfile() or not member.name or member.size > MAX_INDEXED_FILE_SIZE:
+                    continue
+                extracted_bytes += member.size
+                if extracted_bytes > self.max_size:
+                    raise TarballTooLarge(f"Tarball extracts to more than {self.max_size} bytes")
+                try:
+                    tar.extract(member, directory, filter="data")
+                except tarfile.FilterError:
+                    continue  # eg. paths outside of the directory
+
+    def _read(self, directory: str, paths: Dict[str, str]) -> None:
+        for path, sha in paths.items():
+            try:
+                with open(os.path.join(directory, path), "rb") as f:
+                    content = f.read()
+            except OSError:
+                continue  # eg. deleted since indexed
+            if git_blob_sha(content) == sha:
+                with self._lock:
+                    self._contents[sha] = content
+                self.files_read += 1
@@ -41,6 +41,11 @@ class ProgressPrinter(contextlib.AbstractContextManager):
             click.echo("\r" + SHOW_CURSOR, nl=False)
         return None
 
+    def clear(self):
+        if self.overwrite and self.last_width:
+            self._overwrite_previous_line()
+            click.echo("\r", nl=False)
+
     def _overwrite_previous_line(self, message=""):
         line_width = _term_len(message)
         click.echo(f"\r{HIDE_CURSOR}{message}{' ' * (self.last_width - line_width)}", nl=False)
@@ -0,0 +1,155 @@
+import hashlib
+import json
+import os
+import threading
+from typing import Any, Callable, Dict, Iterable, Iterator, List, NamedTuple, Sequence, Tuple
+
+from github.ContentFile import ContentFile
+
+from ghsearch.filters import DecodedContentFilter, Filter
+from ghsearch.results import ResultOwner, ResultRepository, get_content_size
+
+STATE_VERSION = 1
+
+ADDED = "added"
+CHANGED = "changed"
+REMOVED = "removed"
+
+
+class RemovedResult(NamedTuple):
+    """A result which matched on the previous run, but not anymore, with the attributes printers use"""
+
+    repository: ResultRepository
+    path: str
+    name: str
+    sha: str
+    size: int | None
+    html_url: str
+    change: str = REMOVED
+
+
+def state_key(query: Sequence[str], *options: Any) -> str:
+    """Identifies a query and the options its results depend on, so that state isn't reused across them"""
+    return hashlib.sha256(json.dumps([list(query), *options], sort_keys=True).encode()).hexdigest()
+
+
+def _result_key(result: Any) -> str:
+    return f"{result.repository.full_name}/{result.path}"
+
+
+def _match_entry(result: Any) -> Dict[str, Any]:
+    """The size is only known if a content filter read the file: looking it up would download it"""
+    repo = result.repository
+    return {
+        "repository": [repo.full_name, repo.name, repo.owner.login, repo.html_url, repo.fork],
+        "path": result.path,
+        "name": result.name,
+        "sha": result.sha,
+        "size": get_content_size(result),
+        "html_url": result.html_url,
+    }
+
+
+def _removed_result(entry: Dict[str, Any]) -> RemovedResult:
+    full_name, name, owner, html_url, fork = entry["repository"]
+    repository = ResultRepository(full_name, name, ResultOwner(owner), html_url, fork)
+    return RemovedResult(repository, entry["path"], entry["name"], entry["sha"], entry["size"], entry["html_url"])
+
+
+class RememberedContentFilter(Filter):
+    """Reuses the verdict of the previous run for files whose sha hasn't changed, instead of downloading them"""
+
+    def __init__(self, content_filter: DecodedContentFilter, state: "WatchState"):
+        self.content_filter = content_filter
+        self.state = state
+        self.uses_core_api = content_filter.uses_core_api
+        self.uses_text_matches = content_filter.uses_text_matches
+        self.cost = content_filter.cost
+
+    @property
+    def avoided_core_calls(self) -> int:  # type: ignore[override]
+        return self.content_filter.avoided_core_calls
+
+    def prepare(self, results: List[ContentFile]) -> None:
+        self.content_filter.prepare([result for result in results if self.state.previous_verdict(result) is None])
+
+    def estimate_core_calls(self, num_results: int, sample: Sequence[ContentFile] = ()) -> int:
+        return self.content_filter.estimate_core_calls(num_results, sample)
+
+    def __call__(self, result: ContentFile) -> bool:
+        verdict = self.state.previous_verdict(result)
+        if verdict is None:
+            verdict = self.content_filter(result)
+        else:
+            with self.state.lock:
+                self.state.reused += 1
+        self.state.record_verdict(result, verdict)
+        return verdict
+
+
+class WatchState:
+    """
+    The results of the previous run of a query, persisted to a json file: the sha and content filter verdict of each
+    file checked, and the files which matched. Files whose sha hasn't changed are not checked again, and only the
+    results which were added, changed or removed since are reported.
+    """
+
+    def __init__(self, path: str, key: str):
+        self.path = path
+        self.key = key
+        self.reused = 0
+        self.lock = threading.Lock()
+        self._verdicts: Dict[str, Tuple[str, bool]] = {}
+        self._matches: Dict[str, Dict[str, Any]] = {}
+        self._previous_verdicts: Dict[str, Tuple[str, bool]] = {}
+        self._previous_matches: Dict[str, Dict[str, Any]] = {}
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        if data.get("version") == STATE_VERSION and data.get("key") == key:
+            self._previous_verdicts = {name: tuple(verdict) for name, verdict in data["verdicts"].items()}
+            self._previous_matches = data["matches"]
+
+    def remember(self, filters: List[Filter]) -> List[Filter]:
+        return [RememberedContentFilter(f, self) if isinstance(f, DecodedContentFilter) else f for f in filters]
+
+    def previous_verdict(self, result: ContentFile) -> bool | None:
+        sha, verdict = self._previous_verdicts.get(_result_key(result), (None, None))
+        return verdict if sha == result.sha else None
+
+    def record_verdict(self, result: ContentFile, verdict: bool) -> None:
+        with self.lock:
+            self._verdicts[_result_key(result)] = (result.sha, verdict)
+
+    def changes(self, results: Iterable[ContentFile], complete: Callable[[], bool] = lambda: True) -> Iterator[Any]:
+        """
+        Yields the results which are new or changed, followed by the previous matches which are gone. If the results
+        turn out not to be `complete`, the previous matches (and verdicts) not seen are kept rather than reported gone.
+        """
+        for result in results:
+            key = _result_key(result)
+            previous = self._previous_matches.get(key)
+            if previous is not None and previous["sha"] == result.sha:
+                self._matches[key] = previous
+                continue
+            self._matches[key] = _match_entry(result)
+            setattr(result, "change", ADDED if previous is None else CHANGED)
+            yield result
+        if not complete():
+            with self.lock:
+                self._verdicts = {**self._previous_verdicts, **self._verdicts}
+            self._matches = {**self._previous_matches, **self._matches}
+            return
+        for key, entry in self._previous_matches.items():
+            if key not in self._matches:
+                yield _removed_result(entry)
+
+    def save(self) -> None:
+        data = {"version": STATE_VERSION, "key": self.key, "verdicts": self._verdicts, "matches": self._matches}
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(temp_path, self.path)
@@ -1,17 +1,35 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from types import SimpleNamespace
 from unittest.mock import Mock
+from urllib import parse
 
 from github.ContentFile import ContentFile
 
 
 class MockPaginatedList:
-    def __init__(self, *items, total_count=None):
+    def __init__(self, *items, total_count=None, per_page=100):
         self.items = items
         self.totalCount = total_count if total_count else len(items)
+        self.per_page = per_page
 
     def __iter__(self):
         return iter(self.items)
 
+    def get_page(self, page):
+        return list(self.items[page * self.per_page : (page + 1) * self.per_page])  # noqa: E203
+
+
+def build_mock_filter(side_effect=None, return_value=True, uses_core_api=True, cost=10):
+    mock = Mock(side_effect=side_effect, return_value=return_value)
+    mock.uses_core_api = uses_core_api
+    mock.uses_text_matches = False
+    mock.cost = cost
+    mock.avoided_core_calls = 0
+    mock.estimate_core_calls.side_effect = lambda num_results, sample=(): num_results if uses_core_api else 0
+    return mock
+
 
 class MockRateLimit:
     def __init__(self, core_remaining, core_limit, core_reset, search_remaining, search_limit, search_reset):
@@ -20,9 +38,15 @@ class MockRateLimit:
 
 
 def build_mock_content_file(
-    repo_full_name: str = "org/repo", path: str = "path", archived: bool = False, decoded_content: bytes = b""
+    repo_full_name: str = "org/repo",
+    path: str = "path",
+    archived: bool = False,
+    decoded_content: bytes = b"",
+    sha: str | None = None,
+    text_matches: list | None = None,
 ):
     mock = Mock(spec=ContentFile)
+    mock.text_matches = text_matches
     mock.repository.name = repo_full_name.split("/")[1]
     mock.repository.owner.login = repo_full_name.split("/")[0]
     mock.repository.full_name = repo_full_name
@@ -30,8 +54,98 @@ def build_mock_content_file(
     mock.repository.html_url = f"https://www.github.com/{repo_full_name}"
     mock.repository.fork = False
     mock.path = path
+    mock.sha = sha
     mock.decoded_content = decoded_content
     mock.name = path.split("/").pop()
     mock.size = 1000
     mock.html_url = f"https://www.github.com/{repo_full_name}/blob/master/{path}"
     return mock
+
+
+def build_search_item(repo, path, url):
+    return {
+        "name": path.split("/").pop(),
+        "path": path,
+        "sha": "a" * 40,
+        "url": f"{url}/repos/{repo}/contents/{path}?ref=main",
+        "html_url": f"https://www.github.com/{repo}/blob/main/{path}",
+        "repository": {
+            "full_name": repo,
+            "name": repo.split("/")[1],
+            "html_url": f"https://www.github.com/{repo}",
+            "fork": False,
+            "owner": {"login": repo.split("/")[0]},
+        },
+    }
+
+
+def capped_last_link(url):
+    """Like GitHub, the search api's `last` link of pages of one result stops at the 1000th result"""
+    return {"Link": f'<{url}/search/code?q=query&per_page=1&page=1000>; rel="last"'}
+
+
+class StubGitHub:
+    def __init__(self):
+        self.routes = {}
+        self.etags = {}
+        self.headers = {}
+        self.requests = []
+        self.bodies = []
+        self.connections = 0
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                with stub.lock:
+                    stub.connections += 1
+
+            def do_GET(self):
+                url = parse.urlsplit(self.path)
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                with stub.lock:
+                    stub.requests.append((url.path, parse.parse_qs(url.query), dict(self.headers)))
+                    stub.bodies.append(json.loads(body) if body else None)
+                route = stub.routes.get(url.path)
+                if callable(route):
+                    route = route(parse.parse_qs(url.query))
+                status, data = route or (404, {"message": "Not Found"})
+                etag = stub.etags.get(url.path)
+                if etag and self.headers.get("If-None-Match") == etag:
+                    status, data = 304, None
+                body = json.dumps(data).encode() if status != 304 else b""
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                if etag:
+                    self.send_header("ETag", etag)
+                for name, value in stub.headers.get(url.path, {}).items():
+                    self.send_header(name, value)
+                if status == 304:
+                    self.end_headers()
+                elif status == 200 and url.path.endswith("chunked"):
+                    self.send_header("Transfer-Encoding", "chunked")
+                    self.end_headers()
+                    for chunk in (body[:5], body[5:]):
+                        self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+                    self.wfile.write(b"0\r\n\r\n")
+                else:
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+            do_POST = do_GET
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/api/v3"
+        threading.Thread(target=self.server.serve_forever, args=(0.01,), daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
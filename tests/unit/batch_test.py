@@ -0,0 +1,128 @@
+from io import StringIO
+from unittest.mock import Mock, call
+
+import click
+import pytest
+from github import GithubException
+
+from ghsearch.batch import QuerySpec, load_specs, run_batch
+from ghsearch.main import Session
+from ghsearch.ratelimit import BudgetExceededException
+
+
+def test_load_specs_list():
+    specs = load_specs(StringIO('- org:org "a b"\n- query: [org:org, c]\n  name: c query\n  output: json\n'))
+    assert specs == [
+        QuerySpec("query1", ["org:org", "a b"]),
+        QuerySpec("c_query", ["org:org", "c"], output="json"),
+    ]
+
+
+def test_load_specs_with_defaults():
+    specs = load_specs(
+        StringIO(
+            "defaults:\n  output: jsonl\n  include_archived: true\n"
+            "queries:\n  - query: a\n    regex_content_filter: a+\n  - query: b\n    output: yaml\n"
+        )
+    )
+    assert specs == [
+        QuerySpec("query1", ["a"], output="jsonl", regex_content_filter="a+", include_archived=True),
+        QuerySpec("query2", ["b"], output="yaml", include_archived=True),
+    ]
+
+
+@pytest.mark.parametrize(
+    "content, message",
+    [
+        ("a: b", "The queries file must contain a list of queries"),
+        ("- query: a\n  filter: b", "Query 1 has unknown keys: filter"),
+        ("- name: a", "Query 1 has no query"),
+        ("- [a]", "Query 1 must be a string or a mapping"),
+        (
+            "- query: a\n  output: xml",
+            "Query 1 output must be one of: default, repo-list, json, yaml, jsonl, yaml-stream, msgpack, msgpack-gzip,"
+            " msgpack-zstd",
+        ),
+        ("- query: a\n  name: x\n- query: b\n  name: x", "Query names must be unique: x"),
+    ],
+)
+def test_load_specs_invalid(content, message):
+    with pytest.raises(click.UsageError, match=message):
+        load_specs(StringIO(content))
+
+
+@pytest.fixture
+def mock_session():
+    mock = Mock(spec=Session)
+    mock.search.side_effect = lambda query, printer, *args: printer.print(query, [])
+    mock.budget_exceeded = None
+    return mock
+
+
+def test_run_batch_writes_each_query_to_its_own_file(tmp_path, assert_click_echo_calls, mock_session):
+    specs = [QuerySpec("a", ["a"], output="jsonl"), QuerySpec("b", ["b"], output="json", shard=True)]
+    run_batch(specs, mock_session, str(tmp_path / "out"), prefetch_pages=1)
+
+    assert (tmp_path / "out" / "a.jsonl").read_text() == ""
+    assert (tmp_path / "out" / "b.json").read_text() == "[]"
+    assert [c.args[0] for c in mock_session.search.call_args_list] == [["a"], ["b"]]
+    assert mock_session.search.call_args.args[2:] == (
+        None,
+        None,
+        None,
+        False,
+        False,
+        1,
+        True,
+        False,
+        "utf-8",
+        False,
+        None,
+        None,
+    )
+    assert_click_echo_calls(call("Running a: a", err=True), call("Running b: b", err=True))
+
+
+def test_run_batch_keeps_state_per_query(tmp_path, mock_click_echo, mock_session):
+    run_batch([QuerySpec("a", ["a"]), QuerySpec("b", ["b"])], mock_session, str(tmp_path), state_dir="state")
+    assert [c.args[-1] for c in mock_session.search.call_args_list] == ["state/a.json", "state/b.json"]
+
+
+def test_run_batch_continues_after_a_failed_query(tmp_path, mock_click_echo, mock_session):
+    mock_session.search.side_effect = [click.UsageError("Bad!"), GithubException(500, "Oops"), None]
+    specs = [QuerySpec("a", ["a"]), QuerySpec("b", ["b"]), QuerySpec("c", ["c"])]
+
+    with pytest.raises(click.ClickException, match="2 of 3 queries failed: a, b"):
+        run_batch(specs, mock_session, str(tmp_path))
+
+    assert mock_session.search.call_count == 3
+    mock_click_echo.assert_any_call("Error: a failed: Bad!", err=True)
+    mock_click_echo.assert_any_call('Error: b failed: 500 "Oops"', err=True)
+
+
+def test_run_batch_stops_when_budget_is_exceeded(tmp_path, mock_click_echo, mock_session):
+    mock_session.search.side_effect = BudgetExceededException("Used up")
+
+    with pytest.raises(click.ClickException, match="Used up; stopped at a"):
+        run_batch([QuerySpec("a", ["a"]), QuerySpec("b", ["b"])], mock_session, str(tmp_path))
+
+    assert mock_session.search.call_count == 1
+
+
+def test_run_batch_stops_after_a_query_cut_short_by_the_budget(tmp_path, mock_click_echo, mock_session):
+    def search(query, printer, *args):
+        printer.print(query, [])
+        mock_session.budget_exceeded = BudgetExceededException("Used up")
+
+    mock_session.search.side_effect = search
+
+    with pytest.raises(click.ClickException, match="Used up; stopped at a"):
+        run_batch([QuerySpec("a", ["a"]), QuerySpec("b", ["b"])], mock_session, str(tmp_path))
+
+    assert mock_session.search.call_count == 1
+    assert (tmp_path / "a.txt").exists()
+
+
+def test_run_batch_verbose_echoes_stats(tmp_path, mock_click_echo, mock_session):
+    run_batch([QuerySpec("a", ["a"])], mock_session, str(tmp_path), verbose=True)
+    mock_session.echo_stats.assert_called_once_with()
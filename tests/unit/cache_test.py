@@ -0,0 +1,160 @@
+import os
+
+import pytest
+
+from ghsearch.cache import BlobCache, CachedResponse, ResponseCache, cache_key, is_cacheable_url
+
+SHA_1 = "1" * 40
+SHA_2 = "2" * 40
+SHA_3 = "3" * 40
+
+
+@pytest.fixture
+def cache_dir(tmp_path):
+    return str(tmp_path / "blobs")
+
+
+def test_blob_cache_get_missing(cache_dir):
+    cache = BlobCache(cache_dir, 100)
+    assert cache.get(SHA_1) is None
+    assert (cache.hits, cache.misses) == (0, 1)
+
+
+def test_blob_cache_put_and_get(cache_dir):
+    BlobCache(cache_dir, 100).put(SHA_1, b"content")
+
+    cache = BlobCache(cache_dir, 100)
+    assert cache.get(SHA_1) == b"content"
+    assert (cache.hits, cache.misses) == (1, 0)
+    assert os.path.exists(os.path.join(cache_dir, "11", "1" * 38))
+
+
+@pytest.mark.parametrize("sha", [None, "", "not-a-sha", "../" + "1" * 37])
+def test_blob_cache_ignores_invalid_sha(cache_dir, sha):
+    cache = BlobCache(cache_dir, 100)
+    cache.put(sha, b"content")
+
+    assert cache.get(sha) is None
+    assert os.listdir(cache_dir) == []
+
+
+def test_blob_cache_ignores_content_larger_than_max_size(cache_dir):
+    cache = BlobCache(cache_dir, 5)
+    cache.put(SHA_1, b"content")
+
+    assert cache.get(SHA_1) is None
+
+
+def test_blob_cache_evicts_least_recently_used(cache_dir):
+    cache = BlobCache(cache_dir, 10)
+    cache.put(SHA_1, b"1111")
+    cache.put(SHA_2, b"2222")
+    os.utime(cache._path(SHA_1), (1, 1))
+    os.utime(cache._path(SHA_2), (2, 2))
+    cache.put(SHA_3, b"3333")
+
+    assert cache.get(SHA_1) is None
+    assert cache.get(SHA_2) == b"2222"
+    assert cache.get(SHA_3) == b"3333"
+
+
+def test_blob_cache_accounts_for_existing_entries(cache_dir):
+    BlobCache(cache_dir, 10).put(SHA_1, b"1111")
+    os.utime(BlobCache(cache_dir, 10)._path(SHA_1), (1, 1))
+
+    cache = BlobCache(cache_dir, 10)
+    cache.put(SHA_2, b"222222222")
+
+    assert cache.get(SHA_1) is None
+    assert cache.get(SHA_2) == b"222222222"
+
+
+def test_blob_cache_put_replace(cache_dir):
+    cache = BlobCache(cache_dir, 100)
+    cache.put(SHA_1, b"old")
+    cache.put(SHA_1, b"ignored")
+    cache.put(SHA_1, b"replaced", replace=True)
+
+    assert cache.get(SHA_1) == b"replaced"
+    assert cache._size == len(b"replaced")
+
+
+def test_response_cache_put_and_get(cache_dir):
+    ResponseCache(cache_dir, 1000, "token").put("host/url", {"ETag": 'W/"abc"', "Date": "today"}, b"body\nlines")
+
+    cached = ResponseCache(cache_dir, 1000, "token").get("host/url")
+
+    assert cached == ({"etag": 'W/"abc"', "date": "today"}, b"body\nlines")
+    assert cached.validators == {"If-None-Match": 'W/"abc"'}
+    assert ResponseCache(cache_dir, 1000, "other-token").get("host/url") is None
+    assert ResponseCache(cache_dir, 1000, "token").get("host/other") is None
+
+
+def test_response_cache_validators(cache_dir):
+    cache = ResponseCache(cache_dir, 1000)
+    cache.put("host/url", {"Last-Modified": "yesterday"}, b"body")
+    cache.put("host/no-validators", {"Date": "today"}, b"body")
+
+    assert cache.get("host/url").validators == {"If-Modified-Since": "yesterday"}
+    assert cache.get("host/no-validators") is None
+
+
+def test_blob_cache_evicts_below_max_size(cache_dir):
+    cache = BlobCache(cache_dir, 100)
+    for i, (sha, size) in enumerate([(SHA_1, 5), (SHA_2, 40), (SHA_3, 40)]):
+        cache.put(sha, b"x" * size)
+        os.utime(cache._path(sha), (i, i))
+
+    cache.put("4" * 40, b"x" * 20)
+
+    assert cache.get(SHA_1) is None
+    assert cache.get(SHA_2) is None
+    assert cache.get(SHA_3) is not None
+    assert cache._size == 60
+
+
+def test_blob_cache_totals_its_size_on_the_first_put(cache_dir, mocker):
+    BlobCache(cache_dir, 100).put(SHA_1, b"1111")
+    cache = BlobCache(cache_dir, 100)
+    walk = mocker.spy(os, "walk")
+
+    assert cache.get(SHA_1) == b"1111"
+    walk.assert_not_called()
+
+    cache.put(SHA_2, b"2222")
+    walk.assert_called_once()
+    assert cache._size == 8
+
+
+def test_cache_key_varies_with_accept_header():
+    keys = {
+        cache_key("host:443", "/search/code?q=a", headers)
+        for headers in [None, {"Authorization": "token"}, {"Accept": "a"}, {"accept": "a"}, {"Accept": "b"}]
+    }
+
+    assert keys == {
+        "host:443/search/code?q=a",
+        "host:443/search/code?q=a\naccept: a",
+        "host:443/search/code?q=a\naccept: b",
+    }
+
+
+@pytest.mark.parametrize(
+    "url, expected",
+    [
+        ("/api/v3/repos/org/repo", True),
+        ("/api/v3/repos/org/repo/contents/src/contents/a.txt?ref=main", False),
+        ("/repos/org/repo/git/blobs/abc", False),
+        ("/search/code?q=contents", True),
+    ],
+)
+def test_is_cacheable_url(url, expected):
+    assert is_cacheable_url(url) is expected
+
+
+def test_cached_response_refresh():
+    cached = CachedResponse({"etag": "abc", "content-length": "4", "x-ratelimit-remaining": "10"}, b"body")
+
+    refreshed = cached.refresh({"X-RateLimit-Remaining": "9", "Content-Length": "0"})
+
+    assert refreshed == ({"etag": "abc", "content-length": "4", "x-ratelimit-remaining": "9"}, b"body")
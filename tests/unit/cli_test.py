@@ -0,0 +1,37 @@
+import subprocess
+import sys
+
+import pytest
+
+# PyGithub alone used to take about 200ms to import, which every invocation (even --help) paid for
+IMPORT_TIME_BUDGET_CLICK_RATIO = 4
+HEAVY_MODULES = {"github", "requests", "urllib3", "asyncio", "sqlite3", "ruamel", "ghsearch.printers"}
+
+
+def _run_python(code, *args):
+    return subprocess.run([sys.executable, *args, "-c", code], capture_output=True, text=True, check=True)
+
+
+@pytest.mark.parametrize("command", ["cli", "batch_cli", "index_cli"])
+def test_help_does_not_import_heavy_modules(command):
+    code = f"""
+import sys
+from ghsearch.cli import {command}
+try:
+    {command}(["--help"])
+except SystemExit:
+    pass
+print(" ".join(sys.modules), file=sys.stderr)
+"""
+    imported = _run_python(code).stderr.split()
+    heavy = {name for name in imported if any(name == m or name.startswith(f"{m}.") for m in HEAVY_MODULES)}
+    assert heavy == set()
+
+
+def test_import_time_budget():
+    # -X importtime lines are: "import time: self [us] | cumulative | imported package"
+    lines = _run_python("import ghsearch.cli", "-X", "importtime").stderr.splitlines()
+    fields = [line.split("|") for line in lines]
+    cumulative = {package.strip(): int(us) for _, us, package in fields[1:]}
+    # relative to click, which the cli needs anyway, so that the budget holds on slower machines too
+    assert cumulative["ghsearch.cli"] < IMPORT_TIME_BUDGET_CLICK_RATIO * cumulative["click"]
@@ -1,8 +1,19 @@
-from unittest.mock import patch
+import subprocess
+import sys
+import threading
+from unittest.mock import Mock, patch
 
 import pytest
+from github import GithubException
 
-from ghsearch.client import build_client
+from ghsearch.async_client import AsyncGithub
+from ghsearch.cache import ResponseCache
+from ghsearch.client import SERVER_ERROR_RETRY, build_client, conditional_get, graphql_query, search_code, tarball_url
+from ghsearch.defaults import BACKENDS
+from ghsearch.ratelimit import BudgetExceededException, RateLimitScheduler
+from ghsearch.stats import RunStats
+
+from . import StubGitHub, build_search_item, capped_last_link
 
 
 @pytest.fixture
@@ -32,3 +43,216 @@ def test_build_client_passes_expected_parameters_defaults_github(mock_github):
         login_or_token="foo-token",
         per_page=100,
     )
+
+
+def test_build_client_with_pool_size_passes_expected_parameters(mock_github):
+    with patch("ghsearch.client._install_connection_class") as mock_install_connection_class:
+        build_client("foo-token", pool_size=4)
+
+    mock_github.assert_called_once_with(login_or_token="foo-token", per_page=100, pool_size=4)
+    mock_install_connection_class.assert_called_once_with(mock_github.return_value, None, None, None)
+
+
+def test_build_client_with_pool_size_shares_connection_between_threads():
+    client = build_client("foo-token", pool_size=2)
+    requester = client._Github__requester
+    connection = requester._Requester__connectionClass(requester.hostname, None)
+
+    connection.request("GET", "/main", None, {})
+    thread = threading.Thread(target=connection.request, args=("POST", "/other", None, {}))
+    thread.start()
+    thread.join()
+
+    assert (connection.verb, connection.url) == ("GET", "/main")
+
+
+def test_build_client_with_scheduler_leaves_retries_to_it(mock_github):
+    with patch("ghsearch.client._install_connection_class"):
+        build_client("foo-token", scheduler=RateLimitScheduler())
+
+    mock_github.assert_called_once_with(login_or_token="foo-token", per_page=100, retry=SERVER_ERROR_RETRY)
+    assert 403 not in SERVER_ERROR_RETRY.status_forcelist
+
+
+def test_build_client_with_prefetching_installs_thread_safe_connection(mock_github):
+    with patch("ghsearch.client._install_connection_class") as mock_install_connection_class:
+        build_client("foo-token", prefetch_pages=2)
+
+    mock_install_connection_class.assert_called_once_with(mock_github.return_value, None, None, None)
+
+
+def test_build_client_async_backend(mock_github):
+    with patch("ghsearch.async_client.AsyncGithub", autospec=True) as mock_async_github:
+        client = build_client("foo-token", "https://github.example.org/api/v3", backend="async", max_in_flight=5)
+
+    assert client == mock_async_github.return_value
+    mock_async_github.assert_called_once_with(
+        "foo-token", "https://github.example.org/api/v3", 100, 5, None, None, None
+    )
+    mock_github.assert_not_called()
+
+
+def test_build_client_imports_the_async_backend_only_when_selected():
+    code = "import sys; from ghsearch.client import build_client; build_client('token'); print(sorted(sys.modules))"
+    modules = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+
+    assert "ghsearch.async_client" not in modules
+
+
+def test_graphql_query_with_pygithub_client():
+    client = build_client("foo-token", "https://github.example.org/api/v3")
+    with patch.object(client._Github__requester, "requestJsonAndCheck") as mock_request:
+        mock_request.return_value = ({}, {"data": {"viewer": {"login": "me"}}})
+
+        assert graphql_query(client, "query { viewer { login } }", {}) == {"data": {"viewer": {"login": "me"}}}
+
+    mock_request.assert_called_once_with(
+        "POST", "https://github.example.org/api/graphql", input={"query": "query { viewer { login } }", "variables": {}}
+    )
+
+
+def test_graphql_query_with_async_client():
+    client = Mock(spec=AsyncGithub)
+
+    assert graphql_query(client, "query { }", {"a": 1}) == client.graphql.return_value
+    client.graphql.assert_called_once_with("query { }", {"a": 1})
+
+
+@pytest.mark.parametrize(
+    "etag, response, expected",
+    [
+        (None, ({"etag": 'W/"new"'}, {"archived": True}), ({"archived": True}, 'W/"new"')),
+        ('W/"old"', ({"etag": 'W/"new"'}, {"archived": True}), ({"archived": True}, 'W/"new"')),
+        ('W/"old"', ({}, None), (None, 'W/"old"')),
+    ],
+)
+def test_conditional_get_with_pygithub_client(etag, response, expected):
+    client = build_client("foo-token")
+    with patch.object(client._Github__requester, "requestJsonAndCheck") as mock_request:
+        mock_request.return_value = response
+
+        assert conditional_get(client, "/repos/org/repo", etag) == expected
+
+    mock_request.assert_called_once_with("GET", "/repos/org/repo", headers={"If-None-Match": etag} if etag else None)
+
+
+def test_conditional_get_with_async_client():
+    client = Mock(spec=AsyncGithub)
+
+    assert conditional_get(client, "/repos/org/repo", "etag") == client.conditional_get.return_value
+    client.conditional_get.assert_called_once_with("/repos/org/repo", "etag")
+
+
+@pytest.mark.parametrize("pool_size", [None, 2])
+def test_build_client_with_response_cache_revalidates_requests(tmp_path, pool_size):
+    stub = StubGitHub()
+    stub.routes["/api/v3/repos/org/repo"] = (200, {"full_name": "org/repo", "archived": True})
+    stub.etags["/api/v3/repos/org/repo"] = 'W/"abc"'
+    response_cache = ResponseCache(str(tmp_path), 1024, "foo-token")
+    try:
+        for _ in range(2):
+            client = build_client("foo-token", stub.url, pool_size=pool_size, response_cache=response_cache)
+            assert client.get_repo("org/repo").archived is True
+    finally:
+        stub.close()
+
+    assert "If-None-Match" not in stub.requests[0][2]
+    assert stub.requests[1][2]["If-None-Match"] == 'W/"abc"'
+    assert response_cache.not_modified == 1
+
+
+def test_build_client_with_response_cache_refreshes_rate_limit_headers(tmp_path):
+    stub = StubGitHub()
+    stub.routes["/api/v3/repos/org/repo"] = (200, {"full_name": "org/repo", "archived": True})
+    stub.etags["/api/v3/repos/org/repo"] = 'W/"abc"'
+    client = build_client("foo-token", stub.url, response_cache=ResponseCache(str(tmp_path), 1024, "foo-token"))
+    try:
+        for remaining in ("10", "9"):
+            stub.headers["/api/v3/repos/org/repo"] = {"X-RateLimit-Remaining": remaining, "X-RateLimit-Limit": "60"}
+            client.get_repo("org/repo")
+    finally:
+        stub.close()
+
+    assert stub.requests[1][2]["If-None-Match"] == 'W/"abc"'
+    assert client.rate_limiting == (9, 60)
+
+
+def test_build_client_with_scheduler_enforces_budget():
+    stub = StubGitHub()
+    stub.routes["/api/v3/repos/org/repo"] = (200, {"full_name": "org/repo", "archived": True})
+    client = build_client("foo-token", stub.url, scheduler=RateLimitScheduler(budget=1))
+    try:
+        assert client.get_repo("org/repo").archived is True
+        with pytest.raises(BudgetExceededException):
+            client.get_repo("org/repo")
+    finally:
+        stub.close()
+
+    assert len(stub.requests) == 1
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_build_client_with_stats_records_requests(backend):
+    stub = StubGitHub()
+    stub.routes["/api/v3/repos/org/repo"] = (200, {"full_name": "org/repo", "archived": True})
+    stats = RunStats()
+    client = build_client("foo-token", stub.url, backend=backend, stats=stats)
+    try:
+        conditional_get(client, "/repos/org/repo")
+        with pytest.raises(GithubException):
+            conditional_get(client, "/repos/org/other")
+    finally:
+        client.close()
+        stub.close()
+
+    assert set(stats.requests) == {"GET /repos/:owner/:repo"}
+    requests = stats.requests["GET /repos/:owner/:repo"]
+    assert requests.count == 2
+    assert requests.statuses == {200: 1, 404: 1}
+    assert requests.bytes > len('{"full_name": "org/repo", "archived": true}')
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_tarball_url(backend):
+    stub = StubGitHub()
+    stub.routes["/api/v3/repos/org/repo/tarball"] = (302, None)
+    stub.headers["/api/v3/repos/org/repo/tarball"] = {"Location": "https://codeload.example.org/org/repo/tar.gz/main"}
+    client = build_client("foo-token", stub.url, backend=backend)
+    try:
+        assert tarball_url(client, "org/repo") == "https://codeload.example.org/org/repo/tar.gz/main"
+    finally:
+        client.close()
+        stub.close()
+
+    assert [path for path, _, _ in stub.requests] == ["/api/v3/repos/org/repo/tarball"]
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_tarball_url_at_ref(backend):
+    stub = StubGitHub()
+    stub.routes["/api/v3/repos/org/repo/tarball/abc123"] = (302, None)
+    stub.headers["/api/v3/repos/org/repo/tarball/abc123"] = {"Location": "https://codeload.example.org/abc123"}
+    client = build_client("foo-token", stub.url, backend=backend)
+    try:
+        assert tarball_url(client, "org/repo", "abc123") == "https://codeload.example.org/abc123"
+    finally:
+        client.close()
+        stub.close()
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_search_code_total_count_is_not_capped(backend):
+    stub = StubGitHub()
+    items = [build_search_item("org/repo", f"{i}.txt", stub.url) for i in range(2)]
+    stub.routes["/api/v3/search/code"] = (200, {"total_count": 5000, "incomplete_results": False, "items": items})
+    stub.headers["/api/v3/search/code"] = capped_last_link(stub.url)
+    client = build_client("foo-token", stub.url, backend=backend)
+    try:
+        results = search_code(client, "query")
+        assert results.totalCount == 5000
+        assert [result.path for result in results] == ["0.txt", "1.txt"]
+    finally:
+        client.close()
+        stub.close()
+
+    assert len(stub.requests) == 1
@@ -1,9 +1,24 @@
-from unittest.mock import PropertyMock
+from unittest.mock import Mock, PropertyMock
 
 import pytest
 from github.GithubException import GithubException
 
-from ghsearch.filters import ContentFilter, FilterException, NotArchivedFilter, PathFilter, RegexContentFilter
+from ghsearch.cache import BlobCache
+from ghsearch.filters import (
+    COST_FREE,
+    COST_PER_REPO,
+    COST_PER_RESULT,
+    ContentFilter,
+    FilterException,
+    MultiPatternContentFilter,
+    NotArchivedFilter,
+    PathFilter,
+    RegexContentFilter,
+    _line_matches,
+    is_ascii_compatible,
+)
+from ghsearch.repositories import ArchivedStatusResolver
+from ghsearch.results import LineMatch, get_line_matches
 
 from . import build_mock_content_file
 
@@ -111,3 +126,308 @@ def test_not_archived_filter_caches_access_to_archived_property():
     archived1_1.assert_called_once()
     archived1_2.assert_not_called()
     archived2_1.assert_called_once()
+
+
+def test_content_filter_reads_from_blob_cache():
+    blob_cache = Mock(spec=BlobCache)
+    blob_cache.get.return_value = b"cached content"
+    content_filter = ContentFilter("cached", blob_cache)
+    mock_content_file = build_mock_content_file(sha="abc")
+    type(mock_content_file).decoded_content = PropertyMock(side_effect=AssertionError("should not download"))
+
+    assert content_filter(mock_content_file) is True
+    assert mock_content_file.content_size == len(b"cached content")
+    blob_cache.get.assert_called_once_with("abc")
+    blob_cache.put.assert_not_called()
+
+
+def test_regex_content_filter_writes_to_blob_cache():
+    blob_cache = Mock(spec=BlobCache)
+    blob_cache.get.return_value = None
+    content_filter = RegexContentFilter("down.oad", blob_cache)
+    mock_content_file = build_mock_content_file(decoded_content=b"downloaded content", sha="abc")
+
+    assert content_filter(mock_content_file) is True
+    blob_cache.put.assert_called_once_with("abc", b"downloaded content")
+
+
+def test_not_archived_filter_prepare_resolves_uncached_repos():
+    resolved = []
+
+    def resolve(full_names):
+        resolved.extend(full_names)
+        return {full_name: full_name == "org/repo2" for full_name in resolved}
+
+    resolver = Mock(spec=ArchivedStatusResolver)
+    resolver.resolve.side_effect = resolve
+    not_archived_filter = NotArchivedFilter(resolver)
+    not_archived_filter.cache["org/repo3"] = True
+    results = [
+        build_mock_content_file("org/repo1", "a.txt"),
+        build_mock_content_file("org/repo2", "b.txt"),
+        build_mock_content_file("org/repo3", "c.txt"),
+    ]
+    for result in results:
+        type(result.repository).archived = PropertyMock(side_effect=AssertionError("should not be fetched"))
+
+    not_archived_filter.prepare(results)
+
+    assert [not_archived_filter(result) for result in results] == [True, False, True]
+    assert resolved == ["org/repo1", "org/repo2"]
+
+
+def test_not_archived_filter_prepare_falls_back_on_rest_api():
+    resolver = Mock(spec=ArchivedStatusResolver)
+    resolver.resolve.side_effect = GithubException(502, {"message": "Bad gateway"})
+    not_archived_filter = NotArchivedFilter(resolver)
+    result = build_mock_content_file(archived=True)
+
+    not_archived_filter.prepare([result])
+
+    assert not_archived_filter(result) is False
+    assert not_archived_filter.resolver is None
+
+
+@pytest.mark.parametrize(
+    "resolver, num_results, expected",
+    [
+        (None, 250, 250),
+        (Mock(spec=ArchivedStatusResolver), 250, 0),
+        (Mock(spec=ArchivedStatusResolver), 0, 0),
+    ],
+)
+def test_not_archived_filter_estimate_core_calls(resolver, num_results, expected):
+    assert NotArchivedFilter(resolver).estimate_core_calls(num_results) == expected
+
+
+def test_path_filter_estimate_core_calls():
+    assert PathFilter("path").estimate_core_calls(100) == 0
+
+
+@pytest.mark.parametrize(
+    "result_filter, expected_cost",
+    [
+        (PathFilter("src"), COST_FREE),
+        (NotArchivedFilter(), COST_PER_REPO),
+        (ContentFilter("content"), COST_PER_RESULT),
+        (RegexContentFilter("content"), COST_PER_RESULT),
+    ],
+)
+def test_filter_costs(result_filter, expected_cost):
+    assert result_filter.cost == expected_cost
+
+
+def _text_match(fragment, prop="content"):
+    return {"property": prop, "fragment": fragment, "matches": []}
+
+
+@pytest.mark.parametrize(
+    "content_filter",
+    [ContentFilter("special"), RegexContentFilter("spec.al")],
+)
+def test_content_filters_match_text_match_fragments_without_download(content_filter):
+    result = build_mock_content_file(text_matches=[_text_match("some special fragment")])
+    type(result).decoded_content = PropertyMock(side_effect=AssertionError("should not be downloaded"))
+
+    assert content_filter(result) is True
+    assert content_filter.avoided_core_calls == 1
+
+
+@pytest.mark.parametrize(
+    "content_filter, text_matches",
+    [
+        (ContentFilter("special"), [_text_match("nothing here")]),
+        (ContentFilter("special"), [_text_match("special", prop="path")]),
+        (RegexContentFilter("^special"), [_text_match("special fragment")]),
+        (RegexContentFilter(r"special\b"), [_text_match("special fragment")]),
+        (ContentFilter("special"), None),
+    ],
+)
+def test_content_filters_download_inconclusive_results(content_filter, text_matches):
+    result = build_mock_content_file(decoded_content=b"not it", text_matches=text_matches)
+
+    assert content_filter(result) is False
+    assert content_filter.avoided_core_calls == 0
+
+
+def test_content_filter_estimate_core_calls_from_sample():
+    sample = [build_mock_content_file(text_matches=[_text_match("special")])] + [build_mock_content_file()] * 3
+
+    assert ContentFilter("special").estimate_core_calls(100) == 100
+    assert ContentFilter("special").estimate_core_calls(100, sample) == 75
+
+
+@pytest.mark.parametrize(
+    "literals, patterns, match_any, content, expected_result",
+    [
+        (["foo", "bar"], [], False, b"foo and bar", True),
+        (["foo", "bar"], [], False, b"foo only", False),
+        (["foo", "bar"], [], True, b"foo only", True),
+        (["foo"], ["ba[rz]"], True, b"neither", False),
+        (["foo"], ["ba[rz]"], False, b"baz then foo", True),
+        # overlapping matches: the scan consumes "abc", so "bcd" is checked on its own
+        (["abc", "bcd"], [], False, b"abcd", True),
+        (["a.c"], ["a.c"], False, b"a.c", True),
+        (["x"], ["(a)\\1"], False, b"x aa", True),
+        (["x"], ["(a)\\1"], False, b"x ab", False),
+        # inline flags can't be combined into one alternation
+        (["x"], ["(?i)abc"], False, b"x ABC", True),
+    ],
+)
+def test_multi_pattern_content_filter(literals, patterns, match_any, content, expected_result):
+    content_filter = MultiPatternContentFilter(literals, patterns, match_any)
+    assert content_filter(build_mock_content_file(decoded_content=content)) is expected_result
+
+
+def test_multi_pattern_content_filter_combines_patterns():
+    assert MultiPatternContentFilter(["a+"], ["b+"]).combined_pattern.pattern == "(?P<p0>a\\+)|(?P<p1>b+)"
+    assert MultiPatternContentFilter(["a"], ["(?i)b"]).combined_pattern is None
+
+
+def test_multi_pattern_content_filter_invalid_regex():
+    with pytest.raises(FilterException, match="Failed to compile regular expression from '\\['"):
+        MultiPatternContentFilter(["a"], ["["])
+
+
+@pytest.mark.parametrize(
+    "literals, patterns, match_any, fragments, expected_avoided",
+    [
+        (["foo", "bar"], [], False, ["foo", "some bar"], 1),
+        (["foo", "bar"], [], False, ["foo"], 0),
+        (["foo", "bar"], [], True, ["foo"], 1),
+        (["foo$"], ["bar$"], False, ["foo$", "bar"], 0),
+        (["foo$"], ["bar$"], True, ["foo$"], 1),
+    ],
+)
+def test_multi_pattern_content_filter_text_match_fragments(literals, patterns, match_any, fragments, expected_avoided):
+    content_filter = MultiPatternContentFilter(literals, patterns, match_any)
+    result = build_mock_content_file(
+        decoded_content=b"foo$ bar", text_matches=[_text_match(fragment) for fragment in fragments]
+    )
+
+    assert content_filter(result) is True
+    assert content_filter.avoided_core_calls == expected_avoided
+
+
+@pytest.mark.parametrize(
+    "content_filter, content, expected_result",
+    [
+        # not valid utf-8, but ascii patterns are matched against the raw bytes
+        (ContentFilter("special"), b"\xff special", True),
+        (RegexContentFilter("spec.al"), b"special", True),
+        # . matches a whole character, so non-ascii content is decoded first
+        (RegexContentFilter("spec.al"), "specéal".encode(), True),
+        (RegexContentFilter("spec\\wal"), "specéal".encode(), True),
+        (ContentFilter("é"), "specéal".encode(), True),
+        (ContentFilter("é", encoding="latin-1"), "specéal".encode("latin-1"), True),
+        (ContentFilter("é"), b"\xff special", False),
+        (MultiPatternContentFilter(["\xff"], ["spec.al"]), "\xff specéal".encode(), True),
+        (MultiPatternContentFilter(["special", "other"], [], True), b"\xff special", True),
+    ],
+)
+def test_content_filters_encoding(content_filter, content, expected_result):
+    assert content_filter(build_mock_content_file(decoded_content=content)) is expected_result
+
+
+def test_content_filters_match_ascii_patterns_without_decoding():
+    assert ContentFilter("special").can_match_bytes(b"\xff special")
+    assert ContentFilter("special").matches_content(b"\xff special")
+    assert not ContentFilter("é").can_match_bytes("é".encode())
+    assert not ContentFilter("special", encoding="utf-16").can_match_bytes(b"special")
+    assert RegexContentFilter("spec.al").can_match_bytes(b"special")
+    assert RegexContentFilter("spec.al").matches_content(b"special")
+    assert not RegexContentFilter("spec.al").can_match_bytes("specéal".encode())
+    assert MultiPatternContentFilter(["a", "b"]).can_match_bytes(b"\xff a b")
+    assert MultiPatternContentFilter(["a", "b"]).matches_content(b"\xff a b")
+    assert not MultiPatternContentFilter(["a"], ["b"]).can_match_bytes(b"\xff a b")
+
+
+@pytest.mark.parametrize(
+    "encoding, expected_result",
+    [
+        ("utf-8", True),
+        ("latin-1", True),
+        ("cp1252", True),
+        ("ascii", True),
+        # the second byte of a character can be an ASCII one
+        ("shift_jis", False),
+        ("cp932", False),
+        ("gbk", False),
+        ("big5", False),
+        # ASCII escape sequences switch character sets
+        ("iso2022_jp", False),
+        ("utf-16", False),
+        ("nope", False),
+    ],
+)
+def test_is_ascii_compatible(encoding, expected_result):
+    assert is_ascii_compatible(encoding) is expected_result
+
+
+def test_content_filters_do_not_match_ascii_patterns_inside_multibyte_characters():
+    # 表 is encoded as b"\x95\\" in shift_jis
+    content = "表".encode("shift_jis")
+    assert b"\\" in content
+    assert not ContentFilter("\\", encoding="shift_jis")(build_mock_content_file(decoded_content=content))
+    assert not RegexContentFilter("\\\\", encoding="shift_jis")(build_mock_content_file(decoded_content=content))
+    assert ContentFilter("表", encoding="shift_jis")(build_mock_content_file(decoded_content=content))
+
+
+def test_content_filter_unknown_encoding():
+    with pytest.raises(FilterException, match="Unknown encoding 'nope'"):
+        ContentFilter("special", encoding="nope")
+
+
+@pytest.mark.parametrize(
+    "content_filter",
+    [
+        ContentFilter("foo", context=1),
+        RegexContentFilter("fo{2}", context=1),
+        MultiPatternContentFilter(["foo"], ["fo{2}"], context=1),
+    ],
+)
+@pytest.mark.parametrize(
+    "content", [b"zero\r\nfoo\r\ntwo\r\nthree\r\nfour foo", "zero\r\nfoo\r\ntwo\r\nthree\r\nfour foo"]
+)
+def test_content_filters_report_line_matches(content_filter, content):
+    if isinstance(content, str):
+        content = content.replace("zero", "zéro").encode()
+    result = build_mock_content_file(decoded_content=content, text_matches=[_text_match("foo")])
+
+    assert content_filter(result) is True
+    assert content_filter.avoided_core_calls == 0
+    assert get_line_matches(result) == [
+        LineMatch(2, 1, "foo", [content.decode().split("\r\n")[0]], ["two"]),
+        LineMatch(5, 6, "four foo", ["three"], []),
+    ]
+
+
+@pytest.mark.parametrize(
+    "content, expected_after",
+    [
+        (b"a\nfoo\n", []),
+        ("a\nfoo\n", []),
+        (b"a\nfoo\n\n", [""]),
+        (b"a\nfoo\nb\n", ["b"]),
+    ],
+)
+def test_line_matches_stop_at_the_end_of_the_content(content, expected_after):
+    assert _line_matches(content, [(2, 5)], 2, "utf-8") == [LineMatch(2, 1, "foo", ["a"], expected_after)]
+
+
+def test_content_filters_report_columns_in_characters():
+    result = build_mock_content_file(decoded_content="é foo".encode())
+    assert ContentFilter("foo", context=0)(result) is True
+    assert get_line_matches(result) == [LineMatch(1, 3, "é foo", [], [])]
+
+
+def test_content_filters_report_no_line_matches_without_context():
+    result = build_mock_content_file(decoded_content=b"foo")
+    assert ContentFilter("foo")(result) is True
+    assert get_line_matches(result) == []
+
+
+def test_multi_pattern_content_filter_reports_no_line_matches_unless_all_match():
+    result = build_mock_content_file(decoded_content=b"foo")
+    assert MultiPatternContentFilter(["foo", "bar"], context=0)(result) is False
+    assert get_line_matches(result) == []
@@ -5,8 +5,9 @@ import pytest
 
 from ghsearch.filters import FilterException
 from ghsearch.gh_search import GHSearch
+from ghsearch.ratelimit import BudgetExceededException, RateLimitScheduler
 
-from . import MockPaginatedList, MockRateLimit, build_mock_content_file
+from . import MockPaginatedList, MockRateLimit, build_mock_content_file, build_mock_filter
 
 
 @pytest.fixture
@@ -59,7 +60,7 @@ def test_get_filtered_results_without_filters(mock_client, mock_result_1, mock_r
 
 
 def test_get_filtered_results_with_filters(mock_client, mock_result_1, mock_result_2, mock_result_3):
-    ghsearch = GHSearch(mock_client, [Mock(side_effect=[True, False, True])])
+    ghsearch = GHSearch(mock_client, [build_mock_filter([True, False, True])])
     repos = ghsearch.get_filtered_results(["query", "org:bort"])
 
     assert repos == [mock_result_1, mock_result_3]
@@ -68,7 +69,7 @@ def test_get_filtered_results_with_filters(mock_client, mock_result_1, mock_resu
 def test_get_filtered_results_with_exception_when_filtering(mock_client, mock_result_1, mock_progress_printer):
     mock_client.search_code.return_value = MockPaginatedList(mock_result_1)
 
-    ghsearch = GHSearch(mock_client, [Mock(side_effect=FilterException(Mock(), "BOOO"))])
+    ghsearch = GHSearch(mock_client, [build_mock_filter(FilterException(Mock(), "BOOO"))])
 
     repos = ghsearch.get_filtered_results(["query", "org:bort"])
 
@@ -78,7 +79,7 @@ def test_get_filtered_results_with_exception_when_filtering(mock_client, mock_re
 
 def test_get_filtered_results_verbose(mock_client, mock_result_1, mock_result_2, mock_result_3, mock_click):
     ghsearch = GHSearch(
-        mock_client, [Mock(side_effect=[True, True, False]), Mock(side_effect=[False, True, False])], verbose=True
+        mock_client, [build_mock_filter([True, True, False]), build_mock_filter([False, True, False])], verbose=True
     )
 
     repos = ghsearch.get_filtered_results(["query", "org:bort"])
@@ -90,8 +91,7 @@ def test_get_filtered_results_verbose(mock_client, mock_result_1, mock_result_2,
 
 def test_get_filtered_results_near_limit(mock_client, mock_click):
     mock_client.get_rate_limit.return_value = MockRateLimit(1, 10, "sometime in the future", 10, 10, "now")
-    mock_filter = Mock()
-    mock_filter.uses_core_api = True
+    mock_filter = build_mock_filter()
 
     ghsearch = GHSearch(mock_client, [mock_filter])
     ghsearch.get_filtered_results(["query", "org:bort"])
@@ -111,8 +111,7 @@ Do you want to continue?""".strip(),
 def test_get_filtered_results_many_calls(mock_client, mock_click):
     mock_client.get_rate_limit.return_value = MockRateLimit(10000, 10000, "sometime in the future", 10, 10, "now")
     mock_client.search_code.return_value = MockPaginatedList(*[], total_count=257)
-    mock_filter = Mock()
-    mock_filter.uses_core_api = True
+    mock_filter = build_mock_filter()
 
     ghsearch = GHSearch(mock_client, [mock_filter, mock_filter])
     ghsearch.get_filtered_results(["query", "org:bort"])
@@ -139,3 +138,176 @@ def test_get_filtered_results_rate_limiting_disabled(mock_client):
 
     # ensure get_rate_limit was called (and the side_effect above handled)
     mock_client.get_rate_limit.assert_called()
+
+
+def test_get_filtered_results_concurrently(mock_client, mock_result_1, mock_result_2, mock_result_3):
+    mock_client.search_code.return_value = MockPaginatedList(
+        mock_result_1,
+        mock_result_2,
+        mock_result_3,
+        *[build_mock_content_file("org/repo3", f"{i}.txt") for i in range(7)],
+    )
+    keep = {mock_result_1, mock_result_3}
+    ghsearch = GHSearch(mock_client, [build_mock_filter(lambda result: result in keep)], jobs=3)
+
+    repos = ghsearch.get_filtered_results(["query", "org:bort"])
+
+    assert repos == [mock_result_1, mock_result_3]
+
+
+def test_get_filtered_results_concurrently_with_exception_when_filtering(
+    mock_client, mock_result_1, mock_result_2, mock_result_3, mock_progress_printer
+):
+    def _filter(result):
+        if result is mock_result_2:
+            raise FilterException(Mock(), "BOOO")
+        return True
+
+    ghsearch = GHSearch(mock_client, [build_mock_filter(_filter)], jobs=2)
+
+    repos = ghsearch.get_filtered_results(["query", "org:bort"])
+
+    assert repos == [mock_result_1, mock_result_3]
+    mock_progress_printer.return_value.__enter__.return_value.assert_any_call("BOOO", force=True)
+
+
+def test_iter_filtered_results_yields_results_as_they_pass_filters(mock_client, mock_result_1, mock_result_2):
+    mock_filter = build_mock_filter()
+    ghsearch = GHSearch(mock_client, [mock_filter])
+
+    results = ghsearch.iter_filtered_results(["query", "org:bort"])
+
+    assert next(results) == mock_result_1
+    mock_filter.assert_called_once_with(mock_result_1)
+    assert next(results) == mock_result_2
+
+
+def test_get_filtered_results_prefetching_pages(mock_client):
+    results = [build_mock_content_file("org/repo", f"{i}.txt") for i in range(5)]
+    mock_client.per_page = 2
+    mock_client.search_code.return_value = MockPaginatedList(*results, per_page=2)
+
+    ghsearch = GHSearch(mock_client, [], prefetch_pages=1)
+
+    assert ghsearch.get_filtered_results(["query", "org:bort"]) == results
+
+
+def test_get_filtered_results_prepares_filters_in_batches(mock_client):
+    results = [build_mock_content_file("org/repo", f"{i}.txt") for i in range(250)]
+    mock_client.search_code.return_value = MockPaginatedList(*results)
+    mock_filter = build_mock_filter()
+
+    GHSearch(mock_client, [mock_filter]).get_filtered_results(["query"])
+
+    assert [call.args[0] for call in mock_filter.prepare.call_args_list] == [
+        results[:100],
+        results[100:200],
+        results[200:],
+    ]
+
+
+def test_get_filtered_results_many_results_with_batched_core_calls(mock_client, mock_click):
+    mock_client.get_rate_limit.return_value = MockRateLimit(10000, 10000, "sometime in the future", 10, 10, "now")
+    mock_client.search_code.return_value = MockPaginatedList(*[], total_count=900)
+    mock_filter = build_mock_filter()
+    mock_filter.estimate_core_calls.side_effect = lambda num_results, sample: -(-num_results // 100)
+
+    GHSearch(mock_client, [mock_filter]).get_filtered_results(["query", "org:bort"])
+
+    mock_click.confirm.assert_not_called()
+
+
+def test_get_filtered_results_runs_cheap_filters_first(mock_client, mock_result_1, mock_result_2, mock_result_3):
+    expensive_filter = build_mock_filter(cost=10)
+    cheap_filter = build_mock_filter(lambda result: result is not mock_result_2, cost=0)
+
+    ghsearch = GHSearch(mock_client, [expensive_filter, cheap_filter])
+
+    assert ghsearch.get_filtered_results(["query"]) == [mock_result_1, mock_result_3]
+    assert [call.args[0] for call in expensive_filter.call_args_list] == [mock_result_1, mock_result_3]
+
+
+def test_get_filtered_results_reorders_filters_by_rejection_rate(mock_client):
+    results = [build_mock_content_file("org/repo", f"{i}.txt") for i in range(200)]
+    mock_client.search_code.return_value = MockPaginatedList(*results)
+    rarely_rejects = build_mock_filter(lambda result: result is not results[0])
+    usually_rejects = build_mock_filter(lambda result: result is results[0])
+
+    ghsearch = GHSearch(mock_client, [rarely_rejects, usually_rejects])
+
+    assert ghsearch.get_filtered_results(["query"]) == []
+    # the first batch runs in the given order, the second starts with the more selective filter
+    assert rarely_rejects.call_count == 100
+    assert usually_rejects.call_count == 199
+
+
+def test_get_filtered_results_uses_text_matches(mock_client, mock_click, mock_result_1, mock_result_2, mock_result_3):
+    mock_filter = build_mock_filter()
+    mock_filter.uses_text_matches = True
+    mock_filter.avoided_core_calls = 2
+
+    GHSearch(mock_client, [mock_filter], verbose=True).get_filtered_results(["query"])
+
+    mock_client.search_code.assert_called_once_with(query="query", highlight=True)
+    mock_filter.estimate_core_calls.assert_called_once_with(3, [mock_result_1, mock_result_2, mock_result_3])
+    mock_click.echo.assert_any_call("Avoided 2 core api call(s) using search text matches")
+
+
+def test_get_filtered_results_warns_when_truncated(mock_client, mock_click):
+    mock_client.search_code.return_value = MockPaginatedList(total_count=1500)
+
+    GHSearch(mock_client, []).get_filtered_results(["query"])
+
+    mock_click.echo.assert_called_once_with(
+        "Warning: 'query' matched 1500 results, only 1000 of them can be retrieved"
+        " (use --shard to retrieve all of them)",
+        err=True,
+    )
+
+
+def test_get_filtered_results_sharded(mock_client, mock_click, mock_result_1, mock_result_2, mock_result_3):
+    mock_client.per_page = 100
+    mock_client.search_code.side_effect = lambda query: (
+        MockPaginatedList(mock_result_1, mock_result_2, mock_result_3, total_count=1500)
+        if "size:" not in query
+        else (
+            MockPaginatedList(mock_result_1, mock_result_2) if "size:0.." in query else MockPaginatedList(mock_result_3)
+        )
+    )
+
+    results = GHSearch(mock_client, [], shard=True, jobs=2).get_filtered_results(["query"])
+
+    assert results == [mock_result_1, mock_result_2, mock_result_3]
+    assert mock_client.search_code.call_count == 3
+    mock_click.echo.assert_not_called()
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_get_filtered_results_stops_when_budget_is_exceeded(mock_client, mock_result_1, jobs):
+    exceeded = BudgetExceededException("Used up")
+    mock_filter = build_mock_filter(side_effect=[True, exceeded, True])
+    ghsearch = GHSearch(mock_client, [mock_filter], jobs=jobs)
+
+    assert ghsearch.get_filtered_results(["query"]) == [mock_result_1]
+    assert ghsearch.budget_exceeded is exceeded
+
+
+@pytest.mark.parametrize(
+    "scheduler, expected_warning",
+    [
+        (RateLimitScheduler(budget=5), None),
+        (RateLimitScheduler(budget=2), "Warning: gh-search may make up to 3 core api requests, but will stop after 2"),
+        (
+            RateLimitScheduler(max_core_fraction=0.2),
+            "Warning: gh-search may make up to 3 core api requests, but will stop after 2",
+        ),
+    ],
+)
+def test_get_filtered_results_with_budget_does_not_ask(mock_client, mock_click, scheduler, expected_warning):
+    GHSearch(mock_client, [build_mock_filter()], scheduler=scheduler).get_filtered_results(["query"])
+
+    mock_click.confirm.assert_not_called()
+    if expected_warning:
+        mock_click.echo.assert_called_once_with(expected_warning, err=True)
+    else:
+        mock_click.echo.assert_not_called()
@@ -0,0 +1,218 @@
+import io
+import tarfile
+from unittest.mock import Mock, patch
+
+import pytest
+from github import UnknownObjectException
+
+from ghsearch.filters import RegexContentFilter
+from ghsearch.index import IndexException, LocalIndex, _parser_supported, list_repositories, plan_literal, plan_regex
+from ghsearch.tarballs import git_blob_sha
+
+
+def _build_tarball(files):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as tar:
+        for path, content in files.items():
+            member = tarfile.TarInfo(f"org-repo-abc123/{path}")
+            member.size = len(content)
+            tar.addfile(member, io.BytesIO(content))
+    return buffer.getvalue()
+
+
+def _repo(full_name, archived=False):
+    owner = full_name.partition("/")[0]
+    return {
+        "full_name": full_name,
+        "archived": archived,
+        "fork": False,
+        "owner": {"login": owner},
+        "html_url": f"https://github.com/{full_name}",
+        "default_branch": "main",
+    }
+
+
+class FakeRepositories:
+    """Answers the rest api requests made to index repositories, and serves their tarballs"""
+
+    def __init__(self):
+        self.repos = {}
+        self.commits = {}
+        self.tarballs = {}
+        self.requests = []
+
+    def push(self, full_name, commit, files, archived=False):
+        self.repos[full_name] = _repo(full_name, archived)
+        self.commits[full_name] = commit
+        self.tarballs[commit] = _build_tarball(files)
+
+    def conditional_get(self, client, url, etag=None):
+        self.requests.append(url)
+        full_name = url.split("/")[2] + "/" + url.split("/")[3]
+        if url.endswith("/git/ref/heads/main"):
+            data, new_etag = {"object": {"sha": self.commits[full_name]}}, f"ref-{self.commits[full_name]}"
+        else:
+            data, new_etag = self.repos[full_name], f"repo-{self.commits[full_name]}"
+        return (None, etag) if etag == new_etag else (data, new_etag)
+
+    def open_url(self, url):
+        return io.BytesIO(self.tarballs[url])
+
+
+@pytest.fixture
+def fake():
+    fake = FakeRepositories()
+    with (
+        patch("ghsearch.index.conditional_get", side_effect=fake.conditional_get),
+        patch("ghsearch.index.tarball_url", side_effect=lambda client, full_name, ref: ref),
+    ):
+        yield fake
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = LocalIndex(str(tmp_path / "index.sqlite"))
+    yield index
+    index.close()
+
+
+def _search(index, query=(), content_filters=(), regex_content_filters=(), match_any=False):
+    return [
+        (result.repository.full_name, result.path)
+        for result in index.search(query, content_filters, regex_content_filters, match_any)
+    ]
+
+
+@pytest.mark.parametrize(
+    "pattern, expected",
+    [
+        ("abc", ("trigrams", [b"abc"])),
+        ("ab", None),
+        ("a.c", None),
+        (r"foo\.Bar", ("trigrams", [b".ba", b"bar", b"foo", b"o.b", b"oo."])),
+        ("^def [a-z]+_test", ("and", [("trigrams", [b"def", b"ef "]), ("trigrams", [b"_te", b"est", b"tes"])])),
+        ("(abc|defg)h", ("or", [("trigrams", [b"abc"]), ("trigrams", [b"def", b"efg"])])),
+        ("abc|de", None),
+        ("x(abc)+", ("trigrams", [b"abc"])),
+        ("x(abc)*", None),
+        ("(?i)bar", ("trigrams", [b"bar"])),
+        ("(?i)ask", None),
+        ("(?ia)ask", ("trigrams", [b"ask"])),
+        ("(", None),
+    ],
+)
+def test_plan_regex(pattern, expected):
+    assert plan_regex(pattern, "utf-8") == expected
+
+
+@pytest.mark.parametrize(
+    "sre_parse", [None, Mock(parse=Mock(return_value=[("unknown", None)])), Mock(parse=Mock(side_effect=KeyError))]
+)
+def test_plan_regex_scans_every_blob_without_the_regex_parser(sre_parse):
+    _parser_supported.cache_clear()
+    try:
+        with patch("ghsearch.index.sre_parse", sre_parse):
+            assert plan_regex("special", "utf-8") is None
+    finally:
+        _parser_supported.cache_clear()
+
+
+def test_plan_literal():
+    assert plan_literal("é!", "utf-8") == ("trigrams", [b"\xc3\xa9!"])
+    assert plan_literal("é!", "ascii") is None
+
+
+def test_update_and_search(fake, index):
+    fake.push("org/a", "c1", {"README.md": b"Hello World", "src/main.py": b"def main():\n    hello()\n"})
+    fake.push("org/b", "c2", {"docs/hello.txt": b"goodbye", "bin/tool": b"hello\0"})
+
+    assert index.update(Mock(), "org/a", fake.open_url)
+    assert index.update(Mock(), "org/b", fake.open_url)
+
+    assert index.repositories() == ["org/a", "org/b"]
+    assert _search(index, ["hello"]) == [("org/a", "README.md"), ("org/a", "src/main.py")]
+    assert _search(index, ["HELLO", "world"]) == [("org/a", "README.md")]
+    assert _search(index, ["good"]) == [("org/b", "docs/hello.txt")]
+    assert _search(index, ["repo:org/b"]) == [("org/b", "docs/hello.txt")]
+    assert _search(index, ["extension:py"]) == [("org/a", "src/main.py")]
+    assert _search(index, ["filename:README.md"]) == [("org/a", "README.md")]
+    assert _search(index, ["path:src"]) == [("org/a", "src/main.py")]
+    assert _search(index, ["org:other"]) == []
+
+
+def test_search_results(fake, index):
+    fake.push("org/a", "c1", {"src/main.py": b"def main():\n    pass\n"})
+    index.update(Mock(), "org/a", fake.open_url)
+
+    (result,) = index.search(["main"])
+    assert result.name == "main.py"
+    assert result.sha == git_blob_sha(b"def main():\n    pass\n")
+    assert result.size == 21
+    assert result.html_url == "https://github.com/org/a/blob/c1/src/main.py"
+    assert result.decoded_content == b"def main():\n    pass\n"
+    assert result.repository.owner.login == "org"
+    assert result.repository.name == "a"
+    assert not result.repository.archived
+    assert RegexContentFilter(r"main\(\)", context=0)(result)
+
+
+def test_search_narrows_down_by_content_filters(fake, index):
+    fake.push("org/a", "c1", {"a": b"import requests", "b": b"import httpx", "c": b"import os"})
+    index.update(Mock(), "org/a", fake.open_url)
+
+    assert _search(index, [], ["requests"]) == [("org/a", "a")]
+    assert _search(index, [], regex_content_filters=["import (requests|httpx)"]) == [("org/a", "a"), ("org/a", "b")]
+    assert _search(index, [], ["requests"], ["httpx"]) == []
+    assert _search(index, [], ["requests"], ["httpx"], match_any=True) == [("org/a", "a"), ("org/a", "b")]
+    # patterns without trigrams can't narrow anything down
+    assert len(_search(index, [], regex_content_filters=["im.o"])) == 3
+
+
+def test_search_unsupported_qualifier(index):
+    with pytest.raises(IndexException, match="The 'language:' qualifier is not supported by the index"):
+        index.search(["language:python", "foo"])
+
+
+def test_update_is_incremental(fake, index):
+    fake.push("org/a", "c1", {"a.txt": b"first", "b.txt": b"shared"})
+    fake.push("org/b", "c2", {"b.txt": b"shared"})
+    index.update(Mock(), "org/a", fake.open_url)
+    index.update(Mock(), "org/b", fake.open_url)
+
+    assert not index.update(Mock(), "org/a", fake.open_url)
+
+    fake.push("org/a", "c3", {"a.txt": b"second"})
+    assert index.update(Mock(), "org/a", fake.open_url)
+    assert _search(index, ["first"]) == []
+    assert _search(index, ["second"]) == [("org/a", "a.txt")]
+    # the blob is still used by org/b
+    assert _search(index, ["shared"]) == [("org/b", "b.txt")]
+
+    fake.push("org/b", "c4", {"c.txt": b"other"})
+    index.update(Mock(), "org/b", fake.open_url)
+    assert _search(index, ["shared"]) == []
+    assert index._db.execute("SELECT COUNT(*) FROM blobs").fetchone() == (2,)
+    assert index._db.execute("SELECT COUNT(*) FROM trigrams WHERE trigram = ?", (b"sha",)).fetchone() == (0,)
+
+
+def test_update_unchanged_uses_etags(fake, index):
+    fake.push("org/a", "c1", {"a.txt": b"first"})
+    index.update(Mock(), "org/a", fake.open_url)
+
+    with patch.object(fake, "open_url") as mock_open_url:
+        assert not index.update(Mock(), "org/a", mock_open_url)
+    mock_open_url.assert_not_called()
+
+
+def test_list_repositories_falls_back_to_user():
+    def conditional_get(client, url, etag=None):
+        if url.startswith("/orgs/"):
+            raise UnknownObjectException(404, {"message": "Not Found"}, {})
+        page = int(url.rpartition("=")[2])
+        return [{"full_name": f"user/repo{page}-{i}"} for i in range(100 if page == 1 else 1)], None
+
+    with patch("ghsearch.index.conditional_get", side_effect=conditional_get) as mock_get:
+        full_names = list_repositories(Mock(), "user")
+
+    assert len(full_names) == 101
+    assert mock_get.call_args.args[1] == "/users/user/repos?per_page=100&page=2"
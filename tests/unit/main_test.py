@@ -1,11 +1,14 @@
-from unittest.mock import Mock, call, patch
+from unittest.mock import Mock, PropertyMock, call, patch
 
 import click
 import pytest
 from github import BadCredentialsException, Github, GithubException
 
-from ghsearch.main import run
+from ghsearch.main import Session, run, run_index_search, run_index_update
 from ghsearch.output import Printer
+from ghsearch.ratelimit import BudgetExceededException
+from ghsearch.results import LineMatch
+from ghsearch.stats import RunStats
 
 from . import MockPaginatedList, MockRateLimit, build_mock_content_file
 
@@ -36,6 +39,7 @@ def mock_github(
     mock_content_file_repo1_readme, mock_content_file_repo1_file, mock_content_file_repo2_src_other_archived
 ):
     mock = Mock(spec=Github)
+    mock.per_page = 100
     mock.search_code.return_value = MockPaginatedList(
         mock_content_file_repo1_readme,
         mock_content_file_repo1_file,
@@ -55,28 +59,46 @@ def mock_build_client(mock_github):
         yield mock
 
 
+@pytest.fixture(autouse=True)
+def mock_graphql_query():
+    with patch("ghsearch.repositories.graphql_query") as mock:
+        mock.return_value = {
+            "data": {
+                f"repo{i}": {"isArchived": i == 1, "isFork": False, "url": f"url{i}", "owner": {"login": "org"}}
+                for i in range(2)
+            }
+        }
+        yield mock
+
+
 @pytest.fixture()
 def mock_printer():
-    return Mock(spec=Printer)
+    mock = Mock(spec=Printer)
+    mock.printed = []
+    mock.print.side_effect = lambda query, results: mock.printed.append((query, list(results)))
+    return mock
 
 
 def test_run_exclude_archived_by_default(
     assert_click_echo_calls, mock_printer, mock_content_file_repo1_readme, mock_content_file_repo1_file
 ):
     run(["query"], "token", mock_printer)
-    mock_printer.print.assert_called_once_with(
-        ["query"],
-        [
-            mock_content_file_repo1_readme,
-            mock_content_file_repo1_file,
-        ],
-    )
+    assert mock_printer.printed == [
+        (
+            ["query"],
+            [
+                mock_content_file_repo1_readme,
+                mock_content_file_repo1_file,
+            ],
+        )
+    ]
 
 
 def test_run_bad_credentials(assert_click_echo_calls, mock_github, mock_printer):
     mock_github.search_code.side_effect = BadCredentialsException(404, "No!")
     with pytest.raises(click.UsageError, match='Bad Credentials: 404 "No!"'):
         run(["query"], "bad-credentials", mock_printer)
+    mock_github.close.assert_called_once_with()
 
 
 def test_run_verbose(assert_click_echo_calls, mock_printer):
@@ -88,6 +110,17 @@ def test_run_verbose(assert_click_echo_calls, mock_printer):
     )
 
 
+def test_run_verbose_with_cache(tmp_path, assert_click_echo_calls, mock_build_client, mock_printer):
+    run(["query"], "token", mock_printer, verbose=True, cache_dir=str(tmp_path))
+    assert_click_echo_calls(
+        call("Core rate limit: 45/50 (resets soon), Search rate limit: 10/10 (resets soon)"),
+        call("Skipping result for org/repo2 via NotArchivedFilter"),
+        call("Core rate limit: 43/50 (resets even sooner), Search rate limit: 9/10 (resets even sooner)"),
+        call("Requests answered with 304 Not Modified: 0"),
+    )
+    assert mock_build_client.call_args.kwargs["response_cache"] is not None
+
+
 def test_run_include_archived(
     assert_click_echo_calls,
     mock_printer,
@@ -96,34 +129,69 @@ def test_run_include_archived(
     mock_content_file_repo2_src_other_archived,
 ):
     run(["query"], "token", mock_printer, include_archived=True)
-    mock_printer.print.assert_called_once_with(
-        ["query"],
-        [
-            mock_content_file_repo1_readme,
-            mock_content_file_repo1_file,
-            mock_content_file_repo2_src_other_archived,
-        ],
-    )
+    assert mock_printer.printed == [
+        (
+            ["query"],
+            [
+                mock_content_file_repo1_readme,
+                mock_content_file_repo1_file,
+                mock_content_file_repo2_src_other_archived,
+            ],
+        )
+    ]
 
 
 def test_run_content_filter(assert_click_echo_calls, mock_printer, mock_content_file_repo1_readme):
     run(["query"], "token", mock_printer, content_filter="special content")
-    mock_printer.print.assert_called_once_with(
-        ["query"],
-        [
-            mock_content_file_repo1_readme,
-        ],
-    )
+    assert mock_printer.printed == [
+        (
+            ["query"],
+            [
+                mock_content_file_repo1_readme,
+            ],
+        )
+    ]
 
 
 def test_run_regex_content_filter(assert_click_echo_calls, mock_printer, mock_content_file_repo1_readme):
     run(["query"], "token", mock_printer, regex_content_filter="special\\scontent")
-    mock_printer.print.assert_called_once_with(
-        ["query"],
-        [
-            mock_content_file_repo1_readme,
-        ],
-    )
+    assert mock_printer.printed == [
+        (
+            ["query"],
+            [
+                mock_content_file_repo1_readme,
+            ],
+        )
+    ]
+
+
+def test_run_with_state(tmp_path, mock_click_echo, mock_github, mock_printer, mock_content_file_repo1_readme):
+    state_path = str(tmp_path / "state.json")
+    mock_content_file_repo1_readme.sha = "abc"
+    mock_github.get_rate_limit.side_effect = None
+    mock_github.get_rate_limit.return_value = MockRateLimit(45, 50, "soon", 10, 10, "soon")
+
+    run(["query"], "token", mock_printer, content_filter="special content", state_path=state_path)
+    mock_content_file_repo1_readme.decoded_content = b"not downloaded again"
+    run(["query"], "token", mock_printer, content_filter="special content", state_path=state_path, verbose=True)
+
+    assert mock_printer.printed == [(["query"], [mock_content_file_repo1_readme]), (["query"], [])]
+    mock_click_echo.assert_any_call("Content filter results reused from the previous run: 2")
+
+
+def test_run_with_stats(tmp_path, mock_build_client, mock_printer, mock_content_file_repo1_readme):
+    mock_content_file_repo1_readme.sha = "a" * 40
+    stats = RunStats()
+    run(["query"], "token", mock_printer, content_filter="special content", cache_dir=str(tmp_path), stats=stats)
+
+    assert mock_printer.printed == [(["query"], [mock_content_file_repo1_readme])]
+    assert mock_build_client.call_args.kwargs["stats"] is stats
+    assert mock_build_client.call_args.kwargs["prefetch_pages"] == 2
+    assert {"rate limit", "search", "filter", "print"} <= set(stats.stages)
+    assert stats.filters["NotArchivedFilter"]["rejected"] == 1
+    assert stats.filters["ContentFilter"]["evaluated"] == 2
+    assert stats.counters["content cache misses"] == 1
+    assert stats.counters["graphql api requests"] == 0
 
 
 def test_run_regex_content_filter_bad_regex(mock_printer):
@@ -136,7 +204,7 @@ def test_run_regex_content_filter_bad_regex(mock_printer):
 
 def test_run_path_filter(assert_click_echo_calls, mock_printer, mock_content_file_repo1_file):
     run(["query"], "token", mock_printer, path_filter="file.txt")
-    mock_printer.print.assert_called_once_with(["query"], [mock_content_file_repo1_file])
+    assert mock_printer.printed == [(["query"], [mock_content_file_repo1_file])]
 
 
 def test_run_when_raises_github_exception_422(mock_github, mock_printer):
@@ -153,3 +221,142 @@ def test_run_when_raises_github_exception(mock_github, mock_printer):
 
     with pytest.raises(GithubException):
         run(["query"], "token", mock_printer)
+
+
+def test_run_content_filter_with_cache(tmp_path, mock_printer, mock_content_file_repo1_readme):
+    mock_content_file_repo1_readme.sha = "a" * 40
+    run(["query"], "token", mock_printer, content_filter="special content", cache_dir=str(tmp_path))
+
+    assert (tmp_path / "blobs" / "aa" / ("a" * 38)).read_bytes() == b"special content"
+    assert (tmp_path / "repositories.sqlite").exists()
+
+
+def test_run_resolves_archived_repos_in_one_graphql_query(
+    mock_graphql_query, mock_printer, mock_content_file_repo2_src_other_archived
+):
+    type(mock_content_file_repo2_src_other_archived.repository).archived = PropertyMock(
+        side_effect=AssertionError("should not be fetched")
+    )
+
+    run(["query"], "token", mock_printer)
+
+    mock_graphql_query.assert_called_once()
+    assert mock_graphql_query.call_args.args[2] == {
+        "owner0": "org",
+        "name0": "repo1",
+        "owner1": "org",
+        "name1": "repo2",
+    }
+    assert [result.path for result in mock_printer.printed[0][1]] == ["README.md", "file.txt"]
+
+
+def test_run_reuses_cached_repo_metadata(tmp_path, mock_github, mock_graphql_query, mock_printer):
+    run(["query"], "token", mock_printer, cache_dir=str(tmp_path))
+    mock_github.get_rate_limit.side_effect = [MockRateLimit(43, 50, "soon", 9, 10, "soon")] * 2
+    run(["query"], "token", mock_printer, cache_dir=str(tmp_path))
+
+    mock_graphql_query.assert_called_once()
+    assert [[result.path for result in results] for _, results in mock_printer.printed] == [
+        ["README.md", "file.txt"],
+        ["README.md", "file.txt"],
+    ]
+
+
+def test_run_when_budget_is_exceeded(mock_github, mock_printer):
+    mock_github.search_code.side_effect = BudgetExceededException("The budget of 0 core api requests has been used up")
+
+    with pytest.raises(click.ClickException, match="The budget of 0 core api requests has been used up"):
+        run(["query"], "token", mock_printer, budget=0)
+
+
+def test_run_prints_the_results_found_before_the_budget_is_exceeded(
+    mock_github, mock_click_echo, mock_printer, mock_content_file_repo1_readme, mock_content_file_repo1_file
+):
+    exceeded = BudgetExceededException("The budget of 1 core api requests has been used up")
+    type(mock_content_file_repo1_file).decoded_content = PropertyMock(side_effect=exceeded)
+
+    run(["query"], "token", mock_printer, content_filter="special content", budget=1)
+
+    assert mock_printer.printed == [(["query"], [mock_content_file_repo1_readme])]
+    mock_click_echo.assert_called_with(
+        "Warning: The budget of 1 core api requests has been used up, so the results are incomplete", err=True
+    )
+
+
+def test_session_caches_share_the_max_size(tmp_path):
+    session = Session("token", cache_dir=str(tmp_path), cache_max_size=3)
+
+    assert session.response_cache._store.max_size + session.blob_cache.max_size == 3 * 1024 * 1024
+
+
+def test_session_shares_the_archived_status_between_searches(mock_github, mock_graphql_query, mock_printer):
+    session = Session("token")
+    session.search(["query"], mock_printer)
+    mock_github.get_rate_limit.side_effect = [MockRateLimit(43, 50, "soon", 9, 10, "soon")] * 2
+    session.search(["query"], mock_printer)
+
+    mock_graphql_query.assert_called_once()
+    assert session.archived_cache == {"org/repo1": True, "org/repo2": False}
+
+
+@pytest.mark.parametrize(
+    "content_filter, match_any, expected_paths",
+    [
+        (["special", "content"], False, ["README.md"]),
+        (["special", "missing"], False, []),
+        (["special", "missing"], True, ["README.md"]),
+    ],
+)
+def test_run_multiple_content_filters(mock_printer, content_filter, match_any, expected_paths):
+    run(["query"], "token", mock_printer, content_filter=content_filter, match_any=match_any)
+    assert [result.path for result in mock_printer.printed[0][1]] == expected_paths
+
+
+def test_run_show_matches(mock_printer, mock_content_file_repo1_readme):
+    run(["query"], "token", mock_printer, content_filter="content", show_matches=True)
+
+    assert mock_printer.printed == [(["query"], [mock_content_file_repo1_readme])]
+    assert mock_content_file_repo1_readme.line_matches == [LineMatch(1, 9, "special content", [], [])]
+
+
+@pytest.fixture
+def mock_local_index():
+    with patch("ghsearch.main.LocalIndex") as mock:
+        yield mock.return_value
+
+
+def test_run_index_update(assert_click_echo_calls, mock_github, mock_local_index):
+    mock_local_index.update.side_effect = [True, False, GithubException(404, "Not Found")]
+    with patch("ghsearch.main.list_repositories", return_value=["org/b", "org/c"]) as mock_list:
+        with pytest.raises(click.ClickException, match="Failed to index 1 repositories: org/c"):
+            run_index_update("token", "index.sqlite", ["org/a", "org", "org/b"], verbose=True)
+
+    mock_list.assert_called_once_with(mock_github, "org")
+    assert [c.args[1] for c in mock_local_index.update.call_args_list] == ["org/a", "org/b", "org/c"]
+    assert_click_echo_calls(
+        call("Indexed: org/a"),
+        call("Up to date: org/b"),
+        call('Error: failed to index org/c: 404 "Not Found"', err=True),
+    )
+    mock_local_index.close.assert_called_once_with()
+
+
+def test_run_index_update_refreshes_indexed_repositories(mock_local_index):
+    mock_local_index.repositories.return_value = ["org/a"]
+    run_index_update("token", "index.sqlite")
+    assert [c.args[1] for c in mock_local_index.update.call_args_list] == ["org/a"]
+
+
+def test_run_index_search(tmp_path, mock_printer, mock_local_index, mock_content_file_repo1_readme):
+    (tmp_path / "index.sqlite").touch()
+    mock_local_index.search.return_value = iter([mock_content_file_repo1_readme])
+
+    run_index_search(["org:org"], str(tmp_path / "index.sqlite"), mock_printer, regex_content_filter=["spec"])
+
+    mock_local_index.search.assert_called_once_with(["org:org"], (), ("spec",), False, "utf-8")
+    assert mock_printer.printed == [(["org:org"], [mock_content_file_repo1_readme])]
+
+
+def test_run_index_search_without_index(tmp_path, mock_printer):
+    with pytest.raises(click.UsageError, match="There is no index at"):
+        run_index_search(["foo"], str(tmp_path / "index.sqlite"), mock_printer)
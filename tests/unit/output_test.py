@@ -1,8 +1,21 @@
-from io import StringIO
+import gzip
+from io import BytesIO, StringIO, TextIOWrapper
+from unittest.mock import PropertyMock
 
+import click
 import pytest
 
-from ghsearch.output import DefaultPrinter, JsonPrinter, RepoListPrinter, YamlPrinter
+from ghsearch.output import printer_class, printer_extension, printer_factory, printers_list
+from ghsearch.printers.binary import GzipMsgpackPrinter, MsgpackPrinter, ZstdMsgpackPrinter
+from ghsearch.printers.structured import (
+    JsonLinesPrinter,
+    JsonPrinter,
+    StructuredPrinter,
+    YamlPrinter,
+    YamlStreamPrinter,
+)
+from ghsearch.printers.text import DefaultPrinter, RepoListPrinter
+from ghsearch.results import LineMatch, compact_results
 
 from . import build_mock_content_file
 
@@ -17,6 +30,10 @@ from . import build_mock_content_file
             "searching-for-information-on-github/searching-code#considerations-for-code-search)\n",
         ),
         (RepoListPrinter, ""),
+        (JsonLinesPrinter, ""),
+        (JsonPrinter, "[]"),
+        (YamlPrinter, "[]\n"),
+        (YamlStreamPrinter, ""),
     ],
 )
 def test_print_no_results(printer_cls, expected):
@@ -64,6 +81,12 @@ def test_print_results_slingle_repo(printer_cls, expected):
             "\t- file-2.json\n",
         ),
         (RepoListPrinter, "org/repo1\norg/repo2\n"),
+        (
+            JsonLinesPrinter,
+            '{"path": "README.md", "name": "README.md", "size": 1000, "html_url": "https://www.github.com/org/repo1/blob/master/README.md", "repository": {"full_name": "org/repo1", "html_url": "https://www.github.com/org/repo1", "fork": false, "owner": "org", "name": "repo1"}}\n'  # noqa: E501
+            '{"path": "file.txt", "name": "file.txt", "size": 1000, "html_url": "https://www.github.com/org/repo1/blob/master/file.txt", "repository": {"full_name": "org/repo1", "html_url": "https://www.github.com/org/repo1", "fork": false, "owner": "org", "name": "repo1"}}\n'  # noqa: E501
+            '{"path": "file-2.json", "name": "file-2.json", "size": 1000, "html_url": "https://www.github.com/org/repo2/blob/master/file-2.json", "repository": {"full_name": "org/repo2", "html_url": "https://www.github.com/org/repo2", "fork": false, "owner": "org", "name": "repo2"}}\n',  # noqa: E501
+        ),
         (
             JsonPrinter,
             '[{"full_name": "org/repo1", "html_url": "https://www.github.com/org/repo1", "fork": false, "owner": "org", "name": "repo1", "results": [{"path": "README.md", "name": "README.md", "size": 1000, "html_url": "https://www.github.com/org/repo1/blob/master/README.md"}, {"path": "file.txt", "name": "file.txt", "size": 1000, "html_url": "https://www.github.com/org/repo1/blob/master/file.txt"}]}, {"full_name": "org/repo2", "html_url": "https://www.github.com/org/repo2", "fork": false, "owner": "org", "name": "repo2", "results": [{"path": "file-2.json", "name": "file-2.json", "size": 1000, "html_url": "https://www.github.com/org/repo2/blob/master/file-2.json"}]}]',  # noqa: E501
@@ -95,6 +118,42 @@ def test_print_results_slingle_repo(printer_cls, expected):
             "    path: file-2.json\n"
             "    size: 1000\n",
         ),
+        (
+            YamlStreamPrinter,
+            "---\n"
+            "html_url: https://www.github.com/org/repo1/blob/master/README.md\n"
+            "name: README.md\n"
+            "path: README.md\n"
+            "repository:\n"
+            "  fork: false\n"
+            "  full_name: org/repo1\n"
+            "  html_url: https://www.github.com/org/repo1\n"
+            "  name: repo1\n"
+            "  owner: org\n"
+            "size: 1000\n"
+            "---\n"
+            "html_url: https://www.github.com/org/repo1/blob/master/file.txt\n"
+            "name: file.txt\n"
+            "path: file.txt\n"
+            "repository:\n"
+            "  fork: false\n"
+            "  full_name: org/repo1\n"
+            "  html_url: https://www.github.com/org/repo1\n"
+            "  name: repo1\n"
+            "  owner: org\n"
+            "size: 1000\n"
+            "---\n"
+            "html_url: https://www.github.com/org/repo2/blob/master/file-2.json\n"
+            "name: file-2.json\n"
+            "path: file-2.json\n"
+            "repository:\n"
+            "  fork: false\n"
+            "  full_name: org/repo2\n"
+            "  html_url: https://www.github.com/org/repo2\n"
+            "  name: repo2\n"
+            "  owner: org\n"
+            "size: 1000\n",
+        ),
     ],
 )
 def test_print_results_multiple_repos(printer_cls, expected):
@@ -127,3 +186,191 @@ def test_run_with_qualifiers():
         "\t- README.md\n"
         "\t- file.txt\n"
     )
+
+
+@pytest.mark.parametrize("printer_cls", [RepoListPrinter, JsonLinesPrinter])
+def test_streaming_printers_print_results_as_they_arrive(printer_cls):
+    stream = StringIO()
+
+    def results():
+        yield build_mock_content_file("org/repo1", "README.md")
+        assert "org/repo1" in stream.getvalue()
+        yield build_mock_content_file("org/repo2", "file.txt")
+
+    printer_cls(stream).print(["query"], results())
+
+    assert "org/repo2" in stream.getvalue()
+
+
+def _build_content_file_with_line_matches():
+    result = build_mock_content_file("org/repo1", "README.md")
+    result.line_matches = [
+        LineMatch(2, 1, "foo", ["zero", "one"], ["three"]),
+        LineMatch(2, 5, "foo", ["zero", "one"], ["three"]),
+        LineMatch(7, 3, "a foo", ["six"], ["eight"]),
+    ]
+    return result
+
+
+def test_default_printer_prints_line_matches():
+    stream = StringIO()
+    DefaultPrinter(stream).print(["query"], [_build_content_file_with_line_matches()])
+
+    assert stream.getvalue() == (
+        "Results:\n"
+        " 1 - org/repo1: https://www.github.com/org/repo1/search?utf8=✓&q=query\n"
+        "\t- README.md\n"
+        "\t\t0-zero\n"
+        "\t\t1-one\n"
+        "\t\t2:1:foo\n"
+        "\t\t3-three\n"
+        "\t\t--\n"
+        "\t\t6-six\n"
+        "\t\t7:3:a foo\n"
+        "\t\t8-eight\n"
+    )
+
+
+def test_default_printer_prints_line_matches_without_context():
+    result = build_mock_content_file("org/repo1", "README.md")
+    result.line_matches = [LineMatch(2, 1, "foo", [], []), LineMatch(7, 3, "a foo", [], [])]
+    stream = StringIO()
+    DefaultPrinter(stream).print(["query"], [result])
+
+    assert stream.getvalue().endswith("\t- README.md\n\t\t2:1:foo\n\t\t7:3:a foo\n")
+
+
+@pytest.mark.parametrize(
+    "printer_cls, expected",
+    [
+        (
+            JsonLinesPrinter,
+            '"matches": [{"line": 2, "column": 1, "text": "foo", "before": ["zero", "one"], "after": ["three"]}, '
+            '{"line": 2, "column": 5, "text": "foo", "before": ["zero", "one"], "after": ["three"]}, '
+            '{"line": 7, "column": 3, "text": "a foo", "before": ["six"], "after": ["eight"]}]',
+        ),
+        (
+            YamlPrinter,
+            "    matches:\n"
+            "    - after:\n"
+            "      - three\n"
+            "      before:\n"
+            "      - zero\n"
+            "      - one\n"
+            "      column: 1\n"
+            "      line: 2\n"
+            "      text: foo\n",
+        ),
+    ],
+)
+def test_structured_printers_print_line_matches(printer_cls, expected):
+    stream = StringIO()
+    printer_cls(stream).print(["query"], [_build_content_file_with_line_matches()])
+
+    assert expected in stream.getvalue()
+
+
+def test_printers_print_changes():
+    added = build_mock_content_file("org/repo1", "README.md")
+    added.change = "added"
+    removed = build_mock_content_file("org/repo1", "old.md")
+    removed.change = "removed"
+
+    stream = StringIO()
+    DefaultPrinter(stream).print(["query"], [added, removed])
+    assert stream.getvalue().endswith("\t- README.md (added)\n\t- old.md (removed)\n")
+
+    stream = StringIO()
+    JsonLinesPrinter(stream).print(["query"], [added])
+    assert '"change": "added"' in stream.getvalue()
+
+
+def _read_msgpack(data):
+    msgpack = pytest.importorskip("msgpack")
+    return list(msgpack.Unpacker(BytesIO(data)))
+
+
+@pytest.mark.parametrize(
+    "printer_cls, decompress",
+    [
+        (MsgpackPrinter, lambda data: data),
+        (GzipMsgpackPrinter, gzip.decompress),
+    ],
+)
+def test_msgpack_printers(printer_cls, decompress):
+    msgpack = pytest.importorskip("msgpack")
+    results = [build_mock_content_file("org/repo1", "README.md"), build_mock_content_file("org/repo2", "file.txt")]
+    stream = TextIOWrapper(BytesIO(), encoding="utf-8")
+
+    printer_cls(stream).print(["query"], results)
+
+    assert decompress(stream.buffer.getvalue()) == b"".join(
+        msgpack.packb(StructuredPrinter._build_result_with_repo(result))
+        for result in compact_results(results, with_size=True)
+    )
+
+
+def test_msgpack_printer_output_can_be_unpacked():
+    stream = BytesIO()
+    MsgpackPrinter(stream).print(["query"], [build_mock_content_file("org/repo1", "README.md")])
+
+    assert _read_msgpack(stream.getvalue()) == [
+        {
+            "path": "README.md",
+            "name": "README.md",
+            "size": 1000,
+            "html_url": "https://www.github.com/org/repo1/blob/master/README.md",
+            "repository": {
+                "full_name": "org/repo1",
+                "html_url": "https://www.github.com/org/repo1",
+                "fork": False,
+                "owner": "org",
+                "name": "repo1",
+            },
+        }
+    ]
+
+
+def test_zstd_msgpack_printer():
+    msgpack = pytest.importorskip("msgpack")
+    zstandard = pytest.importorskip("zstandard")
+    result = build_mock_content_file("org/repo1", "README.md")
+    stream = BytesIO()
+
+    ZstdMsgpackPrinter(stream).print(["query"], [result])
+
+    decompressed = zstandard.ZstdDecompressor().stream_reader(BytesIO(stream.getvalue())).read()
+    assert decompressed == msgpack.packb(
+        StructuredPrinter._build_result_with_repo(next(compact_results([result], with_size=True)))
+    )
+
+
+@pytest.mark.parametrize("printer_cls", [MsgpackPrinter, GzipMsgpackPrinter])
+def test_msgpack_printers_without_msgpack(mocker, printer_cls):
+    mocker.patch.dict("sys.modules", {"msgpack": None})
+
+    with pytest.raises(click.UsageError, match="the msgpack package: pip install gh-search\\[msgpack\\]"):
+        printer_cls(BytesIO())
+
+
+def test_zstd_msgpack_printer_without_zstandard(mocker):
+    mocker.patch.dict("sys.modules", {"zstandard": None})
+
+    with pytest.raises(click.UsageError, match="pip install gh-search\\[zstd\\]"):
+        ZstdMsgpackPrinter(BytesIO())
+
+
+def test_printer_factory_loads_printers_by_name():
+    stream = StringIO()
+    assert all(printer_class(name).NAME == name for name in printers_list())
+    assert type(printer_factory("json", stream)) is JsonPrinter
+    assert type(printer_factory("json", stream, force_repo_list_printer=True)) is RepoListPrinter
+    assert printer_extension("msgpack-gzip") == "msgpack.gz"
+
+
+@pytest.mark.parametrize("printer_class", [DefaultPrinter, RepoListPrinter])
+def test_printers_without_sizes_do_not_look_them_up(printer_class):
+    result = build_mock_content_file()
+    type(result).size = PropertyMock(side_effect=AssertionError("looking up the size downloads the file"))
+
+    printer_class(StringIO()).print(["query"], [result])
@@ -0,0 +1,94 @@
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from unittest.mock import Mock, patch
+
+import pytest
+
+from ghsearch.pagination import PagePrefetcher, SearchQuota, count_pages
+
+from . import MockPaginatedList
+
+
+@pytest.mark.parametrize(
+    "total_count, per_page, expected",
+    [(0, 100, 0), (1, 100, 1), (100, 100, 1), (101, 100, 2), (5000, 100, 10), (5000, 30, 34)],
+)
+def test_count_pages(total_count, per_page, expected):
+    assert count_pages(total_count, per_page) == expected
+
+
+def test_prefetcher_yields_all_pages_in_order():
+    results = MockPaginatedList(*range(25), per_page=10)
+
+    assert list(PagePrefetcher(results, 3, 10, 1)) == list(range(25))
+
+
+def test_prefetcher_stops_at_short_page():
+    results = Mock(wraps=MockPaginatedList(*range(15), per_page=10))
+
+    assert list(PagePrefetcher(results, 5, 10, 2)) == list(range(15))
+    assert results.get_page.call_count == 2
+
+
+def test_prefetcher_raises_errors_from_fetching():
+    results = Mock()
+    results.get_page.side_effect = [[1, 2], ValueError("boom")]
+
+    with pytest.raises(ValueError, match="boom"):
+        list(PagePrefetcher(results, 3, 2, 1))
+
+
+def test_prefetcher_stops_fetching_when_consumer_stops():
+    results = Mock(wraps=MockPaginatedList(*range(100), per_page=10))
+    prefetcher = iter(PagePrefetcher(results, 10, 10, 1))
+
+    assert next(prefetcher) == 0
+    prefetcher.close()
+
+    assert results.get_page.call_count < 10
+
+
+def test_prefetcher_waits_for_search_rate_limit_reset():
+    results = MockPaginatedList(*range(30), per_page=10)
+    reset = datetime.now(timezone.utc) + timedelta(seconds=30)
+    search_rate = SimpleNamespace(remaining=2, limit=30, reset=reset)
+    prefetcher = PagePrefetcher(results, 3, 10, 1, search_rate)
+
+    with patch.object(prefetcher._stop, "wait") as mock_wait:
+        assert list(prefetcher) == list(range(30))
+
+    mock_wait.assert_called_once()
+    assert 25 < mock_wait.call_args.args[0] <= 30
+
+
+def test_prefetcher_does_not_acquire_quota_for_the_first_page():
+    results = MockPaginatedList(*range(30), per_page=10)
+    search_rate = SimpleNamespace(remaining=10, limit=30, reset=datetime.now(timezone.utc))
+    prefetcher = PagePrefetcher(results, 3, 10, 1, search_rate)
+
+    with patch.object(prefetcher.quota, "acquire", wraps=prefetcher.quota.acquire) as mock_acquire:
+        assert list(prefetcher) == list(range(30))
+
+    assert mock_acquire.call_count == 2
+    assert prefetcher.quota.remaining == 7
+
+
+def test_search_quota_waits_for_reset_once_used_up():
+    reset = datetime.now(timezone.utc) + timedelta(seconds=30)
+    quota = SearchQuota(SimpleNamespace(remaining=3, limit=30, reset=reset), used=1)
+
+    with patch.object(quota._stop, "wait") as mock_wait:
+        for _ in range(3):
+            quota.acquire()
+
+    mock_wait.assert_called_once()
+    assert quota.remaining == 29
+    assert quota.reset == reset + timedelta(minutes=1)
+
+
+def test_search_quota_without_rate_limit():
+    quota = SearchQuota(None)
+
+    quota.acquire()
+
+    assert quota.remaining is None
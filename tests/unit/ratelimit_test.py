@@ -0,0 +1,140 @@
+from types import SimpleNamespace
+from unittest.mock import Mock
+
+import pytest
+
+from ghsearch.ratelimit import (
+    CORE,
+    GRAPHQL,
+    RATE_LIMIT,
+    SEARCH,
+    BudgetExceededException,
+    RateLimitScheduler,
+    resource_for,
+)
+
+
+def _headers(remaining, limit=30, reset=1000, resource="search"):
+    return {
+        "X-RateLimit-Remaining": str(remaining),
+        "X-RateLimit-Limit": str(limit),
+        "X-RateLimit-Reset": str(reset),
+        "X-RateLimit-Resource": resource,
+    }
+
+
+def _response(status, headers=None, text=""):
+    return SimpleNamespace(status=status, getheaders=lambda: (headers or {}).items(), read=lambda: text)
+
+
+@pytest.fixture
+def scheduler():
+    return RateLimitScheduler(clock=lambda: 900, sleep=Mock())
+
+
+@pytest.mark.parametrize(
+    "url, expected",
+    [
+        ("/api/v3/search/code?q=foo", SEARCH),
+        ("/search/code", SEARCH),
+        ("/api/graphql", GRAPHQL),
+        ("/rate_limit", RATE_LIMIT),
+        ("/repos/org/repo", CORE),
+        ("/repos/org/repo/contents/search/file.txt", CORE),
+    ],
+)
+def test_resource_for(url, expected):
+    assert resource_for(url) == expected
+
+
+def test_reserve_without_rate_limit_headers(scheduler):
+    assert scheduler.reserve(SEARCH) == 0
+
+
+def test_reserve_waits_for_reset_once_bucket_is_empty(scheduler):
+    scheduler.record(SEARCH, 200, _headers(1, reset=1000), "")
+
+    assert scheduler.reserve(SEARCH) == 0
+    assert scheduler.reserve(SEARCH) == 100
+    assert scheduler.reserve(SEARCH) == 0
+    assert scheduler.reserve(CORE) == 0
+
+
+@pytest.mark.parametrize("header_resource", ["search", "code_search"])
+def test_record_uses_resource_header(scheduler, header_resource):
+    scheduler.record(CORE, 200, _headers(0, resource=header_resource), "")
+
+    assert scheduler.reserve(CORE) == 0
+    assert scheduler.reserve(SEARCH) == 100
+
+
+@pytest.mark.parametrize(
+    "status, headers, body, attempt, expected",
+    [
+        (200, {}, "", 0, None),
+        (403, {"Retry-After": "5"}, "", 0, 5),
+        (429, {}, "", 1, 120),
+        (403, {}, '{"message": "You have exceeded a secondary rate limit"}', 0, 60),
+        (403, _headers(0, reset=1030, resource="core"), "", 0, 130),
+        (403, {}, '{"message": "Resource not accessible by integration"}', 0, None),
+        (403, {"Retry-After": "5"}, "", 3, None),
+    ],
+)
+def test_record_retry_delay(status, headers, body, attempt, expected):
+    scheduler = RateLimitScheduler(clock=lambda: 900)
+
+    assert scheduler.record(CORE, status, headers, body, attempt) == expected
+
+
+def test_budget(scheduler):
+    scheduler.budget = 2
+    scheduler.reserve(CORE)
+    scheduler.record(CORE, 304, {}, "")
+    # requests count once reserved, before they are answered
+    for _ in range(2):
+        scheduler.reserve(CORE)
+
+    assert scheduler.reserve(SEARCH) == 0
+    with pytest.raises(BudgetExceededException, match="The budget of 2 core api requests has been used up"):
+        scheduler.reserve(CORE)
+
+
+def test_graphql_requests_are_not_counted_against_the_budget(scheduler):
+    scheduler.budget = 1
+    for _ in range(2):
+        scheduler.reserve(GRAPHQL)
+        scheduler.record(GRAPHQL, 200, _headers(4000, limit=5000, resource="graphql"), "")
+
+    assert (scheduler.core_used, scheduler.graphql_used) == (0, 2)
+    assert scheduler.reserve(CORE) == 0
+
+
+@pytest.mark.parametrize(
+    "budget, max_core_fraction, expected",
+    [(None, None, None), (100, None, 100), (None, 0.5, 2000), (100, 0.5, 100), (3000, 0.5, 2000)],
+)
+def test_apply_core_remaining(budget, max_core_fraction, expected):
+    scheduler = RateLimitScheduler(budget, max_core_fraction)
+
+    assert scheduler.has_budget is (expected is not None)
+    assert scheduler.apply_core_remaining(4000) == expected
+    assert scheduler.budget == expected
+
+
+def test_send_paces_code_search(scheduler):
+    # GitHub names the rate limit of /search/code "code_search"
+    send = Mock(return_value=_response(200, _headers(0, resource="code_search")))
+
+    scheduler.send("/api/v3/search/code?q=foo", send)
+    scheduler.send("/api/v3/search/code?q=bar", send)
+
+    scheduler._sleep.assert_called_with(100)
+
+
+def test_send_retries_secondary_rate_limits(scheduler):
+    send = Mock(side_effect=[_response(429, {"Retry-After": "7"}), _response(200, _headers(10))])
+
+    assert scheduler.send("/search/code", send).status == 200
+    assert send.call_count == 2
+    assert scheduler.retries == 1
+    assert [call.args[0] for call in scheduler._sleep.call_args_list] == [0, 7, 0]
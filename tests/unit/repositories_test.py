@@ -0,0 +1,160 @@
+from unittest.mock import Mock, patch
+
+import pytest
+
+from ghsearch.repositories import ArchivedStatusResolver, RepoMetadata, RepoMetadataCache
+
+
+@pytest.fixture
+def mock_graphql_query():
+    with patch("ghsearch.repositories.graphql_query") as mock:
+        yield mock
+
+
+@pytest.fixture
+def mock_conditional_get():
+    with patch("ghsearch.repositories.conditional_get") as mock:
+        yield mock
+
+
+@pytest.fixture
+def metadata_cache(tmp_path):
+    return RepoMetadataCache(str(tmp_path / "repositories.sqlite"), ttl=60)
+
+
+def _rest_repo(full_name, archived):
+    return {
+        "full_name": full_name,
+        "archived": archived,
+        "fork": False,
+        "owner": {"login": full_name.split("/")[0]},
+        "html_url": f"https://github.com/{full_name}",
+    }
+
+
+def test_resolve_archived_status(mock_graphql_query):
+    client = Mock()
+    mock_graphql_query.return_value = {"data": {"repo0": {"isArchived": True}, "repo1": {"isArchived": False}}}
+
+    archived = ArchivedStatusResolver(client).resolve(["org/repo1", "org/repo2", "org/repo1"])
+
+    assert archived == {"org/repo1": True, "org/repo2": False}
+    mock_graphql_query.assert_called_once_with(
+        client,
+        "query($owner0: String!, $name0: String!, $owner1: String!, $name1: String!) {"
+        " repo0: repository(owner: $owner0, name: $name0) { isArchived }"
+        " repo1: repository(owner: $owner1, name: $name1) { isArchived } }",
+        {"owner0": "org", "name0": "repo1", "owner1": "org", "name1": "repo2"},
+    )
+
+
+def test_resolve_archived_status_skips_unresolved_repos(mock_graphql_query):
+    mock_graphql_query.return_value = {
+        "data": {"repo0": None, "repo1": {"isArchived": True}},
+        "errors": [{"type": "NOT_FOUND", "message": "Could not resolve to a Repository"}],
+    }
+
+    assert ArchivedStatusResolver(Mock()).resolve(["org/gone", "org/repo"]) == {"org/repo": True}
+
+
+def test_resolve_archived_status_without_repos(mock_graphql_query):
+    assert ArchivedStatusResolver(Mock()).resolve([]) == {}
+    mock_graphql_query.assert_not_called()
+
+
+def test_resolve_archived_status_in_batches_of_100(mock_graphql_query):
+    mock_graphql_query.side_effect = lambda client, query, variables: {
+        "data": {f"repo{i}": {"isArchived": False} for i in range(len(variables) // 2)}
+    }
+
+    archived = ArchivedStatusResolver(Mock()).resolve([f"org/repo{i}" for i in range(250)])
+
+    assert len(archived) == 250
+    assert [len(call.args[2]) // 2 for call in mock_graphql_query.call_args_list] == [100, 100, 50]
+
+
+def test_metadata_cache_persists_entries(tmp_path):
+    metadata = RepoMetadata("org/repo", True, False, "org", "https://github.com/org/repo")
+    RepoMetadataCache(str(tmp_path / "cache" / "repos.sqlite")).put(metadata, 'W/"etag"')
+
+    cached = RepoMetadataCache(str(tmp_path / "cache" / "repos.sqlite")).get("org/repo")
+
+    assert cached == (metadata, 'W/"etag"', True)
+
+
+def test_metadata_cache_expires_entries(metadata_cache):
+    metadata_cache.put(RepoMetadata("org/repo", True, False, "org", "https://github.com/org/repo"))
+    metadata_cache.ttl = 0
+
+    assert metadata_cache.get("org/repo").fresh is False
+    assert metadata_cache.get("org/other") is None
+
+
+def test_resolve_stores_and_reuses_metadata(mock_graphql_query, mock_conditional_get, metadata_cache):
+    mock_graphql_query.return_value = {
+        "data": {
+            "repo0": {
+                "isArchived": True,
+                "isFork": True,
+                "url": "https://github.com/org/repo",
+                "owner": {"login": "org"},
+            }
+        }
+    }
+
+    assert ArchivedStatusResolver(Mock(), metadata_cache).resolve(["org/repo"]) == {"org/repo": True}
+    assert ArchivedStatusResolver(Mock(), metadata_cache).resolve(["org/repo"]) == {"org/repo": True}
+
+    mock_graphql_query.assert_called_once()
+    assert "isFork url owner { login }" in mock_graphql_query.call_args.args[1]
+    assert metadata_cache.get("org/repo").metadata == RepoMetadata(
+        "org/repo", True, True, "org", "https://github.com/org/repo"
+    )
+    mock_conditional_get.assert_not_called()
+
+
+def test_resolve_revalidates_stale_metadata(mock_graphql_query, mock_conditional_get, metadata_cache):
+    metadata_cache.put(RepoMetadata("org/same", True, False, "org", "https://github.com/org/same"), 'W/"same"')
+    metadata_cache.put(RepoMetadata("org/changed", False, False, "org", "https://github.com/org/changed"), 'W/"old"')
+    metadata_cache.ttl = 0
+    mock_conditional_get.side_effect = lambda client, url, etag: {
+        'W/"same"': (None, etag),
+        'W/"old"': (_rest_repo("org/changed", True), 'W/"new"'),
+    }[etag]
+    mock_graphql_query.return_value = {"data": {"repo0": None}}
+
+    archived = ArchivedStatusResolver(Mock(), metadata_cache).resolve(["org/same", "org/changed", "org/missing"])
+
+    assert archived == {"org/same": True, "org/changed": True}
+    assert metadata_cache.get("org/changed").metadata.archived is True
+    assert metadata_cache.get("org/changed").etag == 'W/"new"'
+    assert mock_graphql_query.call_args.args[2] == {"owner0": "org", "name0": "missing"}
+
+
+def test_fetch_without_metadata_cache(mock_conditional_get):
+    repository = Mock(full_name="org/repo", archived=True)
+
+    assert ArchivedStatusResolver(Mock()).fetch(repository) is True
+    mock_conditional_get.assert_not_called()
+
+
+def test_fetch_with_metadata_cache(mock_conditional_get, metadata_cache):
+    mock_conditional_get.return_value = (_rest_repo("org/repo", True), 'W/"etag"')
+    resolver = ArchivedStatusResolver(Mock(), metadata_cache)
+
+    assert resolver.fetch(Mock(full_name="org/repo")) is True
+    assert resolver.fetch(Mock(full_name="org/repo")) is True
+
+    mock_conditional_get.assert_called_once_with(resolver.client, "/repos/org/repo")
+    assert metadata_cache.get("org/repo").etag == 'W/"etag"'
+
+
+def test_fetch_uses_revalidated_metadata(mock_conditional_get, metadata_cache):
+    metadata_cache.put(RepoMetadata("org/repo", False, False, "org", "https://github.com/org/repo"), 'W/"old"')
+    metadata_cache.ttl = 0
+    mock_conditional_get.return_value = (_rest_repo("org/repo", True), 'W/"new"')
+    resolver = ArchivedStatusResolver(Mock(), metadata_cache)
+
+    assert resolver.fetch(Mock(full_name="org/repo")) is True
+
+    mock_conditional_get.assert_called_once_with(resolver.client, "/repos/org/repo", 'W/"old"')
@@ -0,0 +1,52 @@
+from unittest.mock import PropertyMock
+
+from ghsearch.results import LineMatch, SearchResult, compact_results
+
+from . import build_mock_content_file
+
+
+def test_compact_results():
+    result_1 = build_mock_content_file("org/repo", "src/a.txt", sha="1")
+    result_1.line_matches = [LineMatch(1, 1, "foo", [], [])]
+    result_1.change = "added"
+    result_2 = build_mock_content_file("org/repo", "b.txt", sha="2")
+
+    compact_1, compact_2 = compact_results([result_1, result_2])
+
+    assert isinstance(compact_1, SearchResult)
+    assert (compact_1.path, compact_1.name, compact_1.sha) == ("src/a.txt", "a.txt", "1")
+    assert compact_1.html_url == "https://www.github.com/org/repo/blob/master/src/a.txt"
+    assert compact_1.line_matches == [LineMatch(1, 1, "foo", [], [])]
+    assert compact_1.change == "added"
+    assert compact_1.repository is compact_2.repository
+    assert compact_1.repository.owner.login == "org"
+    assert compact_1.repository.name == "repo"
+    assert compact_1.repository.fork is False
+    assert compact_2.line_matches is None
+    assert compact_2.change is None
+    assert list(compact_results([compact_1])) == [compact_1]
+
+
+def test_compact_results_size():
+    result = build_mock_content_file()
+    size = PropertyMock(return_value=1000)
+    type(result).size = size
+
+    (compact,) = compact_results([result])
+    assert compact.size is None
+    size.assert_not_called()
+
+    (compact,) = compact_results([result], with_size=True)
+    assert compact.size == 1000
+    size.assert_called_once_with()
+    # only the printed fields are kept, not the search result
+    assert all(attribute is not result for attribute in (getattr(compact, name) for name in SearchResult.__slots__))
+
+
+def test_compact_results_size_read_by_content_filter():
+    result = build_mock_content_file()
+    result.content_size = 3
+    type(result).size = PropertyMock(side_effect=AssertionError("should not be looked up"))
+
+    (compact,) = compact_results([result], with_size=True)
+    assert compact.size == 3
@@ -0,0 +1,119 @@
+import re
+from types import SimpleNamespace
+from unittest.mock import Mock
+
+import pytest
+
+from ghsearch.client import build_client
+from ghsearch.defaults import BACKENDS
+from ghsearch.pagination import SearchQuota
+from ghsearch.sharding import MAX_INDEXED_FILE_SIZE, ShardedSearch
+
+from . import MockPaginatedList, StubGitHub, build_search_item, capped_last_link
+
+
+def _result(i, size):
+    return SimpleNamespace(
+        repository=SimpleNamespace(full_name=f"org/repo{i % 7}"), path=f"{i}.txt", sha=str(i), size=size
+    )
+
+
+@pytest.fixture
+def corpus():
+    return [_result(i, (i * 97) % MAX_INDEXED_FILE_SIZE) for i in range(2500)]
+
+
+@pytest.fixture
+def client(corpus):
+    def search_code(query, **_):
+        match = re.search(r"size:(\d+)\.\.(\d+)", query)
+        low, high = (int(match[1]), int(match[2])) if match else (0, MAX_INDEXED_FILE_SIZE)
+        return MockPaginatedList(*[result for result in corpus if low <= result.size <= high])
+
+    mock = Mock()
+    mock.per_page = 100
+    mock.search_code.side_effect = search_code
+    return mock
+
+
+def test_small_queries_are_not_split(client):
+    client.search_code.side_effect = lambda query: MockPaginatedList(*range(10))
+
+    search = ShardedSearch(client, "query")
+
+    assert [shard.query for shard in search.shards] == ["query"]
+    assert search.totalCount == 10
+
+
+@pytest.mark.parametrize("jobs", [1, 3])
+def test_large_queries_are_split_by_size(client, corpus, jobs):
+    search = ShardedSearch(client, "query org:org", {"highlight": True}, jobs=jobs)
+
+    assert len(search.shards) > 1
+    assert all(shard.total_count <= 1000 for shard in search.shards)
+    assert all(re.fullmatch(r"query org:org size:\d+\.\.\d+", shard.query) for shard in search.shards)
+    assert search.totalCount == 2500
+    assert search.truncated_shards == []
+    assert sorted(list(search), key=lambda result: int(result.sha)) == corpus
+    client.search_code.assert_called_with(query=search.shards[-1].query, highlight=True)
+
+
+def test_results_in_several_shards_are_yielded_once(client):
+    duplicate = _result(1, 1)
+    client.search_code.side_effect = lambda query: MockPaginatedList(
+        duplicate, total_count=1 if "size:" in query else 1500
+    )
+
+    search = ShardedSearch(client, "query")
+
+    assert len(search.shards) == 2
+    assert list(search) == [duplicate]
+
+
+def test_queries_with_size_qualifier_are_not_split(client):
+    search = ShardedSearch(client, "query size:0..393216")
+
+    assert [shard.query for shard in search.shards] == ["query size:0..393216"]
+    assert [shard.query for shard in search.truncated_shards] == ["query size:0..393216"]
+
+
+def test_search_quota_is_used_for_each_request(client):
+    quota = Mock(spec=SearchQuota)
+
+    search = ShardedSearch(client, "query", quota=quota)
+    list(search)
+
+    # the first page of each shard is fetched by its search
+    num_pages = sum(-(-shard.total_count // 100) - 1 for shard in search.shards)
+    assert quota.acquire.call_count == client.search_code.call_count + num_pages
+
+
+def test_search_quota_is_acquired_once_per_page_of_a_shard(client):
+    results = [_result(i, 1) for i in range(250)]
+    client.search_code.side_effect = lambda query: MockPaginatedList(*results)
+    quota = Mock(spec=SearchQuota)
+
+    search = ShardedSearch(client, "query", quota=quota)
+    assert quota.acquire.call_count == 1
+    assert list(search) == results
+
+    assert quota.acquire.call_count == 3
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_queries_are_split_by_their_total_count_on_either_backend(backend):
+    stub = StubGitHub()
+    item = build_search_item("org/repo", "a.txt", stub.url)
+    stub.routes["/api/v3/search/code"] = lambda query: (
+        200,
+        {"total_count": 900 if "size:" in query["q"][0] else 5000, "incomplete_results": False, "items": [item]},
+    )
+    stub.headers["/api/v3/search/code"] = capped_last_link(stub.url)
+    client = build_client("foo-token", stub.url, backend=backend)
+    try:
+        search = ShardedSearch(client, "query")
+    finally:
+        client.close()
+        stub.close()
+
+    assert [shard.total_count for shard in search.shards] == [900, 900]
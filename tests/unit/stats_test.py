@@ -0,0 +1,88 @@
+import json
+import pstats
+
+import pytest
+
+from ghsearch.stats import RunStats, collect_stats, endpoint_for
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.mark.parametrize(
+    "url, expected",
+    [
+        ("/search/code?q=foo&page=2", "GET /search/code"),
+        ("/api/v3/repos/org/repo", "GET /repos/:owner/:repo"),
+        ("/repos/org/repo/contents/src/main.py?ref=abc", "GET /repos/:owner/:repo/contents"),
+        ("/repos/org/repo/git/blobs/abc", "GET /repos/:owner/:repo/git/blobs"),
+        ("/repos/org/repo/tarball/abc", "GET /repos/:owner/:repo/tarball"),
+        ("/orgs/org/repos?per_page=100", "GET /orgs/:owner/repos"),
+        ("/rate_limit", "GET /rate_limit"),
+    ],
+)
+def test_endpoint_for(url, expected):
+    assert endpoint_for("GET", url) == expected
+
+
+def test_stages_exclude_nested_stages():
+    clock = FakeClock()
+    stats = RunStats(clock)
+
+    def search():
+        for item in range(2):
+            clock.now += 1
+            yield item
+
+    with stats.stage("print"):
+        clock.now += 0.5
+        for _ in stats.timed("search", search()):
+            clock.now += 0.25
+
+    assert stats.stages == {"print": 1.0, "search": 2.0}
+
+
+def test_record_request_and_filter():
+    stats = RunStats()
+    stats.record_request("GET", "/repos/org/a", 200, 100, 0.01)
+    stats.record_request("GET", "/repos/org/b", 304, 0, 0.3)
+    stats.record_filter("PathFilter", 0.5, passed=False)
+    stats.record_filter("PathFilter", 0.25, passed=True)
+    stats.record_filter("PathFilter", 0.25)
+    stats.count("content cache hits", 2)
+
+    data = stats.as_dict()
+    requests = data["requests"]["GET /repos/:owner/:repo"]
+    assert requests["count"] == 2
+    assert requests["bytes"] == 100
+    assert requests["statuses"] == {"200": 1, "304": 1}
+    assert requests["latency_histogram"]["<=50ms"] == 1
+    assert requests["latency_histogram"]["<=500ms"] == 1
+    assert data["filters"] == {"PathFilter": {"evaluated": 2, "rejected": 1, "seconds": 1.0}}
+    assert data["counters"] == {"content cache hits": 2}
+
+    summary = stats.summary()
+    assert (
+        "  GET /repos/:owner/:repo                      0.310s  2 requests, 100 bytes, mean 155ms, max 300ms" in summary
+    )
+    assert "  PathFilter                                   1.000s  evaluated 2, rejected 1" in summary
+
+
+def test_collect_stats(tmp_path, capsys):
+    json_path, profile_path = tmp_path / "stats.json", tmp_path / "profile"
+    with collect_stats(True, str(json_path), str(profile_path)) as stats:
+        stats.count("core api requests", 3)
+
+    assert json.loads(json_path.read_text())["counters"] == {"core api requests": 3}
+    assert "  core api requests                                 3" in capsys.readouterr().err
+    assert pstats.Stats(str(profile_path)).total_calls > 0
+
+
+def test_collect_stats_disabled():
+    with collect_stats(False, None, None) as stats:
+        assert stats is None
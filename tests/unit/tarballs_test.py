@@ -0,0 +1,169 @@
+import io
+import os
+import tarfile
+from unittest.mock import Mock, PropertyMock, patch
+
+import pytest
+from github import GithubException
+from github.Consts import DEFAULT_TIMEOUT
+
+from ghsearch.cache import BlobCache
+from ghsearch.filters import ContentFilter
+from ghsearch.sharding import MAX_INDEXED_FILE_SIZE
+from ghsearch.tarballs import RepoTarballs, git_blob_sha
+
+from . import build_mock_content_file
+
+
+def _build_tarball(files):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as tar:
+        for path, content in files.items():
+            member = tarfile.TarInfo(f"org-repo-abc123/{path}")
+            member.size = len(content)
+            tar.addfile(member, io.BytesIO(content))
+    return buffer.getvalue()
+
+
+def _build_result(path, content, repo="org/repo"):
+    return build_mock_content_file(repo, path, decoded_content=content, sha=git_blob_sha(content))
+
+
+@pytest.fixture
+def mock_tarball_url():
+    with patch("ghsearch.tarballs.tarball_url") as mock:
+        mock.return_value = "https://codeload.example.org/org/repo/tar.gz/main"
+        yield mock
+
+
+@pytest.fixture
+def open_url():
+    tarball = _build_tarball({"a.txt": b"aaa", "dir/b.txt": b"bbb", "stale.txt": b"new"})
+    return Mock(side_effect=lambda url: io.BytesIO(tarball))
+
+
+@pytest.fixture
+def tarballs(open_url):
+    tarballs = RepoTarballs(Mock(), threshold=1, open_url=open_url)
+    yield tarballs
+    tarballs.close()
+
+
+def test_git_blob_sha():
+    assert git_blob_sha(b"hello\n") == "ce013625030ba8dba906f756967f9e9ca394464a"
+
+
+def test_prepare_reads_files_from_tarball_once_over_threshold(mock_tarball_url, open_url, tarballs):
+    a, b = _build_result("a.txt", b"aaa"), _build_result("dir/b.txt", b"bbb")
+    tarballs.prepare([a])
+    assert tarballs.get(a.sha) is None
+    open_url.assert_not_called()
+
+    tarballs.prepare([a, b])
+    assert tarballs.get(a.sha) == b"aaa"
+    assert tarballs.get(b.sha) == b"bbb"
+    assert tarballs.get(b.sha) is None
+    assert (tarballs.downloaded, tarballs.files_read) == (1, 2)
+
+    tarballs.prepare([b])
+    assert tarballs.get(b.sha) == b"bbb"
+    mock_tarball_url.assert_called_once_with(tarballs.client, "org/repo")
+    open_url.assert_called_once_with("https://codeload.example.org/org/repo/tar.gz/main")
+
+
+def test_prepare_skips_files_changed_since_indexed(mock_tarball_url, tarballs):
+    stale = _build_result("stale.txt", b"old")
+    tarballs.prepare([stale, _build_result("a.txt", b"aaa")])
+
+    assert tarballs.get(stale.sha) is None
+    assert tarballs.files_read == 1
+
+
+def test_prepare_falls_back_when_download_fails(mock_tarball_url, open_url, tarballs):
+    mock_tarball_url.side_effect = GithubException(404, {"message": "Not Found"})
+    a = _build_result("a.txt", b"aaa")
+    tarballs.prepare([a, _build_result("dir/b.txt", b"bbb")])
+    tarballs.prepare([a])
+
+    assert tarballs.get(a.sha) is None
+    assert tarballs.downloaded == 0
+    mock_tarball_url.assert_called_once()
+
+
+def test_prepare_falls_back_when_tarball_is_too_large(mock_tarball_url, open_url):
+    tarballs = RepoTarballs(Mock(), threshold=1, open_url=open_url, max_size=5)
+    a = _build_result("a.txt", b"aaa")
+    tarballs.prepare([a, _build_result("dir/b.txt", b"bbb")])
+
+    assert tarballs.get(a.sha) is None
+    assert tarballs.downloaded == 0
+    assert not os.listdir(tarballs._directory.name)
+    tarballs.close()
+
+
+def test_prepare_skips_files_too_large_to_be_searched(mock_tarball_url):
+    large = b"a" * (MAX_INDEXED_FILE_SIZE + 1)
+    tarball = _build_tarball({"a.txt": b"aaa", "large.txt": large})
+    tarballs = RepoTarballs(Mock(), threshold=1, open_url=lambda url: io.BytesIO(tarball))
+    a = _build_result("a.txt", b"aaa")
+    tarballs.prepare([a, _build_result("large.txt", large)])
+
+    assert tarballs.get(a.sha) == b"aaa"
+    assert tarballs.files_read == 1
+    assert tarballs.downloaded_bytes == len(tarball)
+    tarballs.close()
+
+
+def test_tarballs_are_downloaded_with_a_timeout(mock_tarball_url):
+    tarballs = RepoTarballs(Mock(), threshold=0)
+    with patch("ghsearch.client.urlopen") as mock_urlopen:
+        mock_urlopen.return_value = io.BytesIO(_build_tarball({"a.txt": b"aaa"}))
+        tarballs.prepare([_build_result("a.txt", b"aaa")])
+
+    mock_urlopen.assert_called_once_with("https://codeload.example.org/org/repo/tar.gz/main", timeout=DEFAULT_TIMEOUT)
+    tarballs.close()
+
+
+def test_content_filter_reads_from_tarballs(mock_tarball_url, tarballs):
+    results = [_build_result("a.txt", b"aaa"), _build_result("dir/b.txt", b"bbb")]
+    for result in results:
+        type(result).decoded_content = PropertyMock(side_effect=AssertionError("should not be downloaded"))
+    content_filter = ContentFilter("aaa", tarballs=tarballs)
+
+    content_filter.prepare(results)
+    assert [content_filter(result) for result in results] == [True, False]
+
+
+def test_prepare_decompresses_each_tarball_once(mock_tarball_url, tarballs):
+    a, b = _build_result("a.txt", b"aaa"), _build_result("dir/b.txt", b"bbb")
+    with patch("ghsearch.tarballs.tarfile.open", wraps=tarfile.open) as mock_tarfile_open:
+        tarballs.prepare([a, b])
+        tarballs.prepare([a])
+        tarballs.prepare([b])
+
+    assert mock_tarfile_open.call_count == 1
+    assert tarballs.get(a.sha) == b"aaa"
+    assert tarballs.get(b.sha) == b"bbb"
+
+
+def test_prepare_drops_unclaimed_contents(mock_tarball_url, tarballs):
+    a, b = _build_result("a.txt", b"aaa"), _build_result("dir/b.txt", b"bbb")
+    tarballs.prepare([a, b])
+    tarballs.prepare([])
+    # the checks of the previous batch may still be running
+    assert tarballs.get(b.sha) == b"bbb"
+
+    tarballs.prepare([])
+
+    assert tarballs.get(a.sha) is None
+
+
+def test_content_filter_skips_cached_contents(tmp_path):
+    a, b = _build_result("a.txt", b"aaa"), _build_result("dir/b.txt", b"bbb")
+    blob_cache = BlobCache(str(tmp_path), 100)
+    blob_cache.put(a.sha, b"aaa")
+    tarballs = Mock(spec=RepoTarballs)
+
+    ContentFilter("aaa", blob_cache, tarballs=tarballs).prepare([a, b])
+
+    tarballs.prepare.assert_called_once_with([b])
@@ -52,3 +52,22 @@ def test_progress_printer(assert_click_echo_calls, overwrite, isatty, force, exp
             printer("Hello!", force=force)
 
     assert_click_echo_calls(*expected_calls)
+
+
+def test_progress_printer_clear(assert_click_echo_calls):
+    with patch("ghsearch.terminal.sys") as mock_sys:
+        mock_sys.stdout.isatty.return_value = True
+
+        progress_printer = ProgressPrinter()
+        with progress_printer as printer:
+            printer("Hello!")
+            progress_printer.clear()
+            progress_printer.clear()
+
+    assert_click_echo_calls(
+        call("\r\033[?25lHello!", nl=False),
+        call("\r\033[?25l      ", nl=False),
+        call("\r", nl=False),
+        call("\r\033[?25l", nl=False),
+        call("\r\033[?25h", nl=False),
+    )
@@ -0,0 +1,130 @@
+from io import StringIO
+from unittest.mock import Mock, PropertyMock
+
+import pytest
+
+from ghsearch.filters import ContentFilter, PathFilter
+from ghsearch.printers.structured import JsonLinesPrinter
+from ghsearch.results import get_change
+from ghsearch.watch import RememberedContentFilter, RemovedResult, WatchState, state_key
+
+from . import build_mock_content_file
+
+
+def _run(state, results, filters):
+    filters = state.remember(filters)
+    matched = [result for result in results if all(f(result) for f in filters)]
+    changes = list(state.changes(matched))
+    state.save()
+    return changes
+
+
+@pytest.fixture
+def state_path(tmp_path):
+    return str(tmp_path / "state" / "query.json")
+
+
+def test_state_key():
+    assert state_key(["a"], None, ("b",)) == state_key(("a",), None, ["b"])
+    assert state_key(["a"], None, ("b",)) != state_key(["a"], None, ("c",))
+
+
+def test_remember_wraps_content_filters(state_path):
+    path_filter, content_filter = PathFilter("src"), ContentFilter("foo")
+    filters = WatchState(state_path, "key").remember([path_filter, content_filter])
+
+    assert filters[0] is path_filter
+    assert isinstance(filters[1], RememberedContentFilter)
+    assert filters[1].cost == content_filter.cost
+
+
+def test_first_run_reports_all_results_as_added(state_path):
+    result = build_mock_content_file("org/repo", "a.txt", decoded_content=b"foo", sha="1")
+    changes = _run(WatchState(state_path, "key"), [result], [ContentFilter("foo")])
+
+    assert changes == [result]
+    assert get_change(result) == "added"
+
+
+def test_rerun_reports_changes_and_reuses_unchanged_verdicts(state_path):
+    unchanged = build_mock_content_file("org/repo", "unchanged.txt", decoded_content=b"foo", sha="1")
+    changed = build_mock_content_file("org/repo", "changed.txt", decoded_content=b"foo", sha="2")
+    removed = build_mock_content_file("org/repo", "removed.txt", decoded_content=b"foo", sha="3")
+    not_matching = build_mock_content_file("org/repo", "other.txt", decoded_content=b"bar", sha="4")
+    _run(WatchState(state_path, "key"), [unchanged, changed, removed, not_matching], [ContentFilter("foo")])
+
+    unchanged = build_mock_content_file("org/repo", "unchanged.txt", decoded_content=Mock(), sha="1")
+    changed = build_mock_content_file("org/repo", "changed.txt", decoded_content=b"more foo", sha="5")
+    removed = build_mock_content_file("org/repo", "removed.txt", decoded_content=b"gone", sha="6")
+    not_matching = build_mock_content_file("org/repo", "other.txt", decoded_content=Mock(), sha="4")
+    added = build_mock_content_file("org/repo", "added.txt", decoded_content=b"foo", sha="7")
+    state = WatchState(state_path, "key")
+    changes = _run(state, [unchanged, changed, removed, not_matching, added], [ContentFilter("foo")])
+
+    assert state.reused == 2
+    assert [(result.path, get_change(result)) for result in changes] == [
+        ("changed.txt", "changed"),
+        ("added.txt", "added"),
+        ("removed.txt", "removed"),
+    ]
+    assert changes[2] == RemovedResult(
+        changes[2].repository,
+        "removed.txt",
+        "removed.txt",
+        "3",
+        3,
+        "https://www.github.com/org/repo/blob/master/removed.txt",
+    )
+    assert changes[2].repository.full_name == "org/repo"
+    assert changes[2].repository.owner.login == "org"
+
+
+def test_rerun_without_changes(state_path):
+    result = build_mock_content_file("org/repo", "a.txt", decoded_content=b"foo", sha="1")
+    _run(WatchState(state_path, "key"), [result], [ContentFilter("foo")])
+
+    assert _run(WatchState(state_path, "key"), [result], [ContentFilter("foo")]) == []
+
+
+def test_rerun_does_not_look_up_sizes(state_path):
+    result = build_mock_content_file("org/repo", "a.txt", decoded_content=b"foo", sha="1")
+    type(result).size = PropertyMock(side_effect=AssertionError("looking up the size downloads the file"))
+    _run(WatchState(state_path, "key"), [result], [ContentFilter("foo")])
+    _run(WatchState(state_path, "key"), [result], [PathFilter("a.txt")])
+
+    state = WatchState(state_path, "key")
+    assert [get_change(removed) for removed in _run(state, [], [])] == ["removed"]
+    assert state._previous_matches["org/repo/a.txt"]["size"] == 3
+
+
+def test_removed_results_without_size_can_be_printed(state_path):
+    result = build_mock_content_file("org/repo", "a.txt", sha="1")
+    _run(WatchState(state_path, "key"), [result], [PathFilter("a.txt")])
+
+    [removed] = _run(WatchState(state_path, "key"), [], [])
+    stream = StringIO()
+    JsonLinesPrinter(stream).print(["query"], [removed])
+
+    assert '"size": null' in stream.getvalue()
+
+
+def test_incomplete_run_keeps_the_previous_matches_it_did_not_get_to(state_path):
+    first = build_mock_content_file("org/repo", "a.txt", decoded_content=b"foo", sha="1")
+    second = build_mock_content_file("org/repo", "b.txt", decoded_content=b"foo", sha="2")
+    _run(WatchState(state_path, "key"), [first, second], [ContentFilter("foo")])
+
+    state = WatchState(state_path, "key")
+    changes = list(state.changes([first], complete=lambda: False))
+    state.save()
+
+    assert changes == []
+    assert _run(WatchState(state_path, "key"), [first, second], [ContentFilter("foo")]) == []
+
+
+def test_state_of_other_query_is_not_reused(state_path):
+    result = build_mock_content_file("org/repo", "a.txt", decoded_content=b"foo", sha="1")
+    _run(WatchState(state_path, "key"), [result], [ContentFilter("foo")])
+
+    state = WatchState(state_path, "other key")
+    assert _run(state, [result], [ContentFilter("foo")]) == [result]
+    assert state.reused == 0